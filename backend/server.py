@@ -1,40 +1,234 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Query, Request, Response, WebSocket, WebSocketDisconnect
+from fastapi.encoders import jsonable_encoder
+from fastapi.responses import JSONResponse, StreamingResponse
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
-from motor.motor_asyncio import AsyncIOMotorClient
+from motor.motor_asyncio import AsyncIOMotorClient, AsyncIOMotorGridFSBucket
+from pymongo import (
+    ASCENDING, DESCENDING, GEOSPHERE, IndexModel, InsertOne, ReadPreference, ReplaceOne, ReturnDocument,
+    UpdateMany, UpdateOne, WriteConcern,
+)
+from pymongo.monitoring import ConnectionPoolListener
+from pymongo.errors import BulkWriteError, DuplicateKeyError, OperationFailure
+from gridfs.errors import NoFile
+from PIL import Image, ImageOps, UnidentifiedImageError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, ValidationError, field_validator
+from typing import List, Literal, Optional
 import uuid
+import json
+import time
+import base64
+import asyncio
+import threading
+import hashlib
+import re
+import csv
+import io
+import zlib
+from collections import OrderedDict, defaultdict, deque
+from contextlib import asynccontextmanager
 from datetime import datetime, timezone, timedelta
 import random
+import httpx
+import numpy as np
 from emergentintegrations.llm.chat import LlmChat, UserMessage
 
+try:
+    import msgpack
+except ImportError:  # msgpack telemetry payloads are optional
+    msgpack = None
+
+try:
+    import orjson
+except ImportError:  # list responses fall back to the standard json encoder
+    orjson = None
+
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# MongoDB connection, opened and closed by the app lifespan.
+# Pools are per process: size MONGO_MAX_POOL_SIZE × uvicorn workers against the server's limits.
+MONGO_MAX_POOL_SIZE = int(os.environ.get('MONGO_MAX_POOL_SIZE', 100))
+MONGO_MIN_POOL_SIZE = int(os.environ.get('MONGO_MIN_POOL_SIZE', 0))
+# Fail an operation that waits longer than this for a pooled connection (unset: wait forever)
+MONGO_WAIT_QUEUE_TIMEOUT_MS = os.environ.get('MONGO_WAIT_QUEUE_TIMEOUT_MS')
+MONGO_POOL_WAIT_SAMPLES = 1000  # recent checkouts kept for /api/health/db
+READ_PREFERENCES = {
+    "primary": ReadPreference.PRIMARY,
+    "primaryPreferred": ReadPreference.PRIMARY_PREFERRED,
+    "secondary": ReadPreference.SECONDARY,
+    "secondaryPreferred": ReadPreference.SECONDARY_PREFERRED,
+    "nearest": ReadPreference.NEAREST,
+}
+
+def parse_write_concern(value: str) -> WriteConcern:
+    return WriteConcern(w=int(value) if value.isdigit() else value)
+
+# Read preference / write concern per route class, applied through route_db():
+# analytics reads tolerate replica lag, telemetry writes favour throughput and
+# tickets/deployments/assets wait for a majority.
+MONGO_ROUTE_CLASSES = {
+    "analytics": {"read_preference": READ_PREFERENCES[os.environ.get('MONGO_ANALYTICS_READ_PREFERENCE', 'secondaryPreferred')]},
+    "telemetry": {"write_concern": parse_write_concern(os.environ.get('MONGO_TELEMETRY_WRITE_CONCERN', '1'))},
+    "critical": {"write_concern": parse_write_concern(os.environ.get('MONGO_CRITICAL_WRITE_CONCERN', 'majority'))},
+}
+
+class PoolMonitor(ConnectionPoolListener):
+    """Connection pool counters for /api/health/db.
+
+    pymongo publishes checkout events from the thread running the operation,
+    so a checkout's wait is the time between its started and checked-out
+    events on that thread.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self.open_connections = 0
+        self.in_use = 0
+        self.checkouts = 0
+        self.checkout_failures = defaultdict(int)
+        self.pool_clears = 0
+        self.waits_ms = deque(maxlen=MONGO_POOL_WAIT_SAMPLES)
+
+    def connection_check_out_started(self, event):
+        self._local.started = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        started = getattr(self._local, "started", None)
+        with self._lock:
+            self.in_use += 1
+            self.checkouts += 1
+            if started is not None:
+                self.waits_ms.append((time.perf_counter() - started) * 1000)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.checkout_failures[event.reason] += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.in_use -= 1
+
+    def connection_created(self, event):
+        with self._lock:
+            self.open_connections += 1
+
+    def connection_closed(self, event):
+        with self._lock:
+            self.open_connections -= 1
+
+    def pool_cleared(self, event):
+        with self._lock:
+            self.pool_clears += 1
+
+    def connection_ready(self, event):
+        pass
 
-app = FastAPI()
+    def pool_created(self, event):
+        pass
+
+    def pool_ready(self, event):
+        pass
+
+    def pool_closed(self, event):
+        pass
+
+    def stats(self) -> dict:
+        with self._lock:
+            waits = sorted(self.waits_ms)
+            return {
+                "open_connections": self.open_connections,
+                "in_use": self.in_use,
+                "checkouts": self.checkouts,
+                "checkout_failures": dict(self.checkout_failures),
+                "pool_clears": self.pool_clears,
+                "wait_ms_mean": round(sum(waits) / len(waits), 3) if waits else 0.0,
+                "wait_ms_p95": round(waits[int(0.95 * (len(waits) - 1))], 3) if waits else 0.0,
+                "wait_ms_max": round(waits[-1], 3) if waits else 0.0,
+            }
+
+pool_monitor = PoolMonitor()
+client: Optional[AsyncIOMotorClient] = None
+db = None
+_route_dbs = {}
+
+def connect_database():
+    global client, db
+    options = {"maxPoolSize": MONGO_MAX_POOL_SIZE, "minPoolSize": MONGO_MIN_POOL_SIZE}
+    if MONGO_WAIT_QUEUE_TIMEOUT_MS:
+        options["waitQueueTimeoutMS"] = int(MONGO_WAIT_QUEUE_TIMEOUT_MS)
+    client = AsyncIOMotorClient(os.environ['MONGO_URL'], tz_aware=True, event_listeners=[pool_monitor], **options)
+    db = client[os.environ['DB_NAME']]
+
+def route_db(route_class: str):
+    """`db` with the read preference and write concern of a route class"""
+    view = _route_dbs.get(route_class)
+    if view is None or view[0] is not db:
+        view = _route_dbs[route_class] = (db, db.with_options(**MONGO_ROUTE_CLASSES[route_class]))
+    return view[1]
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Own the Mongo client and the background services for the life of the app"""
+    connect_database()
+    await start_services()
+    try:
+        yield
+    finally:
+        await stop_services()
+        client.close()
+
+app = FastAPI(lifespan=lifespan)
 api_router = APIRouter(prefix="/api")
 
 # =================== MODELS ===================
 
+def check_iso_date(value: Optional[str]) -> str:
+    """Reject installation dates the maintenance scoring could not parse"""
+    if value is None:
+        raise ValueError("installation_date cannot be cleared")
+    datetime.fromisoformat(value)  # the ValueError is reported as a 422
+    return value
+
 class BalanceDevice(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     type: str  # "BMS_ASISTIDA", "AUTOSERVICIO", "IA"
     status: str = "online"  # online, offline, maintenance
     firmware_version: str = "v2.3.1"
-    last_calibration: str
+    last_calibration: datetime  # stored as a BSON date so calibration windows can use an index
     installation_date: str
     avg_consumption: float  # kWh per day
     label_status: str = "good"  # good, warning, replace
     printhead_life: int  # percentage
+    last_seen: Optional[datetime] = None  # last telemetry report
+    weight_total_kg: float = 0  # kg weighed, accumulated from telemetry
+    updated_at: Optional[datetime] = None  # last write to the device, for incremental exports
+    
+    _check_installation_date = field_validator("installation_date")(check_iso_date)
+
+class Device(BalanceDevice):
+    """A device as stored in the `devices` collection"""
+    store_id: str
+
+class StoreRollup(BaseModel):
+    total: int = 0
+    online: int = 0
+    offline: int = 0
+    maintenance: int = 0
+    problematic: int = 0  # offline/maintenance or labels to replace
+    consumption_sum: float = 0  # kWh per day
+    min_printhead_life: Optional[int] = None
+    labels_to_replace: int = 0
+    oldest_calibration: Optional[datetime] = None
+    types: List[str] = []  # device types present in the store
+
+class GeoPoint(BaseModel):
+    type: str = "Point"
+    coordinates: List[float]  # [longitude, latitude]
 
 class Store(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -52,7 +246,74 @@ class Store(BaseModel):
     network_status: str = "connected"
     latency: int  # ms
     sales_level: str = "high"  # high, medium, low
-    devices: List[BalanceDevice] = []
+    devices: List[BalanceDevice] = []  # served from the `devices` collection
+    rollup: Optional[StoreRollup] = None
+    location: Optional[GeoPoint] = None
+    updated_at: Optional[datetime] = None  # last write to the store, for incremental exports
+
+class StoreMarker(BaseModel):
+    id: str
+    name: str
+    comuna: str
+    sap_code: str
+    latitude: float
+    longitude: float
+    status: str
+    sales_level: str = "high"
+    balances_bms: int
+    balances_autoservicio: int
+    balances_ia: int
+    distance_m: Optional[float] = None
+
+class StoreCluster(BaseModel):
+    latitude: float
+    longitude: float
+    count: int
+    online: int
+    partial: int
+    offline: int
+    store: Optional[StoreMarker] = None  # set when the cluster holds a single store
+
+class StoreClusters(BaseModel):
+    total: int
+    clusters: List[StoreCluster]
+
+class DeviceUpdate(BaseModel):
+    status: Optional[str] = None
+    firmware_version: Optional[str] = None
+    last_calibration: Optional[datetime] = None
+    installation_date: Optional[str] = None
+    avg_consumption: Optional[float] = None
+    label_status: Optional[str] = None
+    printhead_life: Optional[int] = None
+    
+    _check_installation_date = field_validator("installation_date")(check_iso_date)
+
+class TelemetryReading(BaseModel):
+    store_id: str
+    device_id: str
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    status: Optional[str] = None
+    firmware_version: Optional[str] = None
+    avg_consumption: Optional[float] = None
+    label_status: Optional[str] = None
+    printhead_life: Optional[int] = None
+    weight_kg: Optional[float] = None  # kg weighed since the previous reading
+    product: Optional[str] = None  # product weighed, recorded as weight history
+    amount: Optional[float] = None  # label total in CLP of that weighing
+    reading_id: Optional[str] = None  # device id of that weighing, makes retried batches idempotent
+    labels_printed: Optional[int] = None  # labels printed since the previous reading
+
+class TelemetryItemResult(BaseModel):
+    index: int
+    accepted: bool
+    error: Optional[str] = None
+
+class TelemetryBatchResult(BaseModel):
+    accepted: int
+    rejected: int
+    stores_updated: int
+    items: List[TelemetryItemResult]
 
 class Campaign(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
@@ -65,15 +326,76 @@ class Campaign(BaseModel):
     total_balances: int = 0
     stores_applied: List[str] = []
 
+class DeploymentCreate(BaseModel):
+    kind: Literal["campaign", "self_service_flow"]
+    campaign_id: Optional[str] = None  # required for campaigns
+    package: Optional[dict] = None  # self-service flow definition
+    store_ids: Optional[List[str]] = None  # every store when omitted
+    device_types: Optional[List[str]] = None  # every device type when omitted
+
+class DeploymentStore(BaseModel):
+    store_id: str
+    store_name: str
+    device_count: int
+    status: str = "pending"  # pending, deployed, failed
+    attempts: int = 0
+    deployed_devices: int = 0
+    bytes_sent: int = 0  # asset bytes the store did not have yet
+    error: Optional[str] = None
+    finished_at: Optional[datetime] = None
+
+class Deployment(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    kind: str  # campaign, self_service_flow
+    campaign_id: Optional[str] = None
+    package: Optional[dict] = None
+    package_hash: str
+    assets: List[str] = []  # SHA-256 of the assets referenced by the package
+    package_bytes: int = 0  # total size of those assets
+    device_types: Optional[List[str]] = None
+    status: str = "queued"  # queued, running, completed, partial, cancelled, failed
+    error: Optional[str] = None  # why a deployment failed
+    total_stores: int
+    total_balances: int
+    deployed_stores: int = 0
+    failed_stores: int = 0
+    deployed_count: int = 0  # devices that received the package
+    bytes_sent: int = 0
+    stores: List[DeploymentStore] = []
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+
+class Asset(BaseModel):
+    sha256: str  # of the stored display rendition
+    url: str
+    content_type: str
+    size: int
+    width: int
+    height: int
+    source_sha256: List[str] = []  # uploads that produced this rendition
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class AssetUpload(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    chunk_size: int
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+
+class AssetUploadComplete(BaseModel):
+    sha256: Optional[str] = None  # of the uploaded bytes, verified when given
+
 class Alert(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     store_id: str
     store_name: str
-    type: str  # calibration, maintenance, firmware
+    type: str  # calibration, maintenance, firmware, network, fraud
     message: str
     priority: str  # high, medium, low
     created_at: str
     resolved: bool = False
+    rule: Optional[str] = None  # set on alerts raised by the rules engine
+    device_id: Optional[str] = None
+    updated_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))  # polled by the stream
 
 class Metrics(BaseModel):
     total_kg_today: float
@@ -84,11 +406,206 @@ class Metrics(BaseModel):
     stores_partial: int
     stores_offline: int
 
+class ComponentWear(BaseModel):
+    printHead: float
+    loadCell: float
+    display: float
+    keyboard: float
+    printer: float
+
+class MaintenanceScore(BaseModel):
+    """Materialized predictive maintenance score of one device"""
+    device_id: str
+    store_id: str
+    store_name: str
+    comuna: str
+    device_type: str
+    status: str
+    maintenance_risk: float  # 0-100
+    priority: str  # high, medium, low
+    next_maintenance_date: datetime
+    days_until_maintenance: int
+    last_calibration: datetime
+    days_since_calibration: int
+    age_months: int
+    daily_consumption: float  # kWh per day
+    monthly_transactions: int  # weighings reported in the last 30 days
+    components: ComponentWear  # wear percentage per component
+    estimated_cost: int  # CLP
+    computed_at: datetime
+
+class MaintenanceSummary(BaseModel):
+    total: int
+    high: int
+    medium: int
+    low: int
+    avg_risk: float
+    total_estimated_cost: int
+    overdue_calibrations: int
+
+class ObsolescenceRecord(BaseModel):
+    """Materialized obsolescence score and replacement plan of one device"""
+    device_id: str
+    store_id: str
+    store_name: str
+    comuna: str
+    device_type: str
+    provider: str
+    firmware_version: str
+    firmware_outdated: bool  # behind the newest version in the fleet
+    installation_date: str
+    age_years: float
+    warranty_expired: bool
+    monthly_failures: float  # tickets per month over the failure window
+    downtime_hours: float  # per month over the failure window
+    last_failure: Optional[str] = None
+    last_calibration: datetime
+    obsolescence_score: float  # 0-100
+    priority: str  # high, medium, low
+    needs_attention: bool
+    replacement_cost: int  # CLP
+    computed_at: datetime
+
+class ObsolescenceGroup(BaseModel):
+    key: str
+    devices: int
+    warranty_expired: int
+    replacement_cost: int
+
+class ObsolescenceSummary(BaseModel):
+    devices: int
+    warranty_expired: int
+    replacement_cost: int
+    by_priority: List[ObsolescenceGroup]
+    by_provider: List[ObsolescenceGroup]
+    by_device_type: List[ObsolescenceGroup]
+
+class SustainabilityTotals(BaseModel):
+    stores: int
+    devices: int
+    energy_kwh_day: float
+    paper_meters_day: float
+    paper_rolls_day: int
+    carbon_kg_month: float  # kg CO2
+    avg_score: float  # 0-100, higher is better
+
+class SustainabilityComuna(SustainabilityTotals):
+    comuna: str
+
+class SustainabilityTypeTotals(BaseModel):
+    device_type: str
+    devices: int
+    energy_kwh_day: float
+
+class SustainabilityStore(BaseModel):
+    store_id: str
+    name: str
+    comuna: str
+    devices: int
+    self_service_devices: int
+    energy_kwh_day: float
+    paper_meters_day: float
+    paper_rolls_day: int
+    carbon_kg_month: float
+    score: float
+    category: str  # green, orange, red
+
+class SustainabilityCategories(BaseModel):
+    green: int
+    orange: int
+    red: int
+
+class SustainabilityReport(BaseModel):
+    totals: SustainabilityTotals
+    categories: SustainabilityCategories
+    by_type: List[SustainabilityTypeTotals]
+    by_comuna: List[SustainabilityComuna]  # highest footprint first
+    top_consumers: List[SustainabilityStore]  # highest energy first
+    most_sustainable: List[SustainabilityStore]
+    needs_attention: List[SustainabilityStore]  # red stores, lowest score first
+
+class SupplySku(BaseModel):
+    sku: str
+    name: str
+    vendor: str
+    quality: str
+    roll_dimensions: str
+    meters_per_roll: int
+    units_per_box: int
+    cost_per_roll: int  # CLP
+
+class SupplyLine(BaseModel):
+    """Thermal paper stock of one SKU at a store or warehouse, with its cached depletion forecast"""
+    id: str  # "<location_id>:<sku>"
+    location_type: str  # store, warehouse
+    location_id: str
+    location_name: str
+    sku: str
+    rolls: float  # on hand
+    min_rolls: float  # reorder point
+    daily_rolls: float = 0  # mean forecast demand over the next SUPPLY_FORECAST_WINDOW days
+    days_left: int = 0  # until the stock runs out, SUPPLY_FORECAST_DAYS when beyond the horizon
+    depletion_date: Optional[datetime] = None
+    reorder_date: Optional[datetime] = None  # when the stock falls under min_rolls
+    forecast_source: Optional[str] = None  # history, fleet_estimate
+    created_at: datetime
+    updated_at: Optional[datetime] = None
+    computed_at: Optional[datetime] = None
+
+class SupplyMovement(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    line_id: str
+    location_id: str
+    sku: str
+    kind: str  # receipt, transfer_out, transfer_in, consumption, adjustment
+    rolls: float  # signed
+    timestamp: datetime
+    reference: Optional[str] = None  # purchase order, dispatch guide...
+
+class SupplyMovementCreate(BaseModel):
+    kind: Literal["receipt", "transfer", "adjustment"]
+    location_id: str  # the warehouse for receipts, the destination store for transfers
+    sku: str
+    rolls: float
+    reference: Optional[str] = None
+
+class SupplySummary(BaseModel):
+    catalog: List[SupplySku]
+    warehouse: List[SupplyLine]
+    stores: int
+    store_rolls: float
+    store_daily_rolls: float  # forecast chain-wide demand
+    stores_below_min: int
+    stores_depleting_soon: int  # within SUPPLY_ALERT_DAYS
+    next_peak: str
+    days_to_next_peak: int
+
 class WeightData(BaseModel):
     product: str
     weights: List[float]
     dates: List[str]
 
+class WeightReading(BaseModel):
+    store_id: str
+    device_id: str
+    product: str
+    weight_kg: float
+    amount: Optional[float] = None  # label total in CLP
+    timestamp: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    reading_id: Optional[str] = None  # unique per device; derived from the reading when absent
+
+class SalesRow(BaseModel):
+    # Grouping keys; only those in `group_by` are set
+    store_id: Optional[str] = None
+    product: Optional[str] = None
+    device_type: Optional[str] = None
+    period: Optional[datetime] = None
+    transactions: int
+    kg: float
+    amount: float  # CLP
+    avg_ticket: float
+    kg_per_transaction: float
+
 class AIPrediction(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     title: str
@@ -110,9 +627,196 @@ class Ticket(BaseModel):
     status: str = "Pendiente"  # Pendiente, En Proceso, Resuelto
     created_at: str = Field(default_factory=lambda: datetime.now(timezone.utc).isoformat())
     assigned_to: Optional[str] = None
+    started_at: Optional[str] = None  # set on the move to "En Proceso"
+    resolved_at: Optional[str] = None
+    resolution_hours: Optional[float] = None  # created_at → resolved_at
+    updated_at: Optional[datetime] = None  # last write to the ticket, for incremental exports
+
+class TicketCreate(BaseModel):
+    device_id: str
+    store_name: str
+    store_comuna: str
+    store_address: str
+    sap_code: str
+    issue: str
+    description: str
+    reported_to: str
+    assigned_to: Optional[str] = None
+
+class TicketUpdate(BaseModel):
+    status: Optional[Literal["Pendiente", "En Proceso", "Resuelto"]] = None
+    assigned_to: Optional[str] = None
+
+class TicketSlaGroup(BaseModel):
+    key: str
+    total: int
+    pending: int
+    in_progress: int
+    resolved: int
+    backlog: int  # not yet resolved
+    mean_hours_to_resolve: Optional[float] = None
+
+class TicketSla(BaseModel):
+    by_provider: List[TicketSlaGroup]
+    by_comuna: List[TicketSlaGroup]
 
 # =================== INITIAL DATA GENERATION ===================
 
+CALIBRATION_WINDOW_DAYS = 90
+STORE_PAGE_MAX = 1000
+EXPORT_BATCH_SIZE = int(os.environ.get('EXPORT_BATCH_SIZE', 500))
+# Debug: validate every list response document through its Pydantic model
+RESPONSE_VALIDATION = os.environ.get('RESPONSE_VALIDATION', 'false').lower() == 'true'
+DEVICE_PAGE_DEFAULT = 100
+DEVICE_PAGE_MAX = 1000
+TICKET_PAGE_DEFAULT = 100
+TICKET_PAGE_MAX = 1000
+# Allowed ticket status moves and the timestamp each one records
+TICKET_TRANSITIONS = {
+    ("Pendiente", "En Proceso"): "started_at",
+    ("En Proceso", "Resuelto"): "resolved_at",
+}
+GEO_MAX_RADIUS_M = 200_000
+GEO_RESULT_MAX = 1000
+CLUSTER_CELLS_PER_TILE = 4  # grid cells per 256px map tile edge
+MARKER_PROJECTION = {"_id": 0, **{field: 1 for field in StoreMarker.model_fields if field != "distance_m"}}
+STREAM_MODE = os.environ.get('STREAM_MODE', 'auto')  # auto, change_stream, poll
+STREAM_POLL_INTERVAL = float(os.environ.get('STREAM_POLL_INTERVAL', 5))
+STREAM_QUEUE_SIZE = int(os.environ.get('STREAM_QUEUE_SIZE', 256))
+STREAM_MAX_RESYNCS = int(os.environ.get('STREAM_MAX_RESYNCS', 5))
+STREAM_KEEPALIVE = 15
+STREAM_RETRY_MAX = 60  # seconds, cap of the change stream restart backoff
+STREAM_TOPICS = ("stores", "alerts", "tickets", "deployments")
+STREAM_WATCHED_COLLECTIONS = ("stores", "devices", "alerts", "tickets")
+STREAM_DEVICE_FIELDS = ("status", "label_status", "printhead_life", "firmware_version", "avg_consumption")
+TELEMETRY_BATCH_MAX = int(os.environ.get('TELEMETRY_BATCH_MAX', 20000))
+WEIGHT_MAX_BUCKETS = 1000
+WEIGHT_DEFAULT_PRODUCTS = 3
+WEIGHT_READINGS_RETENTION_DAYS = os.environ.get('WEIGHT_READINGS_RETENTION_DAYS')
+# How long folded reading ids are remembered to drop retried batches
+WEIGHT_READING_DEDUP_TTL = int(os.environ.get('WEIGHT_READING_DEDUP_TTL', 7 * 24 * 3600))
+# Fraud detection over the weighings of self-service scales
+FRAUD_DEVICE_TYPES = ("AUTOSERVICIO", "IA")
+FRAUD_WINDOW = 128  # weighings kept per device
+FRAUD_BIN_GRAMS = 4
+FRAUD_MAX_GRAMS = 2000  # heavier weighings share one overflow bin
+FRAUD_MATCH_GRAMS = 3  # tolerance when matching a reference item
+FRAUD_REPEAT_MIN = int(os.environ.get('FRAUD_REPEAT_MIN', 12))
+FRAUD_MISMATCH_MIN = int(os.environ.get('FRAUD_MISMATCH_MIN', 6))
+FRAUD_MAX_DEVICES = int(os.environ.get('FRAUD_MAX_DEVICES', 20000))
+# Packaged items passed off as produce: (name, grams)
+FRAUD_REFERENCE_ITEMS = [
+    ("Lata de bebida", 335), ("Botella de agua", 520), ("Chocolate", 50), ("Chicle", 15),
+    ("Lata de conserva", 185), ("Yogurt", 125), ("Galletas", 200), ("Jabón", 90),
+]
+# Sales cubes (store × product × device type) per bucket
+SALES_CUBES = {"hour": "sales_hourly", "day": "sales_daily"}
+SALES_GROUP_FIELDS = ("store_id", "product", "device_type", "period")
+SALES_DEFAULT_DAYS = 30
+SALES_ROWS_MAX = 5000
+BUCKET_STEPS = {"hour": timedelta(hours=1), "day": timedelta(days=1), "week": timedelta(weeks=1)}
+TELEMETRY_DEVICE_FIELDS = ["status", "firmware_version", "avg_consumption", "label_status", "printhead_life"]
+
+# Assets (content-addressed by the SHA-256 of the stored rendition)
+ASSET_CHUNK_SIZE = 4 * 1024 * 1024
+ASSET_MAX_BYTES = int(os.environ.get('ASSET_MAX_BYTES', 50 * 1024 * 1024))
+ASSET_DISPLAY_SIZE = tuple(int(v) for v in os.environ.get('ASSET_DISPLAY_SIZE', '800x480').split('x'))
+ASSET_DISPLAY_FORMAT = os.environ.get('ASSET_DISPLAY_FORMAT', 'JPEG').upper()
+ASSET_UPLOAD_TTL = 24 * 3600
+ASSET_URL_RE = re.compile(r"/api/assets/([0-9a-f]{64})")
+ASSET_STREAM_CHUNK = 255 * 1024
+
+# Deployments
+DEPLOYMENT_CONCURRENCY = int(os.environ.get('DEPLOYMENT_CONCURRENCY', 32))
+DEPLOYMENT_STORE_TIMEOUT = float(os.environ.get('DEPLOYMENT_STORE_TIMEOUT', 30))
+DEPLOYMENT_MAX_ATTEMPTS = int(os.environ.get('DEPLOYMENT_MAX_ATTEMPTS', 3))
+DEPLOYMENT_RETRY_BACKOFF = float(os.environ.get('DEPLOYMENT_RETRY_BACKOFF', 1))
+DEPLOYMENT_PROGRESS_INTERVAL = 0.5  # seconds between progress events per deployment
+DEPLOYMENT_LEASE_SECONDS = float(os.environ.get('DEPLOYMENT_LEASE_SECONDS', 60))  # a worker's claim on a deployment
+DEPLOYMENT_PACKAGE_MAX_BYTES = 12 * 1024 * 1024
+# Store gateway receiving the packages; without one, deliveries are recorded on the devices only
+DEPLOYMENT_GATEWAY_URL = os.environ.get('DEPLOYMENT_GATEWAY_URL')
+DEPLOYMENT_SUMMARY_PROJECTION = {"_id": 0, "stores": 0, "package": 0}
+
+# Predictive maintenance scoring
+MAINTENANCE_REFRESH_INTERVAL = int(os.environ.get('MAINTENANCE_REFRESH_INTERVAL', 6 * 3600))
+MAINTENANCE_PAGE_DEFAULT = 50
+MAINTENANCE_PAGE_MAX = 1000
+MAINTENANCE_MAX_CONSUMPTION = 2.5  # kWh per day at full duty cycle
+MAINTENANCE_MONTHLY_TRANSACTIONS = 4000  # weighings per month at full load
+MAINTENANCE_LIFETIME_MONTHS = 60
+# Wear of each component reaches 100% after this many transaction-months
+COMPONENT_WEAR_LOAD = {"loadCell": 100_000, "keyboard": 75_000, "printer": 80_000}
+
+# Obsolescence and replacement planning
+OBSOLESCENCE_REFRESH_INTERVAL = int(os.environ.get('OBSOLESCENCE_REFRESH_INTERVAL', 6 * 3600))
+OBSOLESCENCE_PAGE_DEFAULT = 50
+OBSOLESCENCE_PAGE_MAX = 1000
+OBSOLESCENCE_FAILURE_WINDOW_DAYS = 90  # ticket history counted as failures
+OBSOLESCENCE_MAX_DOWNTIME_HOURS = 48  # per month
+OBSOLESCENCE_WARRANTY_YEARS = 3
+OBSOLESCENCE_LIFETIME_YEARS = 5
+OBSOLESCENCE_CUBE_FIELDS = ("provider", "device_type", "priority", "needs_attention")
+DEVICE_PROVIDERS = {"IA": "Allcom IA Systems", "AUTOSERVICIO": "Balanzas Chile S.A.", "BMS_ASISTIDA": "Sistemas Integrados"}
+DEVICE_REPLACEMENT_COST = {"IA": 850_000, "AUTOSERVICIO": 650_000, "BMS_ASISTIDA": 450_000}  # CLP
+
+# Sustainability estimates
+SUSTAINABILITY_PAPER_METERS_PER_DAY = 300  # thermal paper printed by a self-service scale
+SUSTAINABILITY_ROLL_METERS = 80
+SUSTAINABILITY_CO2_PER_KWH = 0.5  # kg, grid emission factor
+SUSTAINABILITY_CO2_PER_PAPER_METER = 0.004  # kg
+SUSTAINABILITY_CO2_CEILING = 100  # kg CO2 per device and month that scores 0
+SUSTAINABILITY_TOP_DEFAULT = 10
+SUSTAINABILITY_TOP_MAX = 100
+
+# Thermal paper supplies
+SUPPLY_CATALOG = {
+    "premium": {"name": "Papel Térmico Premium", "vendor": "Papelera Nacional S.A.", "quality": "Premium 80gsm",
+                "roll_dimensions": "80mm x 80m", "meters_per_roll": 80, "units_per_box": 50, "cost_per_roll": 2500},
+    "standard": {"name": "Papel Térmico Estándar", "vendor": "Distribuidora Sur", "quality": "Estándar 55gsm",
+                 "roll_dimensions": "80mm x 60m", "meters_per_roll": 60, "units_per_box": 60, "cost_per_roll": 1800},
+}
+SUPPLY_STORE_SKU = "premium"  # stocked by the stores
+SUPPLY_WAREHOUSE = {"id": "CD-SANTIAGO", "name": "Centro de Distribución Santiago"}  # replenishes every store
+SUPPLY_SEED_WAREHOUSE_STOCK = {"premium": (15000, 5000), "standard": (8000, 3000)}  # (rolls, min rolls)
+SUPPLY_STORE_MIN_DAYS = 5  # seeded store reorder point, in days of demand
+SUPPLY_LABEL_METERS = 0.06  # thermal paper per printed label
+SUPPLY_HISTORY_DAYS = 56
+SUPPLY_MIN_HISTORY_DAYS = 7  # below this the fleet estimate is used
+SUPPLY_FORECAST_DAYS = 90
+SUPPLY_FORECAST_WINDOW = 30  # days averaged into daily_rolls
+SUPPLY_SMOOTHING = 0.2  # exponential smoothing of the demand level
+SUPPLY_WEEKDAY_SHRINKAGE = 2  # weeks of flat profile mixed into each weekday factor
+SUPPLY_ALERT_DAYS = 7
+SUPPLY_REFRESH_INTERVAL = int(os.environ.get('SUPPLY_REFRESH_INTERVAL', 3600))
+SUPPLY_PAGE_DEFAULT = 100
+SUPPLY_PAGE_MAX = 1000
+# Seasonal demand peaks: (name, month, first day, last day, demand multiplier)
+SUPPLY_SEASONAL_PEAKS = [
+    ("Fiestas Patrias", 9, 14, 20, 1.4),
+    ("Navidad", 12, 15, 31, 1.3),
+]
+
+# Startup: wait (seconds) before retrying a failing database bootstrap, doubled up to the max
+BOOTSTRAP_RETRY_DELAY = 1
+BOOTSTRAP_RETRY_MAX_DELAY = float(os.environ.get('BOOTSTRAP_RETRY_MAX_DELAY', 300))
+
+# Fleet snapshot: full rebuild interval (seconds), catches writes from other workers
+FLEET_SNAPSHOT_MAX_AGE = float(os.environ.get('FLEET_SNAPSHOT_MAX_AGE', 60))
+
+# Alert rules
+ALERT_PRINTHEAD_MIN = int(os.environ.get('ALERT_PRINTHEAD_MIN', 20))  # % of printhead life left
+ALERT_LATENCY_MAX_MS = int(os.environ.get('ALERT_LATENCY_MAX_MS', 150))
+ALERT_SWEEP_INTERVAL = int(os.environ.get('ALERT_SWEEP_INTERVAL', 3600))
+
+# AI predictions cache (seconds)
+AI_PREDICTIONS_TTL = int(os.environ.get('AI_PREDICTIONS_TTL', 3600))
+AI_PREDICTIONS_MAX_STALE = int(os.environ.get('AI_PREDICTIONS_MAX_STALE', 86400))
+AI_PREDICTIONS_ERROR_TTL = int(os.environ.get('AI_PREDICTIONS_ERROR_TTL', 60))
+AI_PREDICTIONS_REFRESH_INTERVAL = int(os.environ.get('AI_PREDICTIONS_REFRESH_INTERVAL', 300))
+AI_PREDICTIONS_SHARE_STEP = 0.05  # offline/problematic shares are rounded to this step in the context
+AI_PREDICTIONS_DAYS_STEP = 5  # and warehouse coverage to this many days
+
 SANTIAGO_COMUNAS = [
     {"name": "Las Condes", "lat": -33.4172, "lon": -70.5838},
     {"name": "Providencia", "lat": -33.4269, "lon": -70.6103},
@@ -156,14 +860,98 @@ SANTIAGO_COMUNAS = [
     {"name": "Melipilla", "lat": -33.6875, "lon": -71.2148}
 ]
 
+def _count_devices(cond: dict) -> dict:
+    return {"$size": {"$filter": {"input": {"$ifNull": ["$devices", []]}, "as": "d", "cond": cond}}}
+
+# Stages computing `rollup` and `status` from a `devices` array joined onto each store.
+# Run on every write that touches devices so read paths never walk the devices.
+STORE_ROLLUP_STAGES = [
+    {"$set": {"rollup": {
+        "total": {"$size": {"$ifNull": ["$devices", []]}},
+        "online": _count_devices({"$eq": ["$$d.status", "online"]}),
+        "offline": _count_devices({"$eq": ["$$d.status", "offline"]}),
+        "maintenance": _count_devices({"$eq": ["$$d.status", "maintenance"]}),
+        "problematic": _count_devices({"$or": [
+            {"$in": ["$$d.status", ["offline", "maintenance"]]},
+            {"$eq": ["$$d.label_status", "replace"]},
+        ]}),
+        "consumption_sum": {"$sum": "$devices.avg_consumption"},
+        "min_printhead_life": {"$min": "$devices.printhead_life"},
+        "labels_to_replace": _count_devices({"$eq": ["$$d.label_status", "replace"]}),
+        "oldest_calibration": {"$min": "$devices.last_calibration"},
+        "types": {"$setUnion": [{"$ifNull": ["$devices.type", []]}]},
+    }}},
+    {"$set": {"status": {"$switch": {
+        "branches": [
+            {"case": {"$eq": ["$rollup.online", "$rollup.total"]}, "then": "online"},
+            {"case": {"$gt": ["$rollup.online", {"$multiply": ["$rollup.total", 0.5]}]}, "then": "partial"},
+        ],
+        "default": "offline",
+    }}}},
+]
+
+async def refresh_store_rollups(query: dict):
+    """Recompute rollups for the stores matching `query` from the devices collection"""
+    pipeline = [
+        {"$match": query},
+        {"$project": {"_id": 0, "id": 1}},
+        {"$lookup": {"from": "devices", "localField": "id", "foreignField": "store_id", "as": "devices"}},
+        *STORE_ROLLUP_STAGES,
+        {"$project": {"id": 1, "rollup": 1, "status": 1}},
+        {"$set": {"updated_at": datetime.now(timezone.utc)}},
+    ]
+    try:
+        await db.stores.aggregate([
+            *pipeline,
+            {"$merge": {"into": "stores", "on": "id", "whenMatched": "merge", "whenNotMatched": "discard"}},
+        ]).to_list(None)
+    except NotImplementedError:
+        # mongomock (benchmark and tests) has no $merge: write the rollups back from the client
+        rows = await db.stores.aggregate(pipeline).to_list(None)
+        if rows:
+            await db.stores.bulk_write([
+                UpdateOne({"id": row["id"]}, {"$set": {key: row[key] for key in ("rollup", "status", "updated_at")}})
+                for row in rows
+            ], ordered=False)
+    await fleet_snapshot.refresh(query)
+
+async def insert_stores(stores: List[dict]):
+    """Insert stores with their nested devices into the stores/devices collections"""
+    now = datetime.now(timezone.utc)
+    devices = [
+        {**device, "store_id": store["id"], "updated_at": now}
+        for store in stores for device in store.get("devices", [])
+    ]
+    await db.stores.insert_many([
+        {**{k: v for k, v in store.items() if k != "devices"}, "updated_at": now} for store in stores
+    ])
+    if devices:
+        await db.devices.insert_many(devices)
+    store_ids = [store["id"] for store in stores]
+    await refresh_store_rollups({"id": {"$in": store_ids}})
+    await sync_store_locations({"id": {"$in": store_ids}})
+    await refresh_maintenance_scores({"store_id": {"$in": store_ids}})
+    await refresh_obsolescence({"store_id": {"$in": store_ids}})
+    await evaluate_alerts({"id": {"$in": store_ids}})
+
+async def attach_devices(stores: List[dict]) -> List[dict]:
+    """Compatibility view: nest each store's devices as in the embedded layout"""
+    by_store = defaultdict(list)
+    projection = {**model_projection(BalanceDevice), "store_id": 1}
+    async for device in db.devices.find({"store_id": {"$in": [s["id"] for s in stores]}}, projection):
+        by_store[device.pop("store_id")].append(device)
+    for store in stores:
+        store["devices"] = by_store.get(store["id"], [])
+    return stores
+
 def generate_device(device_type: str) -> BalanceDevice:
     statuses = ["online"] * 8 + ["offline"] * 1 + ["maintenance"] * 1
     return BalanceDevice(
         type=device_type,
         status=random.choice(statuses),
         firmware_version=random.choice(["v2.3.1", "v2.3.0", "v2.2.5"]),
-        last_calibration=(datetime.now(timezone.utc) - timedelta(days=random.randint(1, 90))).isoformat(),
-        installation_date=(datetime.now(timezone.utc) - timedelta(days=random.randint(180, 1095))).isoformat(),
+        last_calibration=datetime.now(timezone.utc) - timedelta(days=random.randint(1, 90)),
+        installation_date=(datetime.now(timezone.utc) - timedelta(days=random.randint(180, 2555))).isoformat(),
         avg_consumption=round(random.uniform(0.5, 2.5), 2),
         label_status=random.choice(["good"] * 8 + ["warning"] * 1 + ["replace"] * 1),
         printhead_life=random.randint(60, 100)
@@ -218,7 +1006,7 @@ async def initialize_data():
         )
         stores.append(store.dict())
     
-    await db.stores.insert_many(stores)
+    await insert_stores(stores)
     
     # Create sample campaigns
     campaigns = [
@@ -289,38 +1077,560 @@ async def initialize_data():
     if alerts:
         await db.alerts.insert_many(alerts)
 
+# =================== FLEET SNAPSHOT ===================
+
+FLEET_STORE_STATUSES = ("online", "partial", "offline")
+FLEET_DEVICE_STATUSES = ("online", "offline", "maintenance")
+FLEET_DEVICE_PROJECTION = {
+    "_id": 0, "id": 1, "store_id": 1, "type": 1, "status": 1, "label_status": 1, "last_calibration": 1, "avg_consumption": 1,
+}
+FLEET_STORE_PROJECTION = {"_id": 0, "id": 1, "name": 1, "comuna": 1, "status": 1}
+
+def _calibration_timestamp(value) -> float:
+    if isinstance(value, str):
+        value = datetime.fromisoformat(value)
+    if value.tzinfo is None:
+        value = value.replace(tzinfo=timezone.utc)
+    return value.timestamp()
+
+class FleetSnapshot:
+    """In-process counters of the whole fleet, shared by the analytics endpoints.
+
+    Devices are held as parallel arrays (store row, type, status, label flag,
+    calibration time, consumption) with categorical codes, so every counter is a vector
+    reduction instead of a scan of the collections. Writes patch the rows of
+    the stores they touch in place through `refresh_store_rollups`, serialized
+    with rebuilds by the snapshot lock; writes made by other workers are picked
+    up by a full rebuild after FLEET_SNAPSHOT_MAX_AGE.
+    """
+
+    _DEVICE_COLUMNS = ("_device_store", "_device_type", "_device_status",
+                       "_device_replace", "_device_calibration", "_device_consumption")
+
+    def __init__(self):
+        self._lock = asyncio.Lock()
+        self._built_at = 0.0
+        self._types: List[str] = []
+        self._comunas: List[str] = []
+        self._store_rows = {}
+        self._stores: List[dict] = []  # id, name and comuna of each store row
+        self._store_status = np.zeros(0, dtype=np.int8)
+        self._store_comuna = np.zeros(0, dtype=np.int16)
+        self._device_store = np.zeros(0, dtype=np.int32)
+        self._device_type = np.zeros(0, dtype=np.int8)
+        self._device_status = np.zeros(0, dtype=np.int8)
+        self._device_replace = np.zeros(0, dtype=bool)
+        self._device_calibration = np.zeros(0, dtype=np.float64)
+        self._device_consumption = np.zeros(0, dtype=np.float64)
+        self._device_ids: List[str] = []  # device id of each device row
+        self._device_rows = {}
+        self._device_owners = {}  # device id -> store id
+        self._store_devices = defaultdict(set)  # store id -> device ids
+
+    def _code(self, vocabulary: List[str], value) -> int:
+        if value not in vocabulary:
+            vocabulary.append(value)
+        return vocabulary.index(value)
+
+    def _status_code(self, statuses: tuple, value) -> int:
+        # Unknown statuses share the extra code past the known ones
+        return statuses.index(value) if value in statuses else len(statuses)
+
+    async def _load(self, store_ids: Optional[List[str]]):
+        """Stores and device columns for `store_ids` (all stores when None)"""
+        query = {} if store_ids is None else {"id": {"$in": store_ids}}
+        stores = await db.stores.find(query, FLEET_STORE_PROJECTION).to_list(None)
+        device_query = {} if store_ids is None else {"store_id": {"$in": store_ids}}
+        devices = await db.devices.find(device_query, FLEET_DEVICE_PROJECTION).to_list(None)
+        return stores, devices
+
+    def _device_columns(self, devices: List[dict]):
+        return (
+            np.array([self._store_rows.get(d["store_id"], -1) for d in devices], dtype=np.int32),
+            np.array([self._code(self._types, d.get("type")) for d in devices], dtype=np.int8),
+            np.array([self._status_code(FLEET_DEVICE_STATUSES, d.get("status")) for d in devices], dtype=np.int8),
+            np.array([d.get("label_status") == "replace" for d in devices], dtype=bool),
+            np.array([_calibration_timestamp(d["last_calibration"]) if d.get("last_calibration") else 0.0
+                      for d in devices], dtype=np.float64),
+            np.array([d.get("avg_consumption") or 0 for d in devices], dtype=np.float64),
+        )
+
+    def _columns(self) -> tuple:
+        return tuple(getattr(self, name) for name in self._DEVICE_COLUMNS)
+
+    def _set_columns(self, columns):
+        for name, column in zip(self._DEVICE_COLUMNS, columns):
+            setattr(self, name, column)
+
+    def _index_devices(self, devices: List[dict]):
+        for device in devices:
+            self._device_owners[device["id"]] = device["store_id"]
+            self._store_devices[device["store_id"]].add(device["id"])
+
+    def _remove_device(self, device_id: str):
+        """Drop a device row by moving the last row into its place"""
+        row = self._device_rows.pop(device_id)
+        self._device_owners.pop(device_id, None)
+        last = self._device_ids.pop()
+        if last != device_id:
+            self._device_ids[row] = last
+            self._device_rows[last] = row
+            for column in self._columns():
+                column[row] = column[-1]
+        self._set_columns(column[:-1] for column in self._columns())
+
+    def _patch_devices(self, store_ids: List[str], devices: List[dict]):
+        """Overwrite, append and remove the device rows of `store_ids`"""
+        loaded = {device["id"] for device in devices}
+        for store_id in store_ids:
+            for device_id in self._store_devices.pop(store_id, set()) - loaded:
+                self._remove_device(device_id)
+        for device in devices:
+            owner = self._device_owners.get(device["id"])
+            if owner is not None and owner != device["store_id"]:
+                self._store_devices[owner].discard(device["id"])  # moved from another store
+        added = [device["id"] for device in devices if device["id"] not in self._device_rows]
+        if added:
+            self._device_rows.update({device_id: len(self._device_ids) + i for i, device_id in enumerate(added)})
+            self._device_ids.extend(added)
+            self._set_columns(
+                np.concatenate([column, np.zeros(len(added), dtype=column.dtype)]) for column in self._columns()
+            )
+        rows = [self._device_rows[device["id"]] for device in devices]
+        for column, values in zip(self._columns(), self._device_columns(devices)):
+            column[rows] = values
+        self._index_devices(devices)
+
+    def _set_store(self, row: int, store: dict):
+        self._stores[row] = {"id": store["id"], "name": store.get("name", ""), "comuna": store.get("comuna", "")}
+        self._store_status[row] = self._status_code(FLEET_STORE_STATUSES, store.get("status"))
+        self._store_comuna[row] = self._code(self._comunas, store.get("comuna", ""))
+
+    async def rebuild(self):
+        stores, devices = await self._load(None)
+        self._store_rows = {store["id"]: row for row, store in enumerate(stores)}
+        self._stores = [None] * len(stores)
+        self._store_status = np.zeros(len(stores), dtype=np.int8)
+        self._store_comuna = np.zeros(len(stores), dtype=np.int16)
+        for row, store in enumerate(stores):
+            self._set_store(row, store)
+        self._set_columns(self._device_columns(devices))
+        self._device_ids = [device["id"] for device in devices]
+        self._device_rows = {device_id: row for row, device_id in enumerate(self._device_ids)}
+        self._device_owners = {}
+        self._store_devices = defaultdict(set)
+        self._index_devices(devices)
+        self._built_at = time.monotonic()
+
+    async def ensure(self):
+        """Rebuild the snapshot when it was never built or is older than its max age"""
+        if time.monotonic() - self._built_at < FLEET_SNAPSHOT_MAX_AGE:
+            return
+        async with self._lock:
+            if time.monotonic() - self._built_at >= FLEET_SNAPSHOT_MAX_AGE:
+                await self.rebuild()
+
+    def invalidate(self):
+        self._built_at = 0.0
+
+    async def refresh(self, query: dict):
+        """Reload the rows of the stores matching `query` after a write"""
+        if not self._built_at:
+            return  # built on first read
+        async with self._lock:
+            if self._built_at:
+                await self._refresh(query)
+
+    async def _refresh(self, query: dict):
+        store_ids = [s["id"] async for s in db.stores.find(query, {"_id": 0, "id": 1})]
+        if not store_ids:
+            return
+        stores, devices = await self._load(store_ids)
+        for store in stores:
+            if store["id"] not in self._store_rows:
+                self._store_rows[store["id"]] = len(self._store_rows)
+        added = len(self._store_rows) - len(self._store_status)
+        if added > 0:
+            self._stores.extend([None] * added)
+            self._store_status = np.concatenate([self._store_status, np.zeros(added, dtype=np.int8)])
+            self._store_comuna = np.concatenate([self._store_comuna, np.zeros(added, dtype=np.int16)])
+        for store in stores:
+            self._set_store(self._store_rows[store["id"]], store)
+        self._patch_devices(store_ids, devices)
+
+    async def counters(self) -> dict:
+        """Store and device counters of the fleet, by status and by device type"""
+        await self.ensure()
+        store_counts = np.bincount(self._store_status, minlength=len(FLEET_STORE_STATUSES) + 1)
+        device_counts = np.bincount(self._device_status, minlength=len(FLEET_DEVICE_STATUSES) + 1)
+        offline, maintenance = FLEET_DEVICE_STATUSES.index("offline"), FLEET_DEVICE_STATUSES.index("maintenance")
+        problematic = (self._device_status == offline) | (self._device_status == maintenance) | self._device_replace
+        # Calibrated when `(now - last_calibration).days <= CALIBRATION_WINDOW_DAYS`
+        cutoff = time.time() - (CALIBRATION_WINDOW_DAYS + 1) * 86400
+        statuses = len(FLEET_DEVICE_STATUSES) + 1
+        by_type = np.bincount(
+            self._device_type.astype(np.int32) * statuses + self._device_status,
+            minlength=len(self._types) * statuses,
+        ).reshape(len(self._types), statuses) if self._types else np.zeros((0, statuses), dtype=np.int64)
+        return {
+            "total_stores": len(self._store_status),
+            "stores": {status: int(store_counts[i]) for i, status in enumerate(FLEET_STORE_STATUSES)},
+            "total_devices": len(self._device_status),
+            "devices": {status: int(device_counts[i]) for i, status in enumerate(FLEET_DEVICE_STATUSES)},
+            "problematic_devices": int(problematic.sum()),
+            "calibrated_devices": int((self._device_calibration > cutoff).sum()),
+            "by_type": {
+                device_type: {status: int(by_type[i, j]) for j, status in enumerate(FLEET_DEVICE_STATUSES)}
+                for i, device_type in enumerate(self._types)
+            },
+        }
+
+    async def store_columns(self) -> dict:
+        """Per-store arrays (devices by type, consumption) indexed like `stores`"""
+        await self.ensure()
+        attached = self._device_store >= 0
+        rows = self._device_store[attached]
+        types = self._device_type[attached].astype(np.int64)
+        by_type = np.bincount(
+            rows.astype(np.int64) * len(self._types) + types, minlength=len(self._stores) * len(self._types)
+        ).reshape(len(self._stores), len(self._types))
+        return {
+            "stores": self._stores,
+            "comunas": self._comunas,
+            "comuna": self._store_comuna,
+            "types": self._types,
+            "devices_by_type": by_type,
+            "consumption": np.bincount(rows, weights=self._device_consumption[attached], minlength=len(self._stores)),
+            "consumption_by_type": np.bincount(types, weights=self._device_consumption[attached],
+                                               minlength=len(self._types)),
+        }
+
+fleet_snapshot = FleetSnapshot()
+
 # =================== API ENDPOINTS ===================
 
 @api_router.get("/")
 async def root():
     return {"message": "BM MANAGER API v1.0"}
 
+class FastJSONResponse(JSONResponse):
+    """Serializes documents as read from Mongo, without a Pydantic round trip"""
+
+    def render(self, content) -> bytes:
+        return dump_json(content)
+
+def dump_json(content) -> bytes:
+    if orjson is not None:
+        return orjson.dumps(content, option=orjson.OPT_UTC_Z | orjson.OPT_NAIVE_UTC)
+    return json.dumps(jsonable_encoder(content), separators=(",", ":")).encode()
+
+def model_projection(model) -> dict:
+    """Mongo projection of the fields declared by `model`"""
+    return {"_id": 0, **{field: 1 for field in model.model_fields}}
+
+def list_response(documents: List[dict], model, headers: Optional[dict] = None) -> Response:
+    """Send documents read with `model_projection(model)` straight to the client.
+
+    Returning a Response skips FastAPI's response_model validation; set
+    RESPONSE_VALIDATION=true to validate every document while debugging.
+    """
+    if RESPONSE_VALIDATION:
+        return JSONResponse(content=jsonable_encoder([model(**document) for document in documents]), headers=headers)
+    return FastJSONResponse(content=documents, headers=headers)
+
+def encode_cursor(*values) -> str:
+    """Encode keyset pagination values into an opaque cursor"""
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+def decode_cursor(cursor: str, size: int) -> list:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    if not isinstance(values, list) or len(values) != size:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+    return values
+
+def csv_filter(value: str):
+    """Match a single value or any of a comma-separated list"""
+    values = [v.strip() for v in value.split(",") if v.strip()]
+    return values[0] if len(values) == 1 else {"$in": values}
+
+def store_filters(comuna: Optional[str], status: Optional[str], sales_level: Optional[str]) -> dict:
+    query = {}
+    if comuna:
+        query["comuna"] = csv_filter(comuna)
+    if status:
+        query["status"] = csv_filter(status)
+    if sales_level:
+        query["sales_level"] = csv_filter(sales_level)
+    return query
+
+def parse_fields(fields: str, model) -> dict:
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    unknown = requested - set(model.model_fields)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown fields: {', '.join(sorted(unknown))}")
+    return {f: 1 for f in requested}
+
 @api_router.get("/stores", response_model=List[Store])
-async def get_stores():
-    stores = await db.stores.find().to_list(1000)
-    return [Store(**store) for store in stores]
+async def get_stores(
+    comuna: Optional[str] = None,
+    status: Optional[str] = None,
+    sales_level: Optional[str] = None,
+    device_type: Optional[str] = None,
+    fields: Optional[str] = None,
+    limit: Optional[int] = Query(None, ge=1, le=STORE_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    """List stores ordered by (sap_code, id).
+
+    Without `limit` every matching store is returned. With `limit` the
+    response holds one page and `X-Next-Cursor` carries the cursor for the
+    next one. `fields` is a comma-separated projection (e.g.
+    `id,latitude,longitude,status`) that skips the device payloads.
+    """
+    query = store_filters(comuna, status, sales_level)
+    if device_type:
+        query["rollup.types"] = csv_filter(device_type)
+    if cursor:
+        last_sap_code, last_id = decode_cursor(cursor, 2)
+        query["$or"] = [
+            {"sap_code": {"$gt": last_sap_code}},
+            {"sap_code": last_sap_code, "id": {"$gt": last_id}},
+        ]
+    
+    if fields:
+        projection = {"_id": 0, **parse_fields(fields, Store), "id": 1, "sap_code": 1}
+    else:
+        projection = model_projection(Store)
+    
+    find = db.stores.find(query, projection).sort([("sap_code", 1), ("id", 1)])
+    if limit:
+        find = find.limit(limit)
+    stores = [store async for store in find]
+    
+    if not fields or "devices" in projection:
+        await attach_devices(stores)
+    
+    headers = {}
+    if limit and len(stores) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(stores[-1]["sap_code"], stores[-1]["id"])
+    if fields:
+        return FastJSONResponse(content=stores, headers=headers)
+    return list_response(stores, Store, headers)
+
+def parse_bbox(bbox: str) -> dict:
+    """`minLon,minLat,maxLon,maxLat` as a GeoJSON polygon"""
+    try:
+        min_lon, min_lat, max_lon, max_lat = (float(v) for v in bbox.split(","))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="bbox must be minLon,minLat,maxLon,maxLat")
+    if not (-180 <= min_lon < max_lon <= 180 and -90 <= min_lat < max_lat <= 90):
+        raise HTTPException(status_code=400, detail="Invalid bbox bounds")
+    return {"type": "Polygon", "coordinates": [[
+        [min_lon, min_lat], [max_lon, min_lat], [max_lon, max_lat], [min_lon, max_lat], [min_lon, min_lat]
+    ]]}
+
+@api_router.get("/stores/near", response_model=List[StoreMarker])
+async def get_stores_near(
+    lat: float = Query(..., ge=-90, le=90),
+    lon: float = Query(..., ge=-180, le=180),
+    radius: float = Query(5000, gt=0, le=GEO_MAX_RADIUS_M),
+    limit: int = Query(100, ge=1, le=GEO_RESULT_MAX),
+    comuna: Optional[str] = None,
+    status: Optional[str] = None,
+    sales_level: Optional[str] = None,
+):
+    """Stores within `radius` meters of a point, nearest first"""
+    pipeline = [
+        {"$geoNear": {
+            "near": {"type": "Point", "coordinates": [lon, lat]},
+            "distanceField": "distance_m",
+            "maxDistance": radius,
+            "spherical": True,
+            "query": store_filters(comuna, status, sales_level),
+        }},
+        {"$limit": limit},
+        {"$project": {**MARKER_PROJECTION, "distance_m": 1}},
+    ]
+    return await db.stores.aggregate(pipeline).to_list(limit)
+
+@api_router.get("/stores/within", response_model=List[StoreMarker])
+async def get_stores_within(
+    bbox: str,
+    limit: int = Query(GEO_RESULT_MAX, ge=1, le=GEO_RESULT_MAX),
+    comuna: Optional[str] = None,
+    status: Optional[str] = None,
+    sales_level: Optional[str] = None,
+):
+    """Stores inside a `minLon,minLat,maxLon,maxLat` bounding box"""
+    query = store_filters(comuna, status, sales_level)
+    query["location"] = {"$geoWithin": {"$geometry": parse_bbox(bbox)}}
+    return await db.stores.find(query, MARKER_PROJECTION).limit(limit).to_list(limit)
+
+@api_router.get("/stores/clusters", response_model=StoreClusters)
+async def get_store_clusters(
+    bbox: str,
+    zoom: int = Query(..., ge=0, le=22),
+    comuna: Optional[str] = None,
+    status: Optional[str] = None,
+    sales_level: Optional[str] = None,
+):
+    """Stores in a bounding box aggregated into grid cells sized for `zoom`.
+
+    Cells holding a single store carry its marker fields so the map can draw
+    it directly; the rest are returned as counts at the cells' centroid.
+    """
+    cell = 360 / (2 ** zoom) / CLUSTER_CELLS_PER_TILE
+    query = store_filters(comuna, status, sales_level)
+    query["location"] = {"$geoWithin": {"$geometry": parse_bbox(bbox)}}
+    pipeline = [
+        {"$match": query},
+        {"$group": {
+            "_id": {
+                "x": {"$floor": {"$divide": ["$longitude", cell]}},
+                "y": {"$floor": {"$divide": ["$latitude", cell]}},
+            },
+            "latitude": {"$avg": "$latitude"},
+            "longitude": {"$avg": "$longitude"},
+            "count": {"$sum": 1},
+            "online": {"$sum": {"$cond": [{"$eq": ["$status", "online"]}, 1, 0]}},
+            "partial": {"$sum": {"$cond": [{"$eq": ["$status", "partial"]}, 1, 0]}},
+            "offline": {"$sum": {"$cond": [{"$eq": ["$status", "offline"]}, 1, 0]}},
+            "store": {"$first": {field: f"${field}" for field in MARKER_PROJECTION if field != "_id"}},
+        }},
+        {"$project": {"_id": 0}},
+    ]
+    clusters = await db.stores.aggregate(pipeline).to_list(None)
+    for cluster in clusters:
+        if cluster["count"] > 1:
+            cluster["store"] = None
+    return StoreClusters(total=sum(c["count"] for c in clusters), clusters=clusters)
 
 @api_router.get("/stores/{store_id}", response_model=Store)
 async def get_store(store_id: str):
-    store = await db.stores.find_one({"id": store_id})
+    store = await db.stores.find_one({"id": store_id}, {"_id": 0})
     if not store:
         raise HTTPException(status_code=404, detail="Store not found")
+    await attach_devices([store])
     return Store(**store)
 
 @api_router.put("/stores/{store_id}")
 async def update_store(store_id: str, store_data: dict):
+    if any(key.startswith("devices.") for key in store_data):
+        raise HTTPException(status_code=400, detail="Update individual devices through /api/devices/{device_id}")
+    devices = store_data.pop("devices", None)
+    if devices is not None:
+        # Validate devices so calibration dates are persisted as BSON dates
+        try:
+            now = datetime.now(timezone.utc)
+            devices = [{**BalanceDevice(**d).dict(), "store_id": store_id, "updated_at": now} for d in devices]
+        except (TypeError, ValidationError) as e:
+            raise HTTPException(status_code=422, detail=f"Invalid devices: {e}")
+        owned = await db.devices.distinct(
+            "id", {"id": {"$in": [d["id"] for d in devices]}, "store_id": {"$ne": store_id}}
+        )
+        if owned:
+            raise HTTPException(status_code=409, detail=f"Devices belong to another store: {', '.join(owned)}")
+    store_data.pop("rollup", None)
+    store_data.pop("location", None)
+    store_data.pop("updated_at", None)
     result = await db.stores.update_one(
         {"id": store_id},
-        {"$set": store_data}
+        {"$set": {**store_data, "updated_at": datetime.now(timezone.utc)}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Store not found")
+    if devices is not None:
+        # Replacing the device list of a store
+        device_ids = [d["id"] for d in devices]
+        await db.devices.delete_many({"store_id": store_id, "id": {"$nin": device_ids}})
+        await db.maintenance_scores.delete_many({"store_id": store_id, "device_id": {"$nin": device_ids}})
+        await db.obsolescence.delete_many({"store_id": store_id, "device_id": {"$nin": device_ids}})
+        if devices:
+            await db.devices.bulk_write([
+                ReplaceOne({"id": d["id"]}, d, upsert=True) for d in devices
+            ], ordered=False)
+        await refresh_store_rollups({"id": store_id})
+        await refresh_maintenance_scores({"store_id": store_id})
+        await refresh_obsolescence({"store_id": store_id})
+    elif any(field in store_data for field in ("status", "name", "comuna")):
+        await fleet_snapshot.refresh({"id": store_id})
+    if "latitude" in store_data or "longitude" in store_data:
+        await sync_store_locations({"id": store_id})
+    if devices is not None or any(field in store_data for field in ("name", "comuna", "latency", "network_status")):
+        await evaluate_alerts({"id": store_id})
+    return {"success": True}
+
+@api_router.put("/stores/{store_id}/devices/{device_id}")
+async def update_store_device(store_id: str, device_id: str, device_data: DeviceUpdate):
+    await apply_device_update({"id": device_id, "store_id": store_id}, device_data)
     return {"success": True}
 
+async def apply_device_update(query: dict, device_data: DeviceUpdate) -> dict:
+    """Update one device and refresh its store rollup; returns the updated device"""
+    changes = device_data.dict(exclude_unset=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No device fields to update")
+    device = await db.devices.find_one_and_update(
+        query,
+        {"$set": {**changes, "updated_at": datetime.now(timezone.utc)}},
+        projection={"_id": 0},
+        return_document=ReturnDocument.AFTER
+    )
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    await refresh_store_rollups({"id": device["store_id"]})
+    await refresh_maintenance_scores({"id": device["id"]})
+    await refresh_obsolescence({"id": device["id"]})
+    await evaluate_alerts({"id": device["store_id"]})
+    return device
+
+@api_router.get("/devices", response_model=List[Device])
+async def get_devices(
+    response: Response,
+    store_id: Optional[str] = None,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    firmware_version: Optional[str] = None,
+    limit: int = Query(DEVICE_PAGE_DEFAULT, ge=1, le=DEVICE_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    """List devices ordered by id; `X-Next-Cursor` carries the next page cursor"""
+    query = {}
+    if store_id:
+        query["store_id"] = csv_filter(store_id)
+    if type:
+        query["type"] = csv_filter(type)
+    if status:
+        query["status"] = csv_filter(status)
+    if firmware_version:
+        query["firmware_version"] = csv_filter(firmware_version)
+    if cursor:
+        last_id, = decode_cursor(cursor, 1)
+        query["id"] = {"$gt": last_id}
+    
+    devices = await db.devices.find(query, {"_id": 0}).sort("id", 1).limit(limit).to_list(limit)
+    if len(devices) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(devices[-1]["id"])
+    return devices
+
+@api_router.get("/devices/{device_id}", response_model=Device)
+async def get_device(device_id: str):
+    device = await db.devices.find_one({"id": device_id}, {"_id": 0})
+    if not device:
+        raise HTTPException(status_code=404, detail="Device not found")
+    return device
+
+@api_router.patch("/devices/{device_id}", response_model=Device)
+async def update_device(device_id: str, device_data: DeviceUpdate):
+    return await apply_device_update({"id": device_id}, device_data)
+
 @api_router.get("/campaigns", response_model=List[Campaign])
 async def get_campaigns():
-    campaigns = await db.campaigns.find().to_list(1000)
-    return [Campaign(**campaign) for campaign in campaigns]
+    campaigns = await db.campaigns.find({}, model_projection(Campaign)).to_list(1000)
+    return list_response(campaigns, Campaign)
 
 @api_router.post("/campaigns", response_model=Campaign)
 async def create_campaign(campaign: Campaign):
@@ -329,6 +1639,11 @@ async def create_campaign(campaign: Campaign):
 
 @api_router.put("/campaigns/{campaign_id}")
 async def update_campaign(campaign_id: str, campaign_data: dict):
+    # Deployment progress is owned by the deployment engine
+    for field in ("id", "deployed_count", "total_balances", "stores_applied"):
+        campaign_data.pop(field, None)
+    if not campaign_data:
+        raise HTTPException(status_code=400, detail="No campaign fields to update")
     result = await db.campaigns.update_one(
         {"id": campaign_id},
         {"$set": campaign_data}
@@ -339,14 +1654,14 @@ async def update_campaign(campaign_id: str, campaign_data: dict):
 
 @api_router.get("/alerts", response_model=List[Alert])
 async def get_alerts():
-    alerts = await db.alerts.find({"resolved": False}).to_list(1000)
-    return [Alert(**alert) for alert in alerts]
+    alerts = await db.alerts.find({"resolved": False}, model_projection(Alert)).sort("created_at", -1).to_list(1000)
+    return list_response(alerts, Alert)
 
 @api_router.put("/alerts/{alert_id}/resolve")
 async def resolve_alert(alert_id: str):
     result = await db.alerts.update_one(
         {"id": alert_id},
-        {"$set": {"resolved": True}}
+        {"$set": {"resolved": True, "updated_at": datetime.now(timezone.utc)}}
     )
     if result.matched_count == 0:
         raise HTTPException(status_code=404, detail="Alert not found")
@@ -354,55 +1669,220 @@ async def resolve_alert(alert_id: str):
 
 @api_router.get("/metrics", response_model=Metrics)
 async def get_metrics():
-    stores = await db.stores.find().to_list(1000)
-    
-    total_balances = sum(s["balances_bms"] + s["balances_autoservicio"] + s["balances_ia"] for s in stores)
-    active_balances = 0
-    calibrated_count = 0
-    total_devices = 0
+    fleet = await fleet_snapshot.counters()
+    total_devices = fleet["total_devices"]
     
-    for store in stores:
-        for device in store.get("devices", []):
-            total_devices += 1
-            if device["status"] == "online":
-                active_balances += 1
-            # Check if calibrated within last 90 days
-            last_cal = datetime.fromisoformat(device["last_calibration"])
-            if (datetime.now(timezone.utc) - last_cal).days <= 90:
-                calibrated_count += 1
-    
-    stores_online = sum(1 for s in stores if s["status"] == "online")
-    stores_partial = sum(1 for s in stores if s["status"] == "partial")
-    stores_offline = sum(1 for s in stores if s["status"] == "offline")
+    today = await route_db("analytics").weight_daily.aggregate([
+        {"$match": {"day": truncate_date(datetime.now(timezone.utc), "day")}},
+        {"$group": {"_id": None, "kg": {"$sum": "$kg"}}},
+    ]).to_list(1)
     
     return Metrics(
-        total_kg_today=round(random.uniform(15000, 25000), 2),
-        active_balances=active_balances,
-        calibration_percentage=round((calibrated_count / total_devices * 100) if total_devices > 0 else 0, 1),
+        total_kg_today=round(today[0]["kg"] if today else 0, 2),
+        active_balances=fleet["devices"]["online"],
+        calibration_percentage=round((fleet["calibrated_devices"] / total_devices * 100) if total_devices > 0 else 0, 1),
         pending_updates=random.randint(3, 12),
-        stores_online=stores_online,
-        stores_partial=stores_partial,
-        stores_offline=stores_offline
+        stores_online=fleet["stores"]["online"],
+        stores_partial=fleet["stores"]["partial"],
+        stores_offline=fleet["stores"]["offline"]
     )
 
+def truncate_date(value: datetime, bucket: str) -> datetime:
+    """Start of the hour/day/week (weeks start on Monday, UTC) containing `value`"""
+    value = value.astimezone(timezone.utc)
+    if bucket == "hour":
+        return value.replace(minute=0, second=0, microsecond=0)
+    day = value.replace(hour=0, minute=0, second=0, microsecond=0)
+    if bucket == "week":
+        day -= timedelta(days=day.weekday())
+    return day
+
+def weight_reading_key(reading) -> str:
+    """Identity of a weighing or telemetry reading: the device's reading id, or
+    a hash of the reading itself for devices that do not send one"""
+    if reading.reading_id:
+        return f"{reading.device_id}:{reading.reading_id}"
+    fields = [reading.device_id, reading.timestamp.astimezone(timezone.utc).isoformat(), reading.product, reading.weight_kg]
+    return hashlib.sha1(json.dumps(fields).encode()).hexdigest()
+
+async def claim_weight_readings(readings: list) -> set:
+    """Keys of the readings not counted before, recording them so that a
+    retried batch is not counted twice.
+
+    Keys are kept for WEIGHT_READING_DEDUP_TTL. A batch that fails after its
+    readings were claimed is not counted again when retried.
+    """
+    keys = list({weight_reading_key(r) for r in readings})
+    if not keys:
+        return set()
+    now = datetime.now(timezone.utc)
+    duplicates = set()
+    try:
+        await route_db("telemetry").weight_reading_keys.insert_many(
+            [{"_id": key, "created_at": now} for key in keys], ordered=False
+        )
+    except BulkWriteError as e:
+        for error in e.details.get("writeErrors", []):
+            if error.get("code") != 11000:
+                raise
+            duplicates.add(keys[error["index"]])
+    return set(keys) - duplicates
+
+def claimed_readings(readings: list, claimed: set) -> list:
+    """The readings whose key is in `claimed`, once each"""
+    fresh = {}
+    for reading in readings:
+        key = weight_reading_key(reading)
+        if key in claimed:
+            fresh.setdefault(key, reading)
+    return list(fresh.values())
+
+async def record_weight_readings(readings: List[WeightReading], device_types: Optional[dict] = None,
+                                 claim: bool = True) -> int:
+    """Store readings in the time-series collection and fold them into the daily
+    rollups and the sales cubes, then through the fraud detector; `device_types`
+    maps device ids to their type when the caller already read it.
+
+    Readings already recorded (same reading id) are skipped unless the caller
+    claimed them itself (`claim=False`); returns the number of new readings."""
+    if not readings:
+        return 0
+    if claim:
+        readings = claimed_readings(readings, await claim_weight_readings(readings))
+    if not readings:
+        return 0
+    telemetry_db = route_db("telemetry")
+    await telemetry_db.weight_readings.insert_many([
+        {
+            "ts": r.timestamp,
+            "meta": {"store_id": r.store_id, "device_id": r.device_id, "product": r.product},
+            "weight_kg": r.weight_kg,
+        }
+        for r in readings
+    ], ordered=False)
+    
+    daily = defaultdict(lambda: [0.0, 0])
+    for r in readings:
+        totals = daily[(truncate_date(r.timestamp, "day"), r.store_id, r.product)]
+        totals[0] += r.weight_kg
+        totals[1] += 1
+    await telemetry_db.weight_daily.bulk_write([
+        UpdateOne(
+            {"day": day, "store_id": store_id, "product": product},
+            {"$inc": {"kg": kg, "count": count}},
+            upsert=True
+        )
+        for (day, store_id, product), (kg, count) in daily.items()
+    ], ordered=False)
+    
+    weighings = defaultdict(int)
+    for r in readings:
+        weighings[(truncate_date(r.timestamp, "day"), r.device_id)] += 1
+    await telemetry_db.device_daily.bulk_write([
+        UpdateOne({"day": day, "device_id": device_id}, {"$inc": {"count": count}}, upsert=True)
+        for (day, device_id), count in weighings.items()
+    ], ordered=False)
+    
+    if device_types is None:
+        device_types = {
+            device["id"]: device.get("type")
+            async for device in db.devices.find(
+                {"id": {"$in": list({r.device_id for r in readings})}}, {"_id": 0, "id": 1, "type": 1}
+            )
+        }
+    await update_sales_cubes(readings, device_types)
+    await fraud_detector.ingest(readings, device_types)
+    return len(readings)
+
+@api_router.post("/weight-readings")
+async def create_weight_readings(readings: List[WeightReading]):
+    inserted = await record_weight_readings(readings)
+    return {"success": True, "inserted": inserted}
+
 @api_router.get("/weight-data", response_model=List[WeightData])
-async def get_weight_data():
-    # Generate sample weekly data for 3 products
-    base_date = datetime.now(timezone.utc) - timedelta(days=6)
-    dates = [(base_date + timedelta(days=i)).strftime("%d/%m") for i in range(7)]
-    
-    products = [
-        {"product": "Tomate", "base": 450, "variance": 80},
-        {"product": "Palta", "base": 320, "variance": 60},
-        {"product": "Plátano", "base": 580, "variance": 100}
-    ]
+async def get_weight_data(
+    products: Optional[str] = None,
+    store_id: Optional[str] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    bucket: Literal["hour", "day", "week"] = "day",
+):
+    """Weighed kg per product, bucketed by hour, day or week.
+
+    Defaults to the last 7 days and the 3 most weighed products. The range is
+    widened to the boundaries of the buckets containing `start` and `end`, so
+    the first and last buckets are whole (a week starting before `start`
+    includes all of its days). Day and week buckets are served from the
+    `weight_daily` rollups; hourly buckets are computed from the raw
+    time-series readings.
+    """
+    end = (end or datetime.now(timezone.utc)).astimezone(timezone.utc)
+    start = (start or truncate_date(end, "day") - timedelta(days=6)).astimezone(timezone.utc)
+    if start >= end:
+        raise HTTPException(status_code=400, detail="start must be before end")
+    
+    step = BUCKET_STEPS[bucket]
+    buckets = []
+    current = truncate_date(start, bucket)
+    while current < end:
+        buckets.append(current)
+        current += step
+    if len(buckets) > WEIGHT_MAX_BUCKETS:
+        raise HTTPException(status_code=400, detail=f"Range spans more than {WEIGHT_MAX_BUCKETS} {bucket} buckets")
+    start, end = buckets[0], current
+    
+    daily_match = {"day": {"$gte": start, "$lt": end}}
+    if store_id:
+        daily_match["store_id"] = store_id
+    if products:
+        product_names = [p.strip() for p in products.split(",") if p.strip()]
+    else:
+        top = await route_db("analytics").weight_daily.aggregate([
+            {"$match": daily_match},
+            {"$group": {"_id": "$product", "kg": {"$sum": "$kg"}}},
+            {"$sort": {"kg": -1}},
+            {"$limit": WEIGHT_DEFAULT_PRODUCTS},
+        ]).to_list(WEIGHT_DEFAULT_PRODUCTS)
+        product_names = [row["_id"] for row in top]
+    if not product_names:
+        return []
+    
+    if bucket == "hour":
+        match = {"ts": {"$gte": start, "$lt": end}, "meta.product": {"$in": product_names}}
+        if store_id:
+            match["meta.store_id"] = store_id
+        collection = route_db("analytics").weight_readings
+        pipeline = [
+            {"$match": match},
+            {"$group": {
+                "_id": {"product": "$meta.product", "bucket": {"$dateTrunc": {"date": "$ts", "unit": "hour"}}},
+                "kg": {"$sum": "$weight_kg"},
+            }},
+        ]
+    else:
+        collection = route_db("analytics").weight_daily
+        bucket_expr = "$day" if bucket == "day" else {
+            "$dateTrunc": {"date": "$day", "unit": "week", "startOfWeek": "monday"}
+        }
+        pipeline = [
+            {"$match": {**daily_match, "product": {"$in": product_names}}},
+            {"$group": {"_id": {"product": "$product", "bucket": bucket_expr}, "kg": {"$sum": "$kg"}}},
+        ]
     
-    result = []
-    for p in products:
-        weights = [round(p["base"] + random.uniform(-p["variance"], p["variance"]), 1) for _ in range(7)]
-        result.append(WeightData(product=p["product"], weights=weights, dates=dates))
+    totals = {}
+    async for row in collection.aggregate(pipeline):
+        totals[(row["_id"]["product"], truncate_date(row["_id"]["bucket"], bucket))] = row["kg"]
     
-    return result
+    date_format = "%d/%m %Hh" if bucket == "hour" else "%d/%m"
+    dates = [b.strftime(date_format) for b in buckets]
+    return [
+        WeightData(
+            product=product,
+            weights=[round(totals.get((product, b), 0), 1) for b in buckets],
+            dates=dates
+        )
+        for product in product_names
+    ]
 
 @api_router.post("/fix-naming")
 async def fix_naming_issue():
@@ -415,50 +1895,147 @@ async def fix_naming_issue():
         )
         
         # Also regenerate data with proper naming
-        await db.stores.delete_many({})
+        # Everything derived from the old stores and devices goes with them
+        for collection in (db.stores, db.devices, db.alerts, db.campaigns, db.maintenance_scores,
+                           db.obsolescence, db.obsolescence_totals, db.weight_readings, db.weight_reading_keys,
+                           db.weight_daily, db.device_daily, *(db[name] for name in SALES_CUBES.values()),
+                           db.supplies, db.supply_movements, db.supply_daily):
+            await collection.delete_many({})
+        fleet_snapshot.invalidate()
         await initialize_data_fixed()
+        await seed_supplies()
         
         return {"success": True, "message": f"Updated {result.modified_count} stores with correct naming"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=f"Error fixing naming: {str(e)}")
 
-@api_router.get("/ai-predictions", response_model=List[AIPrediction])
-async def get_ai_predictions():
-    """Get AI-generated predictions based on system data"""
-    try:
-        # Get system data for context
-        stores = await db.stores.find().to_list(1000)
-        
-        # Create context for AI
-        total_stores = len(stores)
-        offline_stores = len([s for s in stores if s["status"] == "offline"])
-        problematic_devices = 0
-        total_devices = 0
-        
-        for store in stores:
-            for device in store.get("devices", []):
-                total_devices += 1
-                if device["status"] in ["offline", "maintenance"] or device["label_status"] == "replace":
-                    problematic_devices += 1
-        
-        context = f"""Sistema BM MANAGER - Datos actuales:
-- Total locales: {total_stores}
-- Locales offline: {offline_stores}
-- Dispositivos con problemas: {problematic_devices} de {total_devices}
-- Es temporada de invierno (junio-agosto) en Chile
-- Consumo diario estimado: 615 rollos de papel térmico
-- Stock actual: 8000 rollos económicos
+class PredictionCache:
+    """TTL cache for AI predictions keyed by a fingerprint of the fleet context.
+
+    Expired entries keep being served while a single background task
+    regenerates them (stale-while-revalidate), and concurrent misses for the
+    same key share one LLM call. Entries older than `ttl + max_stale` are
+    evicted.
+    """
+
+    def __init__(self, ttl: float, max_stale: float, error_ttl: float, max_entries: int = 32):
+        self.ttl = ttl
+        self.max_stale = max_stale
+        self.error_ttl = error_ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key -> (expires_at, predictions)
+        self._latest_key = None
+        self._inflight = {}  # key -> asyncio.Task
+
+    def _evict(self, now: float):
+        for key in [k for k, (expires_at, _) in self._entries.items() if now - expires_at > self.max_stale]:
+            del self._entries[key]
+        while len(self._entries) > self.max_entries:
+            oldest = min(self._entries, key=lambda k: self._entries[k][0])
+            del self._entries[oldest]
+
+    async def _load(self, key: str, factory) -> List[AIPrediction]:
+        try:
+            predictions, ttl = await factory(), self.ttl
+        except Exception as e:
+            logger.error(f"Error generating AI predictions: {str(e)}")
+            predictions, ttl = get_fallback_predictions(), self.error_ttl
+        now = time.monotonic()
+        self._entries[key] = (now + ttl, predictions)
+        self._latest_key = key
+        self._evict(now)
+        return predictions
+
+    def refresh(self, key: str, factory) -> asyncio.Task:
+        """Start (or join) the regeneration of `key`"""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._load(key, factory))
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        return task
+
+    def is_fresh(self, key: str) -> bool:
+        entry = self._entries.get(key)
+        return entry is not None and entry[0] > time.monotonic()
+
+    async def get(self, key: str, factory) -> List[AIPrediction]:
+        entry = self._entries.get(key)
+        if entry is None and self._latest_key in self._entries:
+            # The fleet changed since the last generation: answer with the
+            # previous predictions while the new ones are generated
+            entry = self._entries[self._latest_key]
+            self.refresh(key, factory)
+            return entry[1]
+        if entry is None:
+            return await asyncio.shield(self.refresh(key, factory))
+        if entry[0] <= time.monotonic():
+            self.refresh(key, factory)
+        return entry[1]
+
+prediction_cache = PredictionCache(
+    ttl=AI_PREDICTIONS_TTL,
+    max_stale=AI_PREDICTIONS_MAX_STALE,
+    error_ttl=AI_PREDICTIONS_ERROR_TTL,
+)
+
+def round_significant(value: float, digits: int = 2) -> int:
+    return int(float(f"{value:.{digits}g}"))
+
+def round_share(count: int, total: int) -> int:
+    """`count` rounded to the nearest AI_PREDICTIONS_SHARE_STEP of `total`"""
+    if not total:
+        return 0
+    return round(round(count / total / AI_PREDICTIONS_SHARE_STEP) * AI_PREDICTIONS_SHARE_STEP * total)
+
+async def fetch_prediction_context() -> dict:
+    """Fleet counters used both as LLM context and as the cache fingerprint.
+
+    They are rounded so that only changes the predictions could reflect
+    produce a new fingerprint; exact counters would miss the cache on
+    almost every fleet update.
+    """
+    fleet = await fleet_snapshot.counters()
+    counters = {
+        "total_stores": round_significant(fleet["total_stores"]),
+        "offline_stores": round_share(fleet["stores"]["offline"], fleet["total_stores"]),
+        "problematic_devices": round_share(fleet["problematic_devices"], fleet["total_devices"]),
+        "total_devices": round_significant(fleet["total_devices"]),
+    }
+    supplies = await supply_context()
+    supplies["paper_rolls_per_day"] = round_significant(supplies["paper_rolls_per_day"])
+    if supplies["warehouse_days_left"] is not None:
+        supplies["warehouse_days_left"] = (
+            round(supplies["warehouse_days_left"] / AI_PREDICTIONS_DAYS_STEP) * AI_PREDICTIONS_DAYS_STEP
+        )
+    counters.update(supplies)
+    counters["day"] = datetime.now(timezone.utc).strftime('%Y%m%d')
+    return counters
+
+def prediction_fingerprint(counters: dict) -> str:
+    return hashlib.sha1(json.dumps(counters, sort_keys=True).encode()).hexdigest()
+
+async def generate_ai_predictions(counters: dict) -> List[AIPrediction]:
+    """Ask the LLM for predictions; raises if the LLM call fails"""
+    context = f"""Sistema BM MANAGER - Datos actuales:
+- Total locales: {counters["total_stores"]}
+- Locales offline: {counters["offline_stores"]}
+- Dispositivos con problemas: {counters["problematic_devices"]} de {counters["total_devices"]}
+- Próximo peak estacional: {counters["next_peak"]} en {counters["days_to_next_peak"]} días
+- Consumo diario pronosticado: {counters["paper_rolls_per_day"]} rollos de papel térmico en los locales
+- Stock en bodega: {", ".join(f'{rolls} rollos {SUPPLY_CATALOG[sku]["name"]}' for sku, rolls in counters["warehouse_rolls"].items())}
+- Cobertura de la bodega: {counters["warehouse_days_left"]} días (horizonte {SUPPLY_FORECAST_DAYS})
 - Próxima calibración programada: 10 marzo 2025
 """
-        
-        # Initialize LLM client
-        llm_chat = LlmChat(
-            api_key=os.environ.get('EMERGENT_LLM_KEY'),
-            session_id=f"ai-predictions-{datetime.now().strftime('%Y%m%d')}",
-            system_message="Eres un asistente de IA especializado en análisis predictivo para sistemas de balanzas de supermercados Walmart en Chile. Generas insights valiosos basados en datos del sistema."
-        ).with_model("openai", "gpt-4o")
-        
-        prompt = f"""{context}
+    
+    # Initialize LLM client
+    llm_chat = LlmChat(
+        api_key=os.environ.get('EMERGENT_LLM_KEY'),
+        session_id=f"ai-predictions-{counters['day']}",
+        system_message="Eres un asistente de IA especializado en análisis predictivo para sistemas de balanzas de supermercados Walmart en Chile. Generas insights valiosos basados en datos del sistema."
+    ).with_model("openai", "gpt-4o")
+    
+    prompt = f"""{context}
 
 Genera 5 predicciones/sugerencias relevantes y accionables para el sistema BM MANAGER. Cada predicción debe:
 - Ser específica y basada en los datos proporcionados
@@ -476,22 +2053,37 @@ Formato requerido (JSON):
   }}
 ]"""
 
-        user_message = UserMessage(text=prompt)
-        response = await llm_chat.send_message(user_message)
-        
-        # Try to parse JSON response, fallback to predefined predictions if needed
+    user_message = UserMessage(text=prompt)
+    response = await llm_chat.send_message(user_message)
+    
+    # Try to parse JSON response, fallback to predefined predictions if needed
+    try:
+        predictions_data = json.loads(response.strip())
+        predictions = [AIPrediction(**pred) for pred in predictions_data]
+    except Exception:
+        predictions = get_fallback_predictions()
+    
+    return predictions[:5]
+
+async def refresh_ai_predictions_periodically():
+    """Keep the prediction cache warm so requests never wait on the LLM"""
+    while True:
         try:
-            import json
-            predictions_data = json.loads(response.strip())
-            predictions = []
-            for pred in predictions_data:
-                predictions.append(AIPrediction(**pred))
-        except:
-            # Fallback to predefined predictions
-            predictions = get_fallback_predictions()
-        
-        return predictions[:5]
-        
+            counters = await fetch_prediction_context()
+            key = prediction_fingerprint(counters)
+            if not prediction_cache.is_fresh(key):
+                await prediction_cache.refresh(key, lambda: generate_ai_predictions(counters))
+        except Exception as e:
+            logger.error(f"Error refreshing AI predictions: {str(e)}")
+        await asyncio.sleep(AI_PREDICTIONS_REFRESH_INTERVAL)
+
+@api_router.get("/ai-predictions", response_model=List[AIPrediction])
+async def get_ai_predictions():
+    """Get AI-generated predictions based on system data (served from cache)"""
+    try:
+        counters = await fetch_prediction_context()
+        key = prediction_fingerprint(counters)
+        return await prediction_cache.get(key, lambda: generate_ai_predictions(counters))
     except Exception as e:
         logger.error(f"Error generating AI predictions: {str(e)}")
         # Return fallback predictions on error
@@ -533,23 +2125,2876 @@ def get_fallback_predictions():
     ]
 
 @api_router.post("/tickets", response_model=Ticket)
-async def create_ticket(ticket_data: dict):
+async def create_ticket(ticket_data: TicketCreate):
     """Create a new support ticket"""
-    try:
-        ticket = Ticket(**ticket_data)
-        await db.tickets.insert_one(ticket.dict())
-        return ticket
-    except Exception as e:
-        raise HTTPException(status_code=400, detail=f"Error creating ticket: {str(e)}")
+    ticket = Ticket(**ticket_data.dict())
+    ticket.updated_at = datetime.fromisoformat(ticket.created_at)
+    await route_db("critical").tickets.insert_one(ticket.dict())
+    await refresh_obsolescence({"id": ticket.device_id})
+    return ticket
+
+def ticket_filters(status: Optional[str], reported_to: Optional[str], sap_code: Optional[str],
+                   created_from: Optional[datetime], created_to: Optional[datetime]) -> dict:
+    query = {}
+    if status:
+        query["status"] = csv_filter(status)
+    if reported_to:
+        query["reported_to"] = csv_filter(reported_to)
+    if sap_code:
+        query["sap_code"] = csv_filter(sap_code)
+    # created_at is an ISO string; compare against UTC ISO strings
+    created = {}
+    for operator, value in (("$gte", created_from), ("$lt", created_to)):
+        if value is not None:
+            if value.tzinfo is None:
+                value = value.replace(tzinfo=timezone.utc)
+            created[operator] = value.astimezone(timezone.utc).isoformat()
+    if created:
+        query["created_at"] = created
+    return query
 
 @api_router.get("/tickets", response_model=List[Ticket])
-async def get_tickets():
-    """Get all support tickets"""
+async def get_tickets(
+    status: Optional[str] = None,
+    reported_to: Optional[str] = None,
+    sap_code: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    limit: int = Query(TICKET_PAGE_DEFAULT, ge=1, le=TICKET_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    """Support tickets, newest first; `X-Next-Cursor` carries the next page cursor"""
+    query = ticket_filters(status, reported_to, sap_code, created_from, created_to)
+    if cursor:
+        last_created, last_id = decode_cursor(cursor, 2)
+        page = {"$or": [
+            {"created_at": {"$lt": last_created}},
+            {"created_at": last_created, "id": {"$gt": last_id}},
+        ]}
+        query = {"$and": [query, page]} if query else page
+    
+    tickets = await db.tickets.find(query, model_projection(Ticket)).sort(
+        [("created_at", -1), ("id", 1)]
+    ).limit(limit).to_list(limit)
+    headers = {}
+    if len(tickets) == limit:
+        headers["X-Next-Cursor"] = encode_cursor(tickets[-1]["created_at"], tickets[-1]["id"])
+    return list_response(tickets, Ticket, headers)
+
+def ticket_sla_group(key: str) -> list:
+    return [
+        {"$group": {
+            "_id": key,
+            "total": {"$sum": 1},
+            "pending": {"$sum": {"$cond": [{"$eq": ["$status", "Pendiente"]}, 1, 0]}},
+            "in_progress": {"$sum": {"$cond": [{"$eq": ["$status", "En Proceso"]}, 1, 0]}},
+            "resolved": {"$sum": {"$cond": [{"$eq": ["$status", "Resuelto"]}, 1, 0]}},
+            "mean_hours_to_resolve": {"$avg": "$resolution_hours"},
+        }},
+        {"$project": {
+            "_id": 0,
+            "key": {"$ifNull": ["$_id", ""]},
+            "total": 1, "pending": 1, "in_progress": 1, "resolved": 1,
+            "backlog": {"$subtract": ["$total", "$resolved"]},
+            "mean_hours_to_resolve": {"$round": ["$mean_hours_to_resolve", 1]},
+        }},
+        {"$sort": {"backlog": -1, "key": 1}},
+    ]
+
+@api_router.get("/tickets/sla", response_model=TicketSla)
+async def get_ticket_sla(
+    reported_to: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+):
+    """Backlog and mean time to resolve per provider and per comuna, aggregated in the database"""
+    result = await route_db("analytics").tickets.aggregate([
+        {"$match": ticket_filters(None, reported_to, None, created_from, created_to)},
+        {"$project": {"_id": 0, "reported_to": 1, "store_comuna": 1, "status": 1, "resolution_hours": 1}},
+        {"$facet": {
+            "by_provider": ticket_sla_group("$reported_to"),
+            "by_comuna": ticket_sla_group("$store_comuna"),
+        }},
+    ]).to_list(1)
+    return result[0] if result else {"by_provider": [], "by_comuna": []}
+
+@api_router.patch("/tickets/{ticket_id}", response_model=Ticket)
+async def update_ticket(ticket_id: str, ticket_data: TicketUpdate):
+    """Move a ticket along Pendiente → En Proceso → Resuelto and/or reassign it"""
+    changes = ticket_data.dict(exclude_unset=True)
+    if not changes:
+        raise HTTPException(status_code=400, detail="No ticket fields to update")
+    ticket = await db.tickets.find_one({"id": ticket_id}, {"_id": 0})
+    if not ticket:
+        raise HTTPException(status_code=404, detail="Ticket not found")
+    
+    query = {"id": ticket_id}
+    status = changes.get("status")
+    if status and status != ticket["status"]:
+        timestamp_field = TICKET_TRANSITIONS.get((ticket["status"], status))
+        if not timestamp_field:
+            raise HTTPException(status_code=409, detail=f"Cannot move a ticket from {ticket['status']} to {status}")
+        now = datetime.now(timezone.utc)
+        changes[timestamp_field] = now.isoformat()
+        if status == "Resuelto":
+            created = datetime.fromisoformat(ticket["created_at"])
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            changes["resolution_hours"] = round((now - created).total_seconds() / 3600, 2)
+        # Only apply the move if no other request changed the status meanwhile
+        query["status"] = ticket["status"]
+    changes["updated_at"] = datetime.now(timezone.utc)
+    
+    result = await route_db("critical").tickets.update_one(query, {"$set": changes})
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Ticket status changed concurrently, retry")
+    if "resolution_hours" in changes:
+        await refresh_obsolescence({"id": ticket["device_id"]})
+    return {**ticket, **changes}
+
+# =================== EXPORT ===================
+
+def export_since(field: str, since: Optional[datetime], as_string: bool) -> dict:
+    """Filter on documents changed after `since` (ISO strings compare in UTC)"""
+    if since is None:
+        return {}
+    if since.tzinfo is None:
+        since = since.replace(tzinfo=timezone.utc)
+    since = since.astimezone(timezone.utc)
+    return {field: {"$gt": since.isoformat() if as_string else since}}
+
+def export_cell(value):
+    if isinstance(value, (dict, list)):
+        return dump_json(value).decode()
+    if isinstance(value, datetime):
+        return value.isoformat()
+    return value
+
+async def export_chunks(cursor, columns: List[str], format: str):
+    """Encode the cursor one batch at a time so memory does not grow with the collection"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, lineterminator="\n")
+    lines = []
+    
+    def flush() -> bytes:
+        if format == "csv":
+            data = buffer.getvalue().encode()
+            buffer.seek(0)
+            buffer.truncate()
+        else:
+            data = b"".join(line + b"\n" for line in lines)
+            lines.clear()
+        return data
+    
+    if format == "csv":
+        writer.writerow(columns)
+    count = 0
+    async for document in cursor:
+        if format == "csv":
+            writer.writerow([export_cell(document.get(column)) for column in columns])
+        else:
+            lines.append(dump_json(document))
+        count += 1
+        if count % EXPORT_BATCH_SIZE == 0:
+            yield flush()
+    data = flush()
+    if data:
+        yield data
+
+async def gzip_chunks(chunks):
+    compressor = zlib.compressobj(wbits=16 + zlib.MAX_WBITS)  # gzip container
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(name: str, collection, query: dict, model, format: str, compress: bool) -> StreamingResponse:
+    columns = [field for field in model.model_fields if field != "devices"]
+    cursor = collection.find(query, {"_id": 0, **{column: 1 for column in columns}}) \
+        .sort("id", 1).batch_size(EXPORT_BATCH_SIZE)
+    chunks = export_chunks(cursor, columns, format)
+    filename = f"{name}.{format}"
+    media_type = "text/csv" if format == "csv" else "application/x-ndjson"
+    if compress:
+        chunks = gzip_chunks(chunks)
+        filename += ".gz"
+        media_type = "application/gzip"
+    return StreamingResponse(chunks, media_type=media_type,
+                             headers={"Content-Disposition": f'attachment; filename="{filename}"'})
+
+@api_router.get("/export/stores")
+async def export_stores(
+    comuna: Optional[str] = None,
+    status: Optional[str] = None,
+    sales_level: Optional[str] = None,
+    device_type: Optional[str] = None,
+    since: Optional[datetime] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+):
+    """Stream every matching store (without devices, see /export/devices).
+
+    `since` exports only stores written after it (edits, telemetry and rollup changes).
+    """
+    query = {**store_filters(comuna, status, sales_level), **export_since("updated_at", since, False)}
+    if device_type:
+        query["rollup.types"] = csv_filter(device_type)
+    return export_response("stores", route_db("analytics").stores, query, Store, format, gzip)
+
+@api_router.get("/export/devices")
+async def export_devices(
+    store_id: Optional[str] = None,
+    type: Optional[str] = None,
+    status: Optional[str] = None,
+    firmware_version: Optional[str] = None,
+    since: Optional[datetime] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+):
+    """Stream every matching device; `since` exports only devices written after it"""
+    query = export_since("updated_at", since, False)
+    if store_id:
+        query["store_id"] = csv_filter(store_id)
+    if type:
+        query["type"] = csv_filter(type)
+    if status:
+        query["status"] = csv_filter(status)
+    if firmware_version:
+        query["firmware_version"] = csv_filter(firmware_version)
+    return export_response("devices", route_db("analytics").devices, query, Device, format, gzip)
+
+@api_router.get("/export/tickets")
+async def export_tickets(
+    status: Optional[str] = None,
+    reported_to: Optional[str] = None,
+    sap_code: Optional[str] = None,
+    created_from: Optional[datetime] = None,
+    created_to: Optional[datetime] = None,
+    since: Optional[datetime] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+):
+    """Stream tickets with the /tickets filters; `since` exports only tickets created or updated after it"""
+    query = {**ticket_filters(status, reported_to, sap_code, created_from, created_to),
+             **export_since("updated_at", since, False)}
+    return export_response("tickets", route_db("analytics").tickets, query, Ticket, format, gzip)
+
+@api_router.get("/export/alerts")
+async def export_alerts(
+    resolved: Optional[bool] = False,
+    since: Optional[datetime] = None,
+    format: Literal["ndjson", "csv"] = "ndjson",
+    gzip: bool = False,
+):
+    """Stream alerts (unresolved by default, as in /alerts); `since` exports only
+    alerts raised, reopened or resolved after it"""
+    query = export_since("updated_at", since, False)
+    if resolved is not None:
+        query["resolved"] = resolved
+    return export_response("alerts", route_db("analytics").alerts, query, Alert, format, gzip)
+
+# =================== ASSETS ===================
+
+def asset_bucket() -> AsyncIOMotorGridFSBucket:
+    return AsyncIOMotorGridFSBucket(db, bucket_name="asset_files")
+
+def render_display_image(data: bytes) -> tuple:
+    """Scale an image down to the display resolution and re-encode it"""
+    try:
+        with Image.open(io.BytesIO(data)) as image:
+            # Pillow only warns below twice its pixel limit; reject before decoding
+            if Image.MAX_IMAGE_PIXELS and image.width * image.height > Image.MAX_IMAGE_PIXELS:
+                raise Image.DecompressionBombError(
+                    f"{image.width * image.height} pixels exceeds limit of {Image.MAX_IMAGE_PIXELS} pixels")
+            image = ImageOps.exif_transpose(image)
+            image.thumbnail(ASSET_DISPLAY_SIZE, Image.LANCZOS)
+            if ASSET_DISPLAY_FORMAT == "JPEG" and image.mode != "RGB":
+                image = image.convert("RGB")
+            output = io.BytesIO()
+            image.save(output, ASSET_DISPLAY_FORMAT, quality=85, optimize=True)
+            return output.getvalue(), Image.MIME[ASSET_DISPLAY_FORMAT], image.width, image.height
+    except Image.DecompressionBombError as e:
+        raise HTTPException(status_code=413, detail=f"Image too large: {str(e)}")
+    except (UnidentifiedImageError, OSError) as e:
+        raise HTTPException(status_code=415, detail=f"Unsupported image: {str(e)}")
+
+async def ingest_asset(data: bytes) -> dict:
+    """Store an uploaded image once per distinct display rendition"""
+    if len(data) > ASSET_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Assets are limited to {ASSET_MAX_BYTES} bytes")
+    source_sha256 = hashlib.sha256(data).hexdigest()
+    asset = await db.assets.find_one({"source_sha256": source_sha256}, {"_id": 0})
+    if asset:
+        return asset
+    
+    rendition, content_type, width, height = await asyncio.to_thread(render_display_image, data)
+    sha256 = hashlib.sha256(rendition).hexdigest()
+    try:
+        await asset_bucket().upload_from_stream_with_id(sha256, sha256, rendition,
+                                                        metadata={"contentType": content_type})
+    except DuplicateKeyError:
+        pass  # same rendition from a different upload
+    asset = Asset(sha256=sha256, url=f"/api/assets/{sha256}", content_type=content_type,
+                  size=len(rendition), width=width, height=height).dict()
+    asset.pop("source_sha256")
+    return await route_db("critical").assets.find_one_and_update(
+        {"sha256": sha256},
+        {"$setOnInsert": asset, "$addToSet": {"source_sha256": source_sha256}},
+        projection={"_id": 0},
+        upsert=True,
+        return_document=ReturnDocument.AFTER
+    )
+
+async def externalize_images(value):
+    """Replace inline data-URL images in a package by asset URLs"""
+    if isinstance(value, dict):
+        return {key: await externalize_images(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [await externalize_images(item) for item in value]
+    if isinstance(value, str) and value.startswith("data:image/") and ";base64," in value:
+        try:
+            data = base64.b64decode(value.split(",", 1)[1], validate=True)
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Invalid data URL image")
+        return (await ingest_asset(data))["url"]
+    return value
+
+def asset_references(package) -> List[str]:
+    return sorted(set(ASSET_URL_RE.findall(dump_json(package).decode())))
+
+@api_router.post("/assets", response_model=Asset)
+async def upload_asset(request: Request):
+    """Upload an image in a single request (raw body)"""
+    return await ingest_asset(await request.body())
+
+@api_router.post("/assets/uploads", response_model=AssetUpload)
+async def create_asset_upload():
+    """Start a chunked upload; send chunks of at most `chunk_size` bytes"""
+    upload = AssetUpload(chunk_size=ASSET_CHUNK_SIZE)
+    await db.asset_uploads.insert_one(upload.dict())
+    return upload
+
+@api_router.put("/assets/uploads/{upload_id}/chunks/{index}")
+async def upload_asset_chunk(upload_id: str, index: int, request: Request):
+    data = await request.body()
+    if index < 0 or index * ASSET_CHUNK_SIZE >= ASSET_MAX_BYTES:
+        raise HTTPException(status_code=413, detail=f"Assets are limited to {ASSET_MAX_BYTES} bytes")
+    if not data or len(data) > ASSET_CHUNK_SIZE:
+        raise HTTPException(status_code=400, detail=f"Chunks must hold 1 to {ASSET_CHUNK_SIZE} bytes")
+    upload = await db.asset_uploads.find_one({"id": upload_id}, {"_id": 0, "created_at": 1})
+    if not upload:
+        raise HTTPException(status_code=404, detail="Upload not found")
+    # Re-sending a chunk replaces it, so interrupted uploads can resume
+    await db.asset_upload_chunks.replace_one(
+        {"upload_id": upload_id, "index": index},
+        {"upload_id": upload_id, "index": index, "data": data, "created_at": upload["created_at"]},
+        upsert=True
+    )
+    return {"success": True, "index": index, "size": len(data)}
+
+@api_router.post("/assets/uploads/{upload_id}/complete", response_model=Asset)
+async def complete_asset_upload(upload_id: str, completion: AssetUploadComplete):
+    if not await db.asset_uploads.count_documents({"id": upload_id}, limit=1):
+        raise HTTPException(status_code=404, detail="Upload not found")
+    chunks = await db.asset_upload_chunks.find(
+        {"upload_id": upload_id}, {"_id": 0, "index": 1, "data": 1}
+    ).sort("index", 1).to_list(None)
+    if [chunk["index"] for chunk in chunks] != list(range(len(chunks))) or not chunks:
+        raise HTTPException(status_code=400, detail="Upload is missing chunks")
+    data = b"".join(chunk["data"] for chunk in chunks)
+    if completion.sha256 and hashlib.sha256(data).hexdigest() != completion.sha256.lower():
+        raise HTTPException(status_code=400, detail="Upload does not match its SHA-256")
+    asset = await ingest_asset(data)
+    await db.asset_upload_chunks.delete_many({"upload_id": upload_id})
+    await db.asset_uploads.delete_one({"id": upload_id})
+    return asset
+
+def parse_range(header: str, size: int) -> tuple:
+    """First range of a `bytes=` Range header as inclusive (start, end)"""
+    match = re.fullmatch(r"bytes=(\d*)-(\d*)(,.*)?", header.strip())
+    if not match or not (match.group(1) or match.group(2)):
+        return None
+    if match.group(1):
+        start = int(match.group(1))
+        end = min(int(match.group(2)), size - 1) if match.group(2) else size - 1
+    else:  # suffix range: the last N bytes
+        start, end = max(0, size - int(match.group(2))), size - 1
+    if start > end or start >= size:
+        raise HTTPException(status_code=416, detail="Requested range not satisfiable",
+                            headers={"Content-Range": f"bytes */{size}"})
+    return start, end
+
+@api_router.get("/assets/{sha256}")
+async def get_asset(sha256: str, request: Request):
+    """Serve an asset; content-addressed, so ETags are strong and caching is permanent"""
+    try:
+        grid_out = await asset_bucket().open_download_stream(sha256)
+    except NoFile:
+        raise HTTPException(status_code=404, detail="Asset not found")
+    etag = f'"{sha256}"'
+    headers = {
+        "ETag": etag,
+        "Accept-Ranges": "bytes",
+        "Cache-Control": "public, max-age=31536000, immutable",
+    }
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+    
+    size = grid_out.length
+    start, end, status_code = 0, size - 1, 200
+    byte_range = request.headers.get("range")
+    if byte_range and request.headers.get("if-range", etag) == etag:
+        parsed = parse_range(byte_range, size)
+        if parsed:
+            (start, end), status_code = parsed, 206
+            headers["Content-Range"] = f"bytes {start}-{end}/{size}"
+    headers["Content-Length"] = str(end - start + 1)
+    
+    async def body():
+        grid_out.seek(start)
+        remaining = end - start + 1
+        while remaining > 0:
+            data = await grid_out.read(min(ASSET_STREAM_CHUNK, remaining))
+            if not data:
+                break
+            remaining -= len(data)
+            yield data
+    
+    content_type = (grid_out.metadata or {}).get("contentType", "application/octet-stream")
+    return StreamingResponse(body(), status_code=status_code, media_type=content_type, headers=headers)
+
+# =================== DEPLOYMENTS ===================
+
+class DeploymentError(Exception):
+    """A store could not take the package; the attempt is retried"""
+
+    def __init__(self, message: str, bytes_sent: int = 0):
+        super().__init__(message)
+        self.bytes_sent = bytes_sent
+
+class DeploymentLeaseLost(Exception):
+    """Another worker took over the deployment; this one stops without recording anything"""
+
+async def resolve_deployment_targets(store_ids: Optional[List[str]],
+                                     device_types: Optional[List[str]]) -> List[DeploymentStore]:
+    """Stores with at least one matching device, in SAP code order"""
+    match = {}
+    if store_ids:
+        match["store_id"] = {"$in": store_ids}
+    if device_types:
+        match["type"] = {"$in": device_types}
+    pipeline = [{"$match": match}, {"$group": {"_id": "$store_id", "count": {"$sum": 1}}}]
+    counts = {row["_id"]: row["count"] async for row in db.devices.aggregate(pipeline)}
+    stores = db.stores.find({"id": {"$in": list(counts)}}, {"_id": 0, "id": 1, "name": 1}).sort("sap_code", 1)
+    return [
+        DeploymentStore(store_id=store["id"], store_name=store["name"], device_count=counts[store["id"]])
+        async for store in stores
+    ]
+
+async def deliver_package(deployment: dict, store_id: str, gateway: Optional[httpx.AsyncClient]) -> int:
+    """Push the package to the store's target devices that do not have it yet.
+
+    Only the assets the store has not received before are sent; returns
+    the number of asset bytes sent.
+    """
+    content_field = f"content.{deployment['kind']}"
+    query = {"store_id": store_id, f"{content_field}.deployment_id": {"$ne": deployment["id"]}}
+    if deployment.get("device_types"):
+        query["type"] = {"$in": deployment["device_types"]}
+    devices = await db.devices.find(query, {"_id": 0, "id": 1, "status": 1}).to_list(None)
+    reachable = [d["id"] for d in devices if d["status"] != "offline"]
+    bytes_sent = 0
+    if reachable:
+        store = await db.stores.find_one({"id": store_id}, {"_id": 0, "assets": 1}) or {}
+        missing = [sha256 for sha256 in deployment.get("assets", []) if sha256 not in set(store.get("assets", []))]
+        if gateway is not None:
+            try:
+                response = await gateway.post(f"/stores/{store_id}/packages", json={
+                    "deployment_id": deployment["id"],
+                    "kind": deployment["kind"],
+                    "package_hash": deployment["package_hash"],
+                    "package": deployment.get("package"),
+                    "campaign_id": deployment.get("campaign_id"),
+                    "assets": [f"/api/assets/{sha256}" for sha256 in missing],
+                    "devices": reachable,
+                })
+            except httpx.HTTPError as e:
+                raise DeploymentError(f"Gateway no disponible: {e.__class__.__name__}")
+            if response.status_code >= 400:
+                raise DeploymentError(f"Gateway respondió {response.status_code}")
+        if missing:
+            await db.stores.update_one({"id": store_id}, {"$addToSet": {"assets": {"$each": missing}}})
+            bytes_sent = sum(deployment["asset_sizes"].get(sha256, 0) for sha256 in missing)
+        await db.devices.update_many({"id": {"$in": reachable}}, {"$set": {content_field: {
+            "deployment_id": deployment["id"],
+            "package_hash": deployment["package_hash"],
+            "deployed_at": datetime.now(timezone.utc),
+        }}})
+    offline = len(devices) - len(reachable)
+    if offline:
+        raise DeploymentError(f"{offline} balanzas sin conexión", bytes_sent)
+    return bytes_sent
+
+class DeploymentEngine:
+    """Runs deployments with a bounded pool of store workers.
+
+    Every store outcome is written to the `deployments` document as soon as
+    it is known, so a restarted server resumes with the stores still
+    pending. A server process claims a deployment with a lease it renews
+    while running, so with several workers each deployment runs in exactly
+    one of them and expired leases are taken over. Progress is pushed on
+    the `deployments` stream topic.
+    """
+
+    def __init__(self):
+        self._jobs = {}
+        self._progress = {}
+        self._gateway = None
+        self._owner = str(uuid.uuid4())
+        self._resume = None
+
+    def start(self):
+        if DEPLOYMENT_GATEWAY_URL:
+            self._gateway = httpx.AsyncClient(base_url=DEPLOYMENT_GATEWAY_URL, timeout=DEPLOYMENT_STORE_TIMEOUT)
+        self._resume = asyncio.create_task(self._resume_pending())
+
+    async def stop(self):
+        if self._resume is not None:
+            self._resume.cancel()
+        for task in list(self._jobs.values()):
+            task.cancel()
+        if self._gateway is not None:
+            await self._gateway.aclose()
+
+    def _claimable(self, now: datetime) -> dict:
+        """Active deployments with no live lease held by another worker"""
+        return {
+            "status": {"$in": ["queued", "running"]},
+            "$or": [
+                {"lease_owner": None},
+                {"lease_owner": self._owner},
+                {"lease_expires_at": {"$lt": now}},
+            ],
+        }
+
+    async def _resume_pending(self):
+        """Pick up deployments left by a restarted or dead worker once their lease expires"""
+        while True:
+            try:
+                async for deployment in db.deployments.find(self._claimable(datetime.now(timezone.utc)),
+                                                            {"_id": 0, "id": 1}):
+                    if deployment["id"] not in self._jobs:
+                        logger.info(f"Resuming deployment {deployment['id']}")
+                        self.submit(deployment["id"])
+            except Exception as e:
+                logger.error(f"Error resuming deployments: {str(e)}")
+            await asyncio.sleep(DEPLOYMENT_LEASE_SECONDS)
+
+    async def _claim(self, deployment_id: str) -> Optional[dict]:
+        """Take the lease of a deployment; None when it is finished or another worker holds it"""
+        now = datetime.now(timezone.utc)
+        return await db.deployments.find_one_and_update(
+            {"id": deployment_id, **self._claimable(now)},
+            {"$set": {"status": "running", "lease_owner": self._owner,
+                      "lease_expires_at": now + timedelta(seconds=DEPLOYMENT_LEASE_SECONDS)}},
+            projection={"_id": 0},
+            return_document=ReturnDocument.AFTER
+        )
+
+    async def _renew_lease(self, deployment_id: str):
+        """Extend the lease while running; stop the run when it was lost or the deployment cancelled"""
+        while True:
+            await asyncio.sleep(DEPLOYMENT_LEASE_SECONDS / 3)
+            result = await db.deployments.update_one(
+                {"id": deployment_id, "status": "running", "lease_owner": self._owner},
+                {"$set": {"lease_expires_at": datetime.now(timezone.utc) + timedelta(seconds=DEPLOYMENT_LEASE_SECONDS)}}
+            )
+            if result.matched_count == 0:
+                logger.warning(f"Deployment {deployment_id} lease lost, stopping")
+                self.cancel(deployment_id)
+                return
+
+    def submit(self, deployment_id: str):
+        if deployment_id in self._jobs:
+            return
+        task = asyncio.create_task(self._run(deployment_id))
+        self._jobs[deployment_id] = task
+        task.add_done_callback(lambda _: self._jobs.pop(deployment_id, None))
+
+    def cancel(self, deployment_id: str):
+        task = self._jobs.get(deployment_id)
+        if task:
+            task.cancel()
+
+    async def _run(self, deployment_id: str):
+        deployment = await self._claim(deployment_id)
+        if not deployment:
+            return
+        heartbeat = asyncio.create_task(self._renew_lease(deployment_id))
+        try:
+            await self._execute(deployment)
+        except asyncio.CancelledError:
+            raise
+        except DeploymentLeaseLost:
+            logger.warning(f"Deployment {deployment_id} taken over by another worker")
+        except Exception as e:
+            logger.exception(f"Deployment {deployment_id} failed")
+            result = await db.deployments.update_one(
+                {"id": deployment_id, "status": "running", "lease_owner": self._owner},
+                {"$set": {"status": "failed", "error": str(e), "finished_at": datetime.now(timezone.utc)}}
+            )
+            if result.matched_count:
+                deployment["status"] = "failed"
+                self._publish(deployment, {"failures": []})
+        finally:
+            heartbeat.cancel()
+            self._progress.pop(deployment_id, None)
+            await db.deployments.update_one(
+                {"id": deployment_id, "lease_owner": self._owner},
+                {"$set": {"lease_owner": None, "lease_expires_at": None}}
+            )
+
+    async def _execute(self, deployment: dict):
+        deployment_id = deployment["id"]
+        if not deployment.get("started_at"):
+            deployment["started_at"] = datetime.now(timezone.utc)
+            await db.deployments.update_one({"id": deployment_id}, {"$set": {"started_at": deployment["started_at"]}})
+        deployment["asset_sizes"] = {
+            asset["sha256"]: asset["size"]
+            async for asset in db.assets.find({"sha256": {"$in": deployment.get("assets", [])}},
+                                              {"_id": 0, "sha256": 1, "size": 1})
+        }
+        self._progress[deployment_id] = {"published": 0.0, "failures": []}
+        
+        queue = asyncio.Queue()
+        for store in deployment["stores"]:
+            if store["status"] == "pending":
+                queue.put_nowait(store)
+        workers = [
+            asyncio.create_task(self._worker(deployment, queue))
+            for _ in range(min(DEPLOYMENT_CONCURRENCY, queue.qsize()))
+        ]
+        try:
+            await asyncio.gather(*workers)
+        except BaseException:
+            for worker in workers:
+                worker.cancel()
+            raise
+        result = await db.deployments.update_one(
+            {"id": deployment_id, "status": "running", "lease_owner": self._owner},
+            {"$set": {
+                "status": "partial" if deployment["failed_stores"] else "completed",
+                "finished_at": datetime.now(timezone.utc),
+            }}
+        )
+        progress = self._progress.pop(deployment_id, None)
+        
+        if result.matched_count:
+            deployment["status"] = "partial" if deployment["failed_stores"] else "completed"
+            if deployment.get("campaign_id"):
+                # Re-sync the campaign counter with the recorded per-store outcomes
+                await db.campaigns.update_one({"id": deployment["campaign_id"]},
+                                              {"$set": {"deployed_count": deployment["deployed_count"]}})
+            self._publish(deployment, progress)
+            logger.info(f"Deployment {deployment_id} {deployment['status']}: "
+                        f"{deployment['deployed_stores']}/{deployment['total_stores']} stores")
+
+    async def _worker(self, deployment: dict, queue: asyncio.Queue):
+        while not queue.empty():
+            await self._deploy_store(deployment, queue.get_nowait())
+
+    async def _deploy_store(self, deployment: dict, store: dict):
+        error = None
+        bytes_sent = 0
+        for attempt in range(1, DEPLOYMENT_MAX_ATTEMPTS + 1):
+            try:
+                bytes_sent += await asyncio.wait_for(deliver_package(deployment, store["store_id"], self._gateway),
+                                                     DEPLOYMENT_STORE_TIMEOUT)
+                error = None
+                break
+            except asyncio.TimeoutError:
+                error = f"Sin respuesta en {DEPLOYMENT_STORE_TIMEOUT:g}s"
+            except DeploymentError as e:
+                error = str(e)
+                bytes_sent += e.bytes_sent
+            if attempt < DEPLOYMENT_MAX_ATTEMPTS:
+                await asyncio.sleep(DEPLOYMENT_RETRY_BACKOFF * 2 ** (attempt - 1))
+        
+        query = {"store_id": store["store_id"], f"content.{deployment['kind']}.deployment_id": deployment["id"]}
+        if deployment.get("device_types"):
+            query["type"] = {"$in": deployment["device_types"]}
+        delivered = await db.devices.count_documents(query)
+        newly_delivered = delivered - store["deployed_devices"]  # retries count earlier deliveries once
+        status = "failed" if error else "deployed"
+        counter = "failed_stores" if error else "deployed_stores"
+        result = await db.deployments.update_one(
+            # A worker that lost its lease must not count the store a second time
+            {"id": deployment["id"], "lease_owner": self._owner, "stores.store_id": store["store_id"]},
+            {
+                "$set": {
+                    "stores.$.status": status,
+                    "stores.$.attempts": attempt,
+                    "stores.$.error": error,
+                    "stores.$.deployed_devices": delivered,
+                    "stores.$.finished_at": datetime.now(timezone.utc),
+                },
+                "$inc": {counter: 1, "deployed_count": newly_delivered, "bytes_sent": bytes_sent,
+                         "stores.$.bytes_sent": bytes_sent},
+            }
+        )
+        if result.matched_count == 0:
+            raise DeploymentLeaseLost(deployment["id"])
+        if deployment.get("campaign_id") and delivered:
+            await db.campaigns.update_one(
+                {"id": deployment["campaign_id"]},
+                {"$inc": {"deployed_count": newly_delivered}, "$addToSet": {"stores_applied": store["store_id"]}}
+            )
+        
+        deployment[counter] += 1
+        deployment["deployed_count"] += newly_delivered
+        deployment["bytes_sent"] += bytes_sent
+        progress = self._progress[deployment["id"]]
+        if error:
+            progress["failures"].append({"store_id": store["store_id"], "store_name": store["store_name"], "error": error})
+        if time.monotonic() - progress["published"] >= DEPLOYMENT_PROGRESS_INTERVAL:
+            self._publish(deployment, progress)
+
+    @staticmethod
+    def _publish(deployment: dict, progress: dict):
+        """Push the counters and the store failures since the previous event"""
+        progress["published"] = time.monotonic()
+        stream_hub.publish({"topic": "deployments", "failures": progress["failures"], **{
+            key: deployment.get(key) for key in ("id", "kind", "campaign_id", "status", "total_stores",
+                                                 "total_balances", "deployed_stores", "failed_stores",
+                                                 "deployed_count", "package_bytes", "bytes_sent")
+        }})
+        progress["failures"] = []
+
+deployment_engine = DeploymentEngine()
+
+@api_router.post("/deployments", response_model=Deployment)
+async def create_deployment(payload: DeploymentCreate):
+    """Start deploying a campaign or self-service flow to the target stores"""
+    campaign = None
+    if payload.kind == "campaign":
+        campaign = await db.campaigns.find_one({"id": payload.campaign_id}, {"_id": 0}) if payload.campaign_id else None
+        if not campaign:
+            raise HTTPException(status_code=404, detail="Campaign not found")
+        package = {"campaign_id": campaign["id"], "wallpaper_url": campaign["wallpaper_url"]}
+    else:
+        if not payload.package:
+            raise HTTPException(status_code=400, detail="Self-service flow deployments need a package")
+        # Inline images become assets so each store only downloads what it lacks
+        package = await externalize_images(payload.package)
+    encoded = dump_json(package)
+    if len(encoded) > DEPLOYMENT_PACKAGE_MAX_BYTES:
+        raise HTTPException(status_code=413, detail="Deployment package is too large")
+    
+    stores = await resolve_deployment_targets(payload.store_ids, payload.device_types)
+    if not stores:
+        raise HTTPException(status_code=400, detail="No stores match the deployment targets")
+    assets = asset_references(package)
+    sizes = await db.assets.find({"sha256": {"$in": assets}}, {"_id": 0, "size": 1}).to_list(None)
+    deployment = Deployment(
+        kind=payload.kind,
+        campaign_id=payload.campaign_id if campaign else None,
+        package=package if payload.kind == "self_service_flow" else None,
+        package_hash=hashlib.sha256(encoded).hexdigest(),
+        assets=assets,
+        package_bytes=sum(asset["size"] for asset in sizes),
+        device_types=payload.device_types,
+        total_stores=len(stores),
+        total_balances=sum(store.device_count for store in stores),
+        stores=stores
+    )
+    await route_db("critical").deployments.insert_one(deployment.dict())
+    if campaign:
+        await db.campaigns.update_one({"id": campaign["id"]}, {"$set": {
+            "deployed_count": 0, "total_balances": deployment.total_balances, "stores_applied": []
+        }})
+    deployment_engine.submit(deployment.id)
+    return deployment
+
+@api_router.get("/deployments", response_model=List[Deployment])
+async def get_deployments(limit: int = Query(50, ge=1, le=500)):
+    """Recent deployments without their per-store detail"""
+    deployments = await db.deployments.find({}, DEPLOYMENT_SUMMARY_PROJECTION) \
+        .sort("created_at", -1).limit(limit).to_list(limit)
+    return list_response(deployments, Deployment)
+
+@api_router.get("/deployments/{deployment_id}", response_model=Deployment)
+async def get_deployment(deployment_id: str):
+    deployment = await db.deployments.find_one({"id": deployment_id}, {"_id": 0})
+    if not deployment:
+        raise HTTPException(status_code=404, detail="Deployment not found")
+    return deployment
+
+@api_router.post("/deployments/{deployment_id}/retry")
+async def retry_deployment(deployment_id: str):
+    """Queue the failed stores of a finished deployment again"""
+    result = await db.deployments.update_one(
+        {"id": deployment_id, "status": {"$in": ["partial", "cancelled", "failed"]}},
+        {
+            "$set": {"stores.$[s].status": "pending", "stores.$[s].error": None,
+                     "status": "queued", "failed_stores": 0, "finished_at": None, "error": None},
+        },
+        array_filters=[{"s.status": {"$in": ["failed", "pending"]}}]
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Only partial, cancelled or failed deployments can be retried")
+    deployment_engine.submit(deployment_id)
+    return {"success": True}
+
+@api_router.post("/deployments/{deployment_id}/cancel")
+async def cancel_deployment(deployment_id: str):
+    result = await db.deployments.update_one(
+        {"id": deployment_id, "status": {"$in": ["queued", "running"]}},
+        {"$set": {"status": "cancelled", "finished_at": datetime.now(timezone.utc)}}
+    )
+    if result.matched_count == 0:
+        raise HTTPException(status_code=409, detail="Deployment is not running")
+    deployment_engine.cancel(deployment_id)
+    return {"success": True}
+
+# =================== TELEMETRY ===================
+
+def parse_telemetry_payload(body: bytes, content_type: str) -> list:
+    """Decode an NDJSON, msgpack or JSON array telemetry batch into raw items"""
+    if "msgpack" in content_type:
+        if msgpack is None:
+            raise HTTPException(status_code=415, detail="msgpack payloads are not supported on this server")
+        try:
+            items = msgpack.unpackb(body, timestamp=3)
+        except Exception as e:
+            raise HTTPException(status_code=400, detail=f"Invalid msgpack payload: {str(e)}")
+    elif "ndjson" in content_type or "jsonlines" in content_type:
+        items = []
+        for line in body.splitlines():
+            if not line.strip():
+                continue
+            try:
+                items.append(json.loads(line))
+            except ValueError:
+                items.append(None)  # rejected below, keeps line numbers aligned
+    else:
+        try:
+            items = json.loads(body)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid JSON payload: {str(e)}")
+    if not isinstance(items, list):
+        raise HTTPException(status_code=400, detail="Telemetry batch must be a list of readings")
+    if len(items) > TELEMETRY_BATCH_MAX:
+        raise HTTPException(status_code=413, detail=f"Batch exceeds {TELEMETRY_BATCH_MAX} readings")
+    return items
+
+def coalesce_readings(readings: List[TelemetryReading], weighed: Optional[List[TelemetryReading]] = None) -> dict:
+    """Merge readings per store and device: the latest value of each field wins
+    and the weights of `weighed` (a subset of `readings`, all of them by
+    default) are summed."""
+    stores = {}
+    for reading in sorted(readings, key=lambda r: r.timestamp):
+        device = stores.setdefault(reading.store_id, {}).setdefault(
+            reading.device_id, {"set": {}, "weight_kg": 0.0, "last_seen": reading.timestamp}
+        )
+        for field in TELEMETRY_DEVICE_FIELDS:
+            value = getattr(reading, field)
+            if value is not None:
+                device["set"][field] = value
+        device["last_seen"] = reading.timestamp
+    for reading in readings if weighed is None else weighed:
+        stores[reading.store_id][reading.device_id]["weight_kg"] += reading.weight_kg or 0
+    return stores
+
+def build_device_telemetry_update(store_id: str, device_id: str, changes: dict, now: datetime) -> UpdateOne:
+    update = {"$set": {**changes["set"], "updated_at": now}, "$max": {"last_seen": changes["last_seen"]}}
+    if changes["weight_kg"]:
+        update["$inc"] = {"weight_total_kg": changes["weight_kg"]}
+    return UpdateOne({"id": device_id, "store_id": store_id}, update)
+
+@api_router.post("/telemetry/batch", response_model=TelemetryBatchResult)
+async def ingest_telemetry_batch(request: Request):
+    """Ingest device readings (NDJSON, msgpack or a JSON array).
+
+    Readings are coalesced per device and applied with a single bulk_write,
+    so throughput scales with batch size rather than request count.
+    """
+    items = parse_telemetry_payload(await request.body(), request.headers.get("content-type", ""))
+    
+    results = [TelemetryItemResult(index=i, accepted=False) for i in range(len(items))]
+    readings = {}
+    for i, item in enumerate(items):
+        if not isinstance(item, dict):
+            results[i].error = "Reading must be an object"
+            continue
+        try:
+            readings[i] = TelemetryReading(**item)
+        except Exception as e:
+            results[i].error = str(e)
+    
+    # Resolve which store/device pairs exist with a single projected query
+    device_ids = list({r.device_id for r in readings.values()})
+    known = set()
+    device_types = {}
+    async for device in db.devices.find({"id": {"$in": device_ids}}, {"_id": 0, "id": 1, "store_id": 1, "type": 1}):
+        known.add((device["store_id"], device["id"]))
+        device_types[device["id"]] = device.get("type")
+    
+    accepted = []
+    for i, reading in readings.items():
+        if (reading.store_id, reading.device_id) in known:
+            results[i].accepted = True
+            accepted.append(reading)
+        else:
+            results[i].error = "Unknown store or device"
+    
+    # Readings of a retried batch update the device fields again but are counted once
+    fresh = claimed_readings(accepted, await claim_weight_readings(accepted))
+    await record_weight_readings([
+        WeightReading(
+            store_id=r.store_id,
+            device_id=r.device_id,
+            product=r.product,
+            weight_kg=r.weight_kg,
+            amount=r.amount,
+            timestamp=r.timestamp,
+            reading_id=r.reading_id
+        )
+        for r in fresh if r.product and r.weight_kg
+    ], device_types, claim=False)
+    
+    await record_paper_consumption(fresh)
+    
+    stores = coalesce_readings(accepted, fresh)
+    if stores:
+        now = datetime.now(timezone.utc)
+        await route_db("telemetry").devices.bulk_write([
+            build_device_telemetry_update(store_id, device_id, changes, now)
+            for store_id, devices in stores.items() for device_id, changes in devices.items()
+        ], ordered=False)
+        await db.stores.update_many(
+            {"id": {"$in": list(stores)}},
+            {"$set": {"last_update": now.isoformat(), "updated_at": now}}
+        )
+        await refresh_store_rollups({"id": {"$in": list(stores)}})
+        await refresh_maintenance_scores({"id": {"$in": list({r.device_id for r in accepted})}})
+        await evaluate_alerts({"id": {"$in": list(stores)}})
+    
+    return TelemetryBatchResult(
+        accepted=len(accepted),
+        rejected=len(items) - len(accepted),
+        stores_updated=len(stores),
+        items=results
+    )
+
+# =================== ALERT RULES ===================
+
+ALERT_STORE_PROJECTION = {"_id": 0, "id": 1, "name": 1, "comuna": 1, "latency": 1, "network_status": 1}
+ALERT_DEVICE_PROJECTION = {
+    "_id": 0, "id": 1, "store_id": 1, "type": 1, "last_calibration": 1, "label_status": 1, "printhead_life": 1,
+}
+
+def store_alert_rules(store: dict) -> list:
+    """(rule, type, priority, message) of every store rule firing for `store`"""
+    fired = []
+    latency = store.get("latency") or 0
+    if latency > ALERT_LATENCY_MAX_MS:
+        fired.append(("high_latency", "network", "medium", f"Latencia alta ({latency} ms)"))
+    if store.get("network_status") == "unstable":
+        fired.append(("network_unstable", "network", "medium", "Conexión de red inestable"))
+    return fired
+
+def device_alert_rules(device: dict, now: datetime) -> list:
+    """(rule, type, priority, message) of every device rule firing for `device`"""
+    fired = []
+    name = f"Balanza {device.get('type', '')}".strip()
+    calibrated = device.get("last_calibration")
+    # Overdue once `(now - last_calibration).days > CALIBRATION_WINDOW_DAYS`, as in /metrics
+    if calibrated and (now - calibrated).days > CALIBRATION_WINDOW_DAYS:
+        fired.append(("calibration_overdue", "calibration", "medium",
+                      f"{name}: calibración vencida hace {(now - calibrated).days} días"))
+    if device.get("label_status") == "replace":
+        fired.append(("labels_replace", "maintenance", "medium", f"{name}: reemplazar rollo de etiquetas"))
+    printhead_life = device.get("printhead_life")
+    if printhead_life is not None and printhead_life < ALERT_PRINTHEAD_MIN:
+        fired.append(("printhead_low", "maintenance", "high", f"{name}: cabezal de impresión al {printhead_life}%"))
+    return fired
+
+def alert_dedup_key(store_id: str, device_id: Optional[str], rule: str) -> str:
+    return f"{store_id}:{device_id or '-'}:{rule}"
+
+async def evaluate_alerts(query: dict):
+    """Raise and clear rule alerts for the stores matching `query`.
+
+    Each (store, device, rule) owns one alert document keyed by `dedup_key`:
+    re-evaluating a firing rule writes nothing, a rule that stops firing
+    resolves its alert and firing again later reopens the same document.
+    Alerts resolved by hand stay resolved while their rule keeps firing.
+    """
+    now = datetime.now(timezone.utc)
+    stores = await db.stores.find(query, ALERT_STORE_PROJECTION).to_list(None)
+    if not stores:
+        return
+    store_ids = [store["id"] for store in stores]
+    devices = defaultdict(list)
+    async for device in db.devices.find({"store_id": {"$in": store_ids}}, ALERT_DEVICE_PROJECTION):
+        devices[device["store_id"]].append(device)
+    
+    firing = {}
+    for store in stores:
+        store_name = f"{store.get('name', '')} - {store.get('comuna', '')}"
+        fired = [(None, rule) for rule in store_alert_rules(store)]
+        fired += [(device["id"], rule) for device in devices[store["id"]] for rule in device_alert_rules(device, now)]
+        for device_id, (rule, alert_type, priority, message) in fired:
+            firing[alert_dedup_key(store["id"], device_id, rule)] = Alert(
+                store_id=store["id"],
+                store_name=store_name,
+                type=alert_type,
+                message=message,
+                priority=priority,
+                created_at=now.isoformat(),
+                rule=rule,
+                device_id=device_id,
+                updated_at=now
+            ).dict()
+    
+    existing = {
+        alert["dedup_key"]: alert
+        async for alert in db.alerts.find(
+            {"store_id": {"$in": store_ids}, "dedup_key": {"$exists": True}, "type": {"$ne": "fraud"}},
+            {"_id": 0, "dedup_key": 1, "active": 1, "message": 1, "priority": 1}
+        )
+    }
+    requests = []
+    for key, alert in firing.items():
+        current = existing.get(key)
+        if current is None:
+            requests.append(InsertOne({**alert, "dedup_key": key, "active": True}))
+        elif not current.get("active"):
+            # The rule had cleared: reopen the alert as a new occurrence
+            requests.append(UpdateOne({"dedup_key": key}, {"$set": {
+                "active": True, "resolved": False, "created_at": alert["created_at"],
+                "message": alert["message"], "priority": alert["priority"], "updated_at": now,
+            }}))
+        elif (current.get("message"), current.get("priority")) != (alert["message"], alert["priority"]):
+            requests.append(UpdateOne({"dedup_key": key}, {"$set": {
+                "message": alert["message"], "priority": alert["priority"], "updated_at": now,
+            }}))
+    cleared = [key for key, alert in existing.items() if alert.get("active") and key not in firing]
+    if cleared:
+        requests.append(UpdateMany({"dedup_key": {"$in": cleared}},
+                                   {"$set": {"active": False, "resolved": True, "updated_at": now}}))
+    if requests:
+        try:
+            await db.alerts.bulk_write(requests, ordered=False)
+        except BulkWriteError as e:
+            # A concurrent evaluation inserted the same dedup_key first
+            if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+
+async def sweep_calibration_alerts_periodically():
+    """Evaluate the stores whose devices went past the calibration window since the last sweep"""
+    previous_cutoff = None
+    while True:
+        try:
+            cutoff = datetime.now(timezone.utc) - timedelta(days=CALIBRATION_WINDOW_DAYS + 1)
+            window = {"$lte": cutoff} if previous_cutoff is None else {"$gt": previous_cutoff, "$lte": cutoff}
+            store_ids = await db.devices.distinct("store_id", {"last_calibration": window})
+            if store_ids:
+                await evaluate_alerts({"id": {"$in": store_ids}})
+            previous_cutoff = cutoff
+        except Exception as e:
+            logger.error(f"Error sweeping calibration alerts: {str(e)}")
+        await asyncio.sleep(ALERT_SWEEP_INTERVAL)
+
+# =================== FRAUD DETECTION ===================
+
+FRAUD_BINS = FRAUD_MAX_GRAMS // FRAUD_BIN_GRAMS
+FRAUD_REFERENCE_GRAMS = np.array([grams for _, grams in FRAUD_REFERENCE_ITEMS], dtype=np.float64)
+
+class DeviceWeightWindow:
+    """The last FRAUD_WINDOW weighings of one device.
+
+    Ring buffers hold each weighing's weight bin, product code and matching
+    reference item (-1 for none); `histogram` counts the bins in the ring and
+    is updated by adding the new bins and removing the evicted ones.
+    """
+    __slots__ = ("bins", "products", "matches", "histogram", "position", "size", "flagged")
+
+    def __init__(self):
+        self.bins = np.zeros(FRAUD_WINDOW, dtype=np.int16)
+        self.products = np.zeros(FRAUD_WINDOW, dtype=np.int16)
+        self.matches = np.full(FRAUD_WINDOW, -1, dtype=np.int8)
+        self.histogram = np.zeros(FRAUD_BINS + 1, dtype=np.int16)  # last bin: over FRAUD_MAX_GRAMS
+        self.position = 0
+        self.size = 0
+        self.flagged = set()
+
+    def push(self, bins: np.ndarray, products: np.ndarray, matches: np.ndarray):
+        bins, products, matches = bins[-FRAUD_WINDOW:], products[-FRAUD_WINDOW:], matches[-FRAUD_WINDOW:]
+        slots = (self.position + np.arange(len(bins))) % FRAUD_WINDOW
+        evicted = self.bins[slots[slots < self.size]] if self.size < FRAUD_WINDOW else self.bins[slots]
+        self.histogram -= np.bincount(evicted, minlength=FRAUD_BINS + 1).astype(np.int16)
+        self.histogram += np.bincount(bins, minlength=FRAUD_BINS + 1).astype(np.int16)
+        self.bins[slots] = bins
+        self.products[slots] = products
+        self.matches[slots] = matches
+        self.position = (self.position + len(bins)) % FRAUD_WINDOW
+        self.size = min(FRAUD_WINDOW, self.size + len(bins))
+
+class FraudDetector:
+    """Streaming fraud detection over the weighings of self-service scales.
+
+    Two detectors run on each device's window after every batch:
+    - repeated_weight: FRAUD_REPEAT_MIN weighings within one bin either side
+      of the same weight, which produce sold by weight rarely does.
+    - product_mismatch: FRAUD_MISMATCH_MIN weighings matching the weight of a
+      packaged item from FRAUD_REFERENCE_ITEMS while labelled as produce, e.g.
+      a 335 g soda can weighed as avocados.
+    A detector fires once and re-arms when its count falls under half its
+    threshold, so a device keeps at most one alert write per episode. Memory is
+    bounded by FRAUD_MAX_DEVICES windows, least recently seen evicted first.
+    Each worker sees only the batches it ingests.
+    """
+
+    def __init__(self):
+        self._windows = OrderedDict()
+        self._products: List[str] = []
+        self._product_codes = {}
+        self.events = 0
+
+    def _window(self, device_id: str) -> DeviceWeightWindow:
+        window = self._windows.get(device_id)
+        if window is None:
+            window = self._windows[device_id] = DeviceWeightWindow()
+            if len(self._windows) > FRAUD_MAX_DEVICES:
+                self._windows.popitem(last=False)
+        else:
+            self._windows.move_to_end(device_id)
+        return window
+
+    def _product_code(self, product: str) -> int:
+        code = self._product_codes.get(product)
+        if code is None:
+            code = self._product_codes[product] = len(self._products)
+            self._products.append(product)
+        return code
+
+    def observe(self, readings: List[WeightReading], device_types: dict) -> List[dict]:
+        """Feed a batch of weighings; returns the detections that fired"""
+        by_device = defaultdict(list)
+        for reading in readings:
+            if device_types.get(reading.device_id) in FRAUD_DEVICE_TYPES:
+                by_device[(reading.store_id, reading.device_id)].append(reading)
+        detections = []
+        for (store_id, device_id), device_readings in by_device.items():
+            device_readings.sort(key=lambda r: r.timestamp)
+            grams = np.array([r.weight_kg * 1000 for r in device_readings])
+            bins = np.clip(grams // FRAUD_BIN_GRAMS, 0, FRAUD_BINS).astype(np.int16)
+            distance = np.abs(grams[:, None] - FRAUD_REFERENCE_GRAMS[None, :])
+            matches = np.where(distance.min(axis=1) <= FRAUD_MATCH_GRAMS, distance.argmin(axis=1), -1).astype(np.int8)
+            products = np.array([self._product_code(r.product) for r in device_readings], dtype=np.int16)
+            window = self._window(device_id)
+            window.push(bins, products, matches)
+            self.events += len(device_readings)
+            for rule, count, message in self._detect(window, bins, device_types[device_id]):
+                detections.append({"store_id": store_id, "device_id": device_id, "rule": rule,
+                                   "count": count, "message": message})
+        return detections
+
+    def _detect(self, window: DeviceWeightWindow, bins: np.ndarray, device_type: str):
+        # Weighings within one bin of each new weighing (the overflow bin never counts)
+        near = np.convolve(window.histogram[:FRAUD_BINS], np.ones(3, dtype=np.int16), mode="same")
+        candidates = np.unique(bins[bins < FRAUD_BINS])
+        repeated = (int(near[candidates].max()), int(candidates[near[candidates].argmax()])) if len(candidates) else (0, 0)
+        
+        matched = window.matches[:window.size]
+        matched = matched[matched >= 0]
+        per_item = np.bincount(matched, minlength=len(FRAUD_REFERENCE_ITEMS))
+        item = int(per_item.argmax())
+        mismatches = int(per_item[item])
+        
+        if self._fires(window, "product_mismatch", mismatches, FRAUD_MISMATCH_MIN):
+            item_products = window.products[:window.size][window.matches[:window.size] == item]
+            product = self._products[int(np.bincount(item_products).argmax())]
+            name, grams = FRAUD_REFERENCE_ITEMS[item]
+            yield "product_mismatch", mismatches, (
+                f"Balanza {device_type}: {mismatches} pesajes de ~{grams} g registrados como {product} "
+                f"(coincide con {name})"
+            )
+        count, weight_bin = repeated
+        # Repeats of a reference item are already reported as a mismatch
+        grams = (weight_bin + 0.5) * FRAUD_BIN_GRAMS
+        if mismatches >= FRAUD_MISMATCH_MIN and np.abs(FRAUD_REFERENCE_GRAMS - grams).min() <= FRAUD_MATCH_GRAMS:
+            count = 0
+        if self._fires(window, "repeated_weight", count, FRAUD_REPEAT_MIN):
+            yield "repeated_weight", count, (
+                f"Balanza {device_type}: {count} de los últimos {window.size} pesajes pesan ~{grams:.0f} g"
+            )
+
+    def _fires(self, window: DeviceWeightWindow, rule: str, count: int, threshold: int) -> bool:
+        if rule in window.flagged:
+            if count < threshold / 2:
+                window.flagged.discard(rule)  # re-arm
+            return False
+        if count >= threshold:
+            window.flagged.add(rule)
+            return True
+        return False
+
+    async def ingest(self, readings: List[WeightReading], device_types: dict):
+        detections = self.observe(readings, device_types)
+        if detections:
+            await raise_fraud_alerts(detections)
+
+fraud_detector = FraudDetector()
+
+async def raise_fraud_alerts(detections: List[dict]):
+    """Open (or reopen) one `fraud` alert per (store, device, rule)"""
+    now = datetime.now(timezone.utc).isoformat()
+    store_ids = list({d["store_id"] for d in detections})
+    stores = {
+        store["id"]: f"{store.get('name', '')} - {store.get('comuna', '')}"
+        async for store in db.stores.find({"id": {"$in": store_ids}}, {"_id": 0, "id": 1, "name": 1, "comuna": 1})
+    }
+    requests = []
+    for detection in detections:
+        key = alert_dedup_key(detection["store_id"], detection["device_id"], detection["rule"])
+        alert = Alert(
+            store_id=detection["store_id"],
+            store_name=stores.get(detection["store_id"], ""),
+            type="fraud",
+            message=detection["message"],
+            priority="high",
+            created_at=now,
+            rule=detection["rule"],
+            device_id=detection["device_id"]
+        ).dict()
+        reopened = {field: alert.pop(field) for field in ("message", "created_at", "resolved", "updated_at")}
+        requests.append(UpdateOne(
+            {"dedup_key": key},
+            {"$set": {**reopened, "active": True}, "$setOnInsert": {**alert, "dedup_key": key}},
+            upsert=True
+        ))
+    try:
+        await db.alerts.bulk_write(requests, ordered=False)
+    except BulkWriteError as e:
+        if any(error.get("code") != 11000 for error in e.details.get("writeErrors", [])):
+            raise
+
+# =================== SALES ANALYTICS ===================
+
+async def update_sales_cubes(readings: List[WeightReading], device_types: dict):
+    """Fold readings into the hourly and daily store × product × device type cubes"""
+    telemetry_db = route_db("telemetry")
+    for bucket, collection in SALES_CUBES.items():
+        cells = defaultdict(lambda: [0, 0.0, 0.0])
+        for r in readings:
+            cell = cells[(truncate_date(r.timestamp, bucket), r.store_id, r.product,
+                          device_types.get(r.device_id) or "unknown")]
+            cell[0] += 1
+            cell[1] += r.weight_kg
+            cell[2] += r.amount or 0
+        await telemetry_db[collection].bulk_write([
+            UpdateOne(
+                {"period": period, "store_id": store_id, "product": product, "device_type": device_type},
+                {"$inc": {"transactions": transactions, "kg": kg, "amount": amount}},
+                upsert=True
+            )
+            for (period, store_id, product, device_type), (transactions, kg, amount) in cells.items()
+        ], ordered=False)
+
+@api_router.get("/analytics/sales", response_model=List[SalesRow])
+async def get_sales_analytics(
+    group_by: str = "store_id",
+    granularity: Literal["hour", "day"] = "day",
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    store_id: Optional[str] = None,
+    product: Optional[str] = None,
+    device_type: Optional[str] = None,
+    limit: int = Query(SALES_ROWS_MAX, ge=1, le=SALES_ROWS_MAX),
+):
+    """Sales totals read from the pre-aggregated cubes, never from raw readings.
+
+    Rows are grouped by any of store_id, product, device_type and period (the
+    hour or day bucket of `granularity`), largest amount first or
+    chronologically when grouped by period. The range defaults to the last
+    SALES_DEFAULT_DAYS days; `start` is rounded down to its bucket.
+    """
+    fields = [f.strip() for f in group_by.split(",") if f.strip()]
+    unknown = set(fields) - set(SALES_GROUP_FIELDS)
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown group_by fields: {', '.join(sorted(unknown))}")
+    end = end or datetime.now(timezone.utc)
+    start = start or end - timedelta(days=SALES_DEFAULT_DAYS)
+    if start.tzinfo is None:
+        start = start.replace(tzinfo=timezone.utc)
+    if end.tzinfo is None:
+        end = end.replace(tzinfo=timezone.utc)
+    
+    match = {"period": {"$gte": truncate_date(start, granularity), "$lt": end}}
+    for field, value in (("store_id", store_id), ("product", product), ("device_type", device_type)):
+        if value:
+            match[field] = csv_filter(value)
+    sort = {"_id.period": 1, "amount": -1} if "period" in fields else {"amount": -1}
+    rows = await route_db("analytics")[SALES_CUBES[granularity]].aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {field: f"${field}" for field in fields} if fields else None,
+            "transactions": {"$sum": "$transactions"},
+            "kg": {"$sum": "$kg"},
+            "amount": {"$sum": "$amount"},
+        }},
+        {"$sort": sort},
+        {"$limit": limit},
+    ]).to_list(limit)
+    return [
+        SalesRow(
+            **(row["_id"] or {}),
+            transactions=row["transactions"],
+            kg=round(row["kg"], 3),
+            amount=round(row["amount"]),
+            avg_ticket=round(row["amount"] / row["transactions"]) if row["transactions"] else 0,
+            kg_per_transaction=round(row["kg"] / row["transactions"], 3) if row["transactions"] else 0
+        )
+        for row in rows
+    ]
+
+# =================== PREDICTIVE MAINTENANCE ===================
+
+MAINTENANCE_DEVICE_PROJECTION = {
+    "_id": 0, "id": 1, "store_id": 1, "type": 1, "status": 1, "installation_date": 1,
+    "last_calibration": 1, "avg_consumption": 1, "printhead_life": 1,
+}
+
+def score_devices(devices: List[dict], transactions: dict, now: datetime) -> dict:
+    """Score a batch of devices at once with column arrays.
+
+    Every factor is normalized to 0-1 and the risk is their mean on a 0-100
+    scale; component wear follows the age and load of each device.
+    """
+    day = 86400.0
+    installed = np.array([datetime.fromisoformat(d["installation_date"]).timestamp() for d in devices])
+    calibrated = np.array([d["last_calibration"].timestamp() for d in devices])
+    consumption = np.array([d.get("avg_consumption") or 0 for d in devices], dtype=float)
+    printhead_life = np.array([d.get("printhead_life", 100) for d in devices], dtype=float)
+    monthly = np.array([transactions.get(d["id"], 0) for d in devices], dtype=float)
+    
+    age_months = np.maximum(now.timestamp() - installed, 0) / (30 * day)
+    days_since_calibration = np.maximum(now.timestamp() - calibrated, 0) / day
+    factors = np.clip(np.vstack([
+        consumption / MAINTENANCE_MAX_CONSUMPTION,
+        age_months / MAINTENANCE_LIFETIME_MONTHS,
+        days_since_calibration / CALIBRATION_WINDOW_DAYS,
+        monthly / MAINTENANCE_MONTHLY_TRANSACTIONS,
+        1 - printhead_life / 100,
+    ]), 0, 1)
+    risk = factors.mean(axis=0) * 100
+    
+    load = monthly * age_months
+    components = {
+        "printHead": 100 - printhead_life,
+        "display": age_months / MAINTENANCE_LIFETIME_MONTHS * 100,
+        **{name: load / rated * 100 for name, rated in COMPONENT_WEAR_LOAD.items()},
+    }
+    return {
+        "risk": risk,
+        "priority": np.select([risk >= 70, risk >= 40], ["high", "medium"], "low"),
+        "days_until": np.maximum(1, np.floor(90 - risk * 0.9)).astype(int),
+        "cost": (50_000 + risk / 100 * 200_000).astype(int),
+        "age_months": age_months.astype(int),
+        "days_since_calibration": days_since_calibration.astype(int),
+        "monthly": monthly.astype(int),
+        "consumption": consumption,
+        "components": {name: np.clip(wear, 0, 100) for name, wear in components.items()},
+    }
+
+async def count_monthly_transactions(device_ids: Optional[List[str]], now: datetime) -> dict:
+    """Weighings reported per device over the last 30 days, from the `device_daily` rollups
+    so the cost does not grow with the stored readings"""
+    match = {"day": {"$gte": truncate_date(now, "day") - timedelta(days=29)}}
+    if device_ids is not None:
+        match["device_id"] = {"$in": device_ids}
+    pipeline = [
+        {"$match": match},
+        {"$group": {"_id": "$device_id", "count": {"$sum": "$count"}}},
+    ]
+    return {row["_id"]: row["count"] async for row in db.device_daily.aggregate(pipeline)}
+
+async def backfill_device_daily():
+    """Build the `device_daily` rollups of the last 30 days from the raw readings"""
+    pipeline = [
+        {"$match": {"ts": {"$gte": truncate_date(datetime.now(timezone.utc), "day") - timedelta(days=29)}}},
+        {"$group": {
+            "_id": {"device_id": "$meta.device_id", "year": {"$year": "$ts"}, "month": {"$month": "$ts"},
+                    "day": {"$dayOfMonth": "$ts"}},
+            "count": {"$sum": 1},
+        }},
+    ]
+    requests = [
+        UpdateOne(
+            {"day": datetime(row["_id"]["year"], row["_id"]["month"], row["_id"]["day"], tzinfo=timezone.utc),
+             "device_id": row["_id"]["device_id"]},
+            {"$set": {"count": row["count"]}},
+            upsert=True
+        )
+        async for row in db.weight_readings.aggregate(pipeline)
+    ]
+    if requests:
+        await db.device_daily.bulk_write(requests, ordered=False)
+
+async def refresh_maintenance_scores(query: dict):
+    """Recompute the `maintenance_scores` documents of the devices matching `query`"""
+    now = datetime.now(timezone.utc)
+    devices = await db.devices.find(query, MAINTENANCE_DEVICE_PROJECTION).to_list(None)
+    if devices:
+        store_ids = list({d["store_id"] for d in devices})
+        stores = {
+            store["id"]: store
+            async for store in db.stores.find({"id": {"$in": store_ids}}, {"_id": 0, "id": 1, "name": 1, "comuna": 1})
+        }
+        transactions = await count_monthly_transactions([d["id"] for d in devices] if query else None, now)
+        scores = score_devices(devices, transactions, now)
+        requests = []
+        for i, device in enumerate(devices):
+            store = stores.get(device["store_id"], {})
+            days_until = int(scores["days_until"][i])
+            score = MaintenanceScore(
+                device_id=device["id"],
+                store_id=device["store_id"],
+                store_name=store.get("name", ""),
+                comuna=store.get("comuna", ""),
+                device_type=device["type"],
+                status=device["status"],
+                maintenance_risk=round(float(scores["risk"][i]), 1),
+                priority=str(scores["priority"][i]),
+                next_maintenance_date=truncate_date(now, "day") + timedelta(days=days_until),
+                days_until_maintenance=days_until,
+                last_calibration=device["last_calibration"],
+                days_since_calibration=int(scores["days_since_calibration"][i]),
+                age_months=int(scores["age_months"][i]),
+                daily_consumption=float(scores["consumption"][i]),
+                monthly_transactions=int(scores["monthly"][i]),
+                components=ComponentWear(**{
+                    name: round(float(wear[i]), 1) for name, wear in scores["components"].items()
+                }),
+                estimated_cost=int(scores["cost"][i]),
+                computed_at=now
+            )
+            requests.append(ReplaceOne({"device_id": device["id"]}, score.dict(), upsert=True))
+        await db.maintenance_scores.bulk_write(requests, ordered=False)
+    if not query:
+        # A full rescore also drops the scores of removed devices
+        await db.maintenance_scores.delete_many({"computed_at": {"$lt": now}})
+
+async def refresh_maintenance_scores_periodically():
+    """Rescore the whole fleet so age and calibration factors advance with time"""
+    while True:
+        try:
+            await refresh_maintenance_scores({})
+        except Exception as e:
+            logger.error(f"Error refreshing maintenance scores: {str(e)}")
+        await asyncio.sleep(MAINTENANCE_REFRESH_INTERVAL)
+
+def maintenance_filters(priority: Optional[str], store_id: Optional[str], comuna: Optional[str],
+                        device_type: Optional[str]) -> dict:
+    query = {}
+    if priority:
+        query["priority"] = csv_filter(priority)
+    if store_id:
+        query["store_id"] = csv_filter(store_id)
+    if comuna:
+        query["comuna"] = csv_filter(comuna)
+    if device_type:
+        query["device_type"] = csv_filter(device_type)
+    return query
+
+@api_router.get("/maintenance/scores", response_model=List[MaintenanceScore])
+async def get_maintenance_scores(
+    response: Response,
+    priority: Optional[str] = None,
+    store_id: Optional[str] = None,
+    comuna: Optional[str] = None,
+    device_type: Optional[str] = None,
+    min_risk: Optional[float] = None,
+    limit: int = Query(MAINTENANCE_PAGE_DEFAULT, ge=1, le=MAINTENANCE_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    """Device maintenance scores, highest risk first.
+
+    The next maintenance date and cost grow monotonically with the risk, so
+    this order is also the order by date and by cost.
+    """
+    query = maintenance_filters(priority, store_id, comuna, device_type)
+    if min_risk is not None:
+        query["maintenance_risk"] = {"$gte": min_risk}
+    if cursor:
+        last_risk, last_id = decode_cursor(cursor, 2)
+        query["$or"] = [
+            {"maintenance_risk": {"$lt": last_risk}},
+            {"maintenance_risk": last_risk, "device_id": {"$gt": last_id}},
+        ]
+    
+    scores = await db.maintenance_scores.find(query, {"_id": 0}).sort(
+        [("maintenance_risk", -1), ("device_id", 1)]
+    ).limit(limit).to_list(limit)
+    if len(scores) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(scores[-1]["maintenance_risk"], scores[-1]["device_id"])
+    return scores
+
+@api_router.get("/maintenance/summary", response_model=MaintenanceSummary)
+async def get_maintenance_summary(
+    store_id: Optional[str] = None,
+    comuna: Optional[str] = None,
+    device_type: Optional[str] = None,
+):
+    pipeline = [
+        {"$match": maintenance_filters(None, store_id, comuna, device_type)},
+        {"$group": {
+            "_id": None,
+            "total": {"$sum": 1},
+            "high": {"$sum": {"$cond": [{"$eq": ["$priority", "high"]}, 1, 0]}},
+            "medium": {"$sum": {"$cond": [{"$eq": ["$priority", "medium"]}, 1, 0]}},
+            "low": {"$sum": {"$cond": [{"$eq": ["$priority", "low"]}, 1, 0]}},
+            "avg_risk": {"$avg": "$maintenance_risk"},
+            "total_estimated_cost": {"$sum": "$estimated_cost"},
+            "overdue_calibrations": {"$sum": {"$cond": [
+                {"$gt": ["$days_since_calibration", CALIBRATION_WINDOW_DAYS]}, 1, 0
+            ]}},
+        }},
+    ]
+    result = await route_db("analytics").maintenance_scores.aggregate(pipeline).to_list(1)
+    if not result:
+        return MaintenanceSummary(total=0, high=0, medium=0, low=0, avg_risk=0,
+                                  total_estimated_cost=0, overdue_calibrations=0)
+    return MaintenanceSummary(**{**result[0], "avg_risk": round(result[0]["avg_risk"] or 0, 1)})
+
+# =================== OBSOLESCENCE ===================
+
+OBSOLESCENCE_DEVICE_PROJECTION = {
+    "_id": 0, "id": 1, "store_id": 1, "type": 1, "firmware_version": 1,
+    "installation_date": 1, "last_calibration": 1,
+}
+
+def firmware_key(version: str) -> tuple:
+    """Sortable form of a "v2.3.1" firmware version"""
+    return tuple(int(part) for part in re.findall(r"\d+", version or ""))
+
+async def ticket_history(device_ids: Optional[List[str]], now: datetime) -> dict:
+    """Failures, downtime (hours) and last failure per device over the
+    OBSOLESCENCE_FAILURE_WINDOW_DAYS window; open tickets count as down until now."""
+    query = {"created_at": {"$gte": (now - timedelta(days=OBSOLESCENCE_FAILURE_WINDOW_DAYS)).isoformat()}}
+    if device_ids is not None:
+        query["device_id"] = {"$in": device_ids}
+    history = defaultdict(lambda: {"failures": 0, "downtime": 0.0, "last_failure": None})
+    projection = {"_id": 0, "device_id": 1, "created_at": 1, "resolution_hours": 1}
+    async for ticket in db.tickets.find(query, projection):
+        device = history[ticket["device_id"]]
+        device["failures"] += 1
+        hours = ticket.get("resolution_hours")
+        if hours is None:
+            created = datetime.fromisoformat(ticket["created_at"])
+            if created.tzinfo is None:
+                created = created.replace(tzinfo=timezone.utc)
+            hours = max((now - created).total_seconds() / 3600, 0)
+        device["downtime"] += hours
+        device["last_failure"] = max(device["last_failure"] or "", ticket["created_at"])
+    return history
+
+def score_obsolescence(devices: List[dict], history: dict, latest_firmware: tuple, now: datetime) -> dict:
+    """Score a batch of devices at once with column arrays.
+
+    Points for age (20 past the warranty, 40 past the lifetime), failures
+    (8 each per month), downtime (up to 30 at OBSOLESCENCE_MAX_DOWNTIME_HOURS
+    per month), an expired warranty (20) and outdated firmware (10), capped at 100.
+    """
+    months = OBSOLESCENCE_FAILURE_WINDOW_DAYS / 30
+    installed = np.array([datetime.fromisoformat(d["installation_date"]).timestamp() for d in devices])
+    failures = np.array([history[d["id"]]["failures"] if d["id"] in history else 0 for d in devices]) / months
+    downtime = np.array([history[d["id"]]["downtime"] if d["id"] in history else 0 for d in devices]) / months
+    outdated = np.array([firmware_key(d.get("firmware_version")) < latest_firmware for d in devices])
+    
+    age_years = np.maximum(now.timestamp() - installed, 0) / (365 * 86400)
+    warranty_expired = age_years > OBSOLESCENCE_WARRANTY_YEARS
+    score = np.minimum(
+        np.select([age_years > OBSOLESCENCE_LIFETIME_YEARS, warranty_expired], [40, 20], 0)
+        + failures * 8
+        + np.minimum(downtime / OBSOLESCENCE_MAX_DOWNTIME_HOURS, 1) * 30
+        + warranty_expired * 20
+        + outdated * 10,
+        100
+    )
+    return {
+        "score": score,
+        "priority": np.select([score >= 70, score >= 40], ["high", "medium"], "low"),
+        "needs_attention": (score > 60) | (age_years > OBSOLESCENCE_LIFETIME_YEARS) | (failures > 3),
+        "age_years": age_years,
+        "warranty_expired": warranty_expired,
+        "failures": failures,
+        "downtime": downtime,
+        "outdated": outdated,
+    }
+
+async def refresh_obsolescence(query: dict):
+    """Recompute the `obsolescence` documents of the devices matching `query`,
+    then the `obsolescence_totals` cube"""
+    now = datetime.now(timezone.utc)
+    devices = await db.devices.find(query, OBSOLESCENCE_DEVICE_PROJECTION).to_list(None)
+    if devices:
+        store_ids = list({d["store_id"] for d in devices})
+        stores = {
+            store["id"]: store
+            async for store in db.stores.find({"id": {"$in": store_ids}}, {"_id": 0, "id": 1, "name": 1, "comuna": 1})
+        }
+        history = await ticket_history([d["id"] for d in devices] if query else None, now)
+        latest_firmware = max(map(firmware_key, await db.devices.distinct("firmware_version")), default=())
+        scores = score_obsolescence(devices, history, latest_firmware, now)
+        requests = []
+        for i, device in enumerate(devices):
+            store = stores.get(device["store_id"], {})
+            record = ObsolescenceRecord(
+                device_id=device["id"],
+                store_id=device["store_id"],
+                store_name=store.get("name", ""),
+                comuna=store.get("comuna", ""),
+                device_type=device["type"],
+                provider=DEVICE_PROVIDERS.get(device["type"], ""),
+                firmware_version=device.get("firmware_version", ""),
+                firmware_outdated=bool(scores["outdated"][i]),
+                installation_date=device["installation_date"],
+                age_years=round(float(scores["age_years"][i]), 1),
+                warranty_expired=bool(scores["warranty_expired"][i]),
+                monthly_failures=round(float(scores["failures"][i]), 1),
+                downtime_hours=round(float(scores["downtime"][i]), 1),
+                last_failure=history[device["id"]]["last_failure"] if device["id"] in history else None,
+                last_calibration=device["last_calibration"],
+                obsolescence_score=round(float(scores["score"][i]), 1),
+                priority=str(scores["priority"][i]),
+                needs_attention=bool(scores["needs_attention"][i]),
+                replacement_cost=DEVICE_REPLACEMENT_COST.get(device["type"], 0),
+                computed_at=now
+            )
+            requests.append(ReplaceOne({"device_id": device["id"]}, record.dict(), upsert=True))
+        await db.obsolescence.bulk_write(requests, ordered=False)
+    if not query:
+        # A full rescore also drops the records of removed devices
+        await db.obsolescence.delete_many({"computed_at": {"$lt": now}})
+    await refresh_obsolescence_totals()
+
+async def refresh_obsolescence_totals():
+    """Rebuild the totals cube: one row per provider × type × priority × attention"""
+    now = datetime.now(timezone.utc)
+    pipeline = [
+        {"$group": {
+            "_id": {field: f"${field}" for field in OBSOLESCENCE_CUBE_FIELDS},
+            "devices": {"$sum": 1},
+            "warranty_expired": {"$sum": {"$cond": ["$warranty_expired", 1, 0]}},
+            "replacement_cost": {"$sum": "$replacement_cost"},
+        }},
+    ]
+    rows = await db.obsolescence.aggregate(pipeline).to_list(None)
+    if rows:
+        await db.obsolescence_totals.bulk_write([
+            ReplaceOne({"_id": row["_id"]}, {**row, **row["_id"], "computed_at": now}, upsert=True)
+            for row in rows
+        ], ordered=False)
+    await db.obsolescence_totals.delete_many({"computed_at": {"$lt": now}})
+
+async def refresh_obsolescence_periodically():
+    """Rescore the whole fleet so age, warranty and firmware reported by telemetry stay current"""
+    while True:
+        try:
+            await refresh_obsolescence({})
+        except Exception as e:
+            logger.error(f"Error refreshing obsolescence: {str(e)}")
+        await asyncio.sleep(OBSOLESCENCE_REFRESH_INTERVAL)
+
+def obsolescence_filters(device_type: Optional[str], provider: Optional[str], priority: Optional[str],
+                         attention_only: bool) -> dict:
+    query = {}
+    if device_type:
+        query["device_type"] = csv_filter(device_type)
+    if provider:
+        query["provider"] = csv_filter(provider)
+    if priority:
+        query["priority"] = csv_filter(priority)
+    if attention_only:
+        query["needs_attention"] = True
+    return query
+
+@api_router.get("/obsolescence/devices", response_model=List[ObsolescenceRecord])
+async def get_obsolescence_devices(
+    response: Response,
+    device_type: Optional[str] = None,
+    provider: Optional[str] = None,
+    priority: Optional[str] = None,
+    attention_only: bool = True,
+    store_id: Optional[str] = None,
+    limit: int = Query(OBSOLESCENCE_PAGE_DEFAULT, ge=1, le=OBSOLESCENCE_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    """Replacement candidates, most obsolete first; attention_only=false lists the whole fleet"""
+    query = obsolescence_filters(device_type, provider, priority, attention_only)
+    if store_id:
+        query["store_id"] = csv_filter(store_id)
+    if cursor:
+        last_score, last_id = decode_cursor(cursor, 2)
+        query["$or"] = [
+            {"obsolescence_score": {"$lt": last_score}},
+            {"obsolescence_score": last_score, "device_id": {"$gt": last_id}},
+        ]
+    
+    records = await db.obsolescence.find(query, {"_id": 0}).sort(
+        [("obsolescence_score", -1), ("device_id", 1)]
+    ).limit(limit).to_list(limit)
+    if len(records) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(records[-1]["obsolescence_score"], records[-1]["device_id"])
+    return records
+
+@api_router.get("/obsolescence/summary", response_model=ObsolescenceSummary)
+async def get_obsolescence_summary(
+    device_type: Optional[str] = None,
+    provider: Optional[str] = None,
+    priority: Optional[str] = None,
+    attention_only: bool = True,
+):
+    """Totals by provider, type and priority, summed from the precomputed cube"""
+    query = obsolescence_filters(device_type, provider, priority, attention_only)
+    totals = {"devices": 0, "warranty_expired": 0, "replacement_cost": 0}
+    groups = {field: defaultdict(lambda: dict.fromkeys(totals, 0)) for field in ("priority", "provider", "device_type")}
+    async for row in db.obsolescence_totals.find(query, {"_id": 0}):
+        for field, by_key in groups.items():
+            for name in totals:
+                by_key[row[field]][name] += row[name]
+        for name in totals:
+            totals[name] += row[name]
+    return ObsolescenceSummary(
+        **totals,
+        **{f"by_{field}": [ObsolescenceGroup(key=key, **values) for key, values in sorted(by_key.items())]
+           for field, by_key in groups.items()}
+    )
+
+# =================== SUSTAINABILITY ===================
+
+def sustainability_totals(devices: np.ndarray, energy: np.ndarray, paper: np.ndarray,
+                          carbon: np.ndarray, score: np.ndarray) -> dict:
+    return {
+        "stores": len(energy),
+        "devices": int(devices.sum()),
+        "energy_kwh_day": round(float(energy.sum()), 2),
+        "paper_meters_day": round(float(paper.sum()), 1),
+        "paper_rolls_day": int(np.ceil(paper.sum() / SUSTAINABILITY_ROLL_METERS)),
+        "carbon_kg_month": round(float(carbon.sum()), 1),
+        "avg_score": round(float(score.mean()), 1) if len(score) else 0,
+    }
+
+@api_router.get("/sustainability", response_model=SustainabilityReport)
+async def get_sustainability(top: int = Query(SUSTAINABILITY_TOP_DEFAULT, ge=1, le=SUSTAINABILITY_TOP_MAX)):
+    """Energy, thermal paper and carbon estimates of the chain, per comuna and per store.
+
+    Computed from the fleet snapshot, whose consumption column is refreshed
+    with the store rollups whenever devices report a new consumption.
+    """
+    columns = await fleet_snapshot.store_columns()
+    types = columns["types"]
+    devices = columns["devices_by_type"].sum(axis=1)
+    self_service = (columns["devices_by_type"][:, types.index("AUTOSERVICIO")]
+                    if "AUTOSERVICIO" in types else np.zeros(len(devices), dtype=np.int64))
+    energy = columns["consumption"]
+    paper = self_service * SUSTAINABILITY_PAPER_METERS_PER_DAY
+    carbon = (energy * SUSTAINABILITY_CO2_PER_KWH + paper * SUSTAINABILITY_CO2_PER_PAPER_METER) * 30
+    score = np.clip(100 * (1 - carbon / np.maximum(devices, 1) / SUSTAINABILITY_CO2_CEILING), 0, 100)
+    category = np.select([score >= 70, score >= 40], ["green", "orange"], "red")
+    
+    def store_rows(order: np.ndarray) -> List[SustainabilityStore]:
+        return [
+            SustainabilityStore(
+                store_id=columns["stores"][i]["id"],
+                name=columns["stores"][i]["name"],
+                comuna=columns["stores"][i]["comuna"],
+                devices=int(devices[i]),
+                self_service_devices=int(self_service[i]),
+                energy_kwh_day=round(float(energy[i]), 2),
+                paper_meters_day=float(paper[i]),
+                paper_rolls_day=int(np.ceil(paper[i] / SUSTAINABILITY_ROLL_METERS)),
+                carbon_kg_month=round(float(carbon[i]), 1),
+                score=round(float(score[i]), 1),
+                category=str(category[i])
+            )
+            for i in order[:top]
+        ]
+    
+    red = np.flatnonzero(category == "red")
+    return SustainabilityReport(
+        totals=SustainabilityTotals(**sustainability_totals(devices, energy, paper, carbon, score)),
+        categories=SustainabilityCategories(**{
+            name: int((category == name).sum()) for name in ("green", "orange", "red")
+        }),
+        by_type=[
+            SustainabilityTypeTotals(
+                device_type=device_type,
+                devices=int(columns["devices_by_type"][:, i].sum()),
+                energy_kwh_day=round(float(columns["consumption_by_type"][i]), 2)
+            )
+            for i, device_type in enumerate(types) if device_type
+        ],
+        by_comuna=sorted((
+            SustainabilityComuna(comuna=comuna, **sustainability_totals(
+                devices[in_comuna], energy[in_comuna], paper[in_comuna], carbon[in_comuna], score[in_comuna]
+            ))
+            for code, comuna in enumerate(columns["comunas"])
+            for in_comuna in [columns["comuna"] == code] if in_comuna.any()
+        ), key=lambda c: -c.carbon_kg_month),
+        top_consumers=store_rows(np.argsort(-energy, kind="stable")),
+        most_sustainable=store_rows(np.argsort(-score, kind="stable")),
+        needs_attention=store_rows(red[np.argsort(score[red], kind="stable")]),
+    )
+
+# =================== SUPPLIES ===================
+
+def supply_line_id(location_id: str, sku: str) -> str:
+    return f"{location_id}:{sku}"
+
+def supply_consumption_id(line_id: str, day: datetime) -> str:
+    """Ledger id of the consumption movement accumulated for a line on a day"""
+    return f"{line_id}:consumption:{day:%Y-%m-%d}"
+
+def seasonal_multipliers(days: List[datetime]) -> np.ndarray:
+    """Demand multiplier of each day from SUPPLY_SEASONAL_PEAKS"""
+    multipliers = np.ones(len(days))
+    months = np.array([d.month for d in days])
+    month_days = np.array([d.day for d in days])
+    for _, month, first, last, multiplier in SUPPLY_SEASONAL_PEAKS:
+        multipliers[(months == month) & (month_days >= first) & (month_days <= last)] = multiplier
+    return multipliers
+
+def next_seasonal_peak(today: datetime) -> tuple:
+    """(name, days until it starts) of the next seasonal peak, today included"""
+    upcoming = []
+    for name, month, first, last, _ in SUPPLY_SEASONAL_PEAKS:
+        for year in (today.year, today.year + 1):
+            start, end = today.replace(year=year, month=month, day=first), today.replace(year=year, month=month, day=last)
+            if end >= today:
+                upcoming.append((max((start - today).days, 0), name))
+                break
+    days, name = min(upcoming)
+    return name, days
+
+def forecast_demand(history: np.ndarray, observed: np.ndarray, prior: np.ndarray,
+                    start: datetime, horizon: int) -> np.ndarray:
+    """Daily demand forecast (lines × horizon) from daily history (lines × days ending yesterday).
+
+    History is deseasonalized with the calendar peaks, then each line gets a
+    weekday profile (shrunk towards flat by SUPPLY_WEEKDAY_SHRINKAGE weeks)
+    and an exponentially smoothed level over its `observed` days. Lines with
+    fewer than SUPPLY_MIN_HISTORY_DAYS observed days use their `prior` level.
+    """
+    lines, days = history.shape
+    past = [start - timedelta(days=days - i) for i in range(days)]
+    future = [start + timedelta(days=i) for i in range(horizon)]
+    mask = np.arange(days)[None, :] >= (days - observed)[:, None]
+    base = np.where(mask, history / seasonal_multipliers(past)[None, :], 0)
+    
+    weekdays = np.array([d.weekday() for d in past])
+    mean = base.sum(axis=1) / np.maximum(observed, 1)
+    by_weekday = np.stack([base[:, weekdays == wd].sum(axis=1) for wd in range(7)], axis=1)
+    count = np.stack([mask[:, weekdays == wd].sum(axis=1) for wd in range(7)], axis=1)
+    shrink = SUPPLY_WEEKDAY_SHRINKAGE
+    profile = np.where(
+        mean[:, None] > 0,
+        (by_weekday + shrink * mean[:, None]) / ((count + shrink) * np.maximum(mean[:, None], 1e-9)),
+        1
+    )
+    
+    # Most recent day weighs SUPPLY_SMOOTHING, each older one (1 - SUPPLY_SMOOTHING) times less
+    weights = SUPPLY_SMOOTHING * (1 - SUPPLY_SMOOTHING) ** np.arange(days - 1, -1, -1)
+    adjusted = base / profile[:, weekdays]
+    level = (adjusted * weights * mask).sum(axis=1) / np.maximum((weights * mask).sum(axis=1), 1e-9)
+    level = np.where(observed >= SUPPLY_MIN_HISTORY_DAYS, level, prior)
+    
+    future_weekdays = np.array([d.weekday() for d in future])
+    return level[:, None] * profile[:, future_weekdays] * seasonal_multipliers(future)[None, :]
+
+async def store_paper_estimates() -> dict:
+    """Fleet estimate of each store's rolls per day, from its self-service scales"""
+    columns = await fleet_snapshot.store_columns()
+    types = columns["types"]
+    if "AUTOSERVICIO" not in types:
+        return {}
+    self_service = columns["devices_by_type"][:, types.index("AUTOSERVICIO")]
+    meters_per_roll = SUPPLY_CATALOG[SUPPLY_STORE_SKU]["meters_per_roll"]
+    return {
+        store["id"]: float(count * SUSTAINABILITY_PAPER_METERS_PER_DAY / meters_per_roll)
+        for store, count in zip(columns["stores"], self_service)
+    }
+
+async def refresh_supply_forecasts(line_ids: Optional[List[str]] = None):
+    """Refresh the cached depletion forecast of the given supply lines (all when None).
+
+    The demand model only sees whole past days, so it is rerun once per line
+    and day; movements during the day just recompute the depletion dates
+    from the cached daily forecast and the new stock. Warehouse demand is the
+    sum of the forecasts of the store lines they replenish.
+    """
+    now = datetime.now(timezone.utc)
+    today = truncate_date(now, "day")
+    query = {} if line_ids is None else {"id": {"$in": line_ids}}
+    lines = await db.supplies.find(query, {"_id": 0}).to_list(None)
+    stores = [line for line in lines if line["location_type"] == "store"]
+    warehouses = [line for line in lines if line["location_type"] == "warehouse"]
+    
+    if stores:
+        forecast = np.array([line.get("daily_forecast") or [0.0] * SUPPLY_FORECAST_DAYS for line in stores])
+        stale = np.array([not line.get("computed_at") or line["computed_at"] < today for line in stores])
+        from_history = np.array([line.get("forecast_source") == "history" for line in stores])
+        if stale.any():
+            stale_lines = [line for line, is_stale in zip(stores, stale) if is_stale]
+            history, observed = await supply_history(stale_lines, today)
+            estimates = await store_paper_estimates()
+            prior = np.array([estimates.get(line["location_id"], 0.0) for line in stale_lines])
+            forecast[stale] = forecast_demand(history, observed, prior, today, SUPPLY_FORECAST_DAYS)
+            from_history[stale] = observed >= SUPPLY_MIN_HISTORY_DAYS
+        await db.supplies.bulk_write(supply_forecast_updates(stores, forecast, from_history, today, now), ordered=False)
+    
+    if warehouses:
+        store_forecast = defaultdict(lambda: np.zeros(SUPPLY_FORECAST_DAYS))
+        async for line in db.supplies.find({"location_type": "store"}, {"_id": 0, "sku": 1, "daily_forecast": 1}):
+            if line.get("daily_forecast"):
+                store_forecast[line["sku"]] += np.array(line["daily_forecast"])
+        forecast = np.stack([store_forecast[line["sku"]] for line in warehouses])
+        await db.supplies.bulk_write(
+            supply_forecast_updates(warehouses, forecast, np.ones(len(warehouses), dtype=bool), today, now),
+            ordered=False
+        )
+
+async def supply_history(lines: List[dict], today: datetime) -> tuple:
+    """Daily demand (lines × SUPPLY_HISTORY_DAYS, ending yesterday) and the
+    number of days each line has existed within that window"""
+    start = today - timedelta(days=SUPPLY_HISTORY_DAYS)
+    index = {line["id"]: i for i, line in enumerate(lines)}
+    history = np.zeros((len(lines), SUPPLY_HISTORY_DAYS))
+    async for row in db.supply_daily.find(
+        {"line_id": {"$in": list(index)}, "day": {"$gte": start, "$lt": today}},
+        {"_id": 0, "line_id": 1, "day": 1, "rolls": 1}
+    ):
+        history[index[row["line_id"]], (truncate_date(row["day"], "day") - start).days] += row["rolls"]
+    observed = np.array([
+        min((today - truncate_date(line["created_at"], "day")).days, SUPPLY_HISTORY_DAYS) for line in lines
+    ])
+    return history, observed
+
+def supply_forecast_updates(lines: List[dict], forecast: np.ndarray, from_history: np.ndarray,
+                            today: datetime, now: datetime) -> List[UpdateOne]:
+    rolls = np.array([line["rolls"] for line in lines], dtype=float)
+    min_rolls = np.array([line["min_rolls"] for line in lines], dtype=float)
+    consumed = np.cumsum(forecast, axis=1)
+    # First day whose cumulative demand exceeds the stock (or the reorder margin); the horizon when none
+    depleted = consumed >= rolls[:, None]
+    reorder = consumed >= (rolls - min_rolls)[:, None]
+    days_left = np.where(depleted.any(axis=1), depleted.argmax(axis=1), SUPPLY_FORECAST_DAYS)
+    days_to_reorder = np.where(reorder.any(axis=1), reorder.argmax(axis=1), SUPPLY_FORECAST_DAYS)
+    return [
+        UpdateOne({"id": line["id"]}, {"$set": {
+            "daily_rolls": round(float(forecast[i, :SUPPLY_FORECAST_WINDOW].mean()), 2),
+            "daily_forecast": np.round(forecast[i], 3).tolist(),
+            "days_left": int(days_left[i]),
+            "depletion_date": today + timedelta(days=int(days_left[i])) if days_left[i] < SUPPLY_FORECAST_DAYS else None,
+            "reorder_date": today + timedelta(days=int(days_to_reorder[i])) if days_to_reorder[i] < SUPPLY_FORECAST_DAYS else None,
+            "forecast_source": "history" if from_history[i] else "fleet_estimate",
+            "computed_at": now,
+        }})
+        for i, line in enumerate(lines)
+    ]
+
+async def record_supply_movements(movements: List[SupplyMovement]):
+    """Append movements to the ledger, apply them to the stock of their lines,
+    fold consumption into the daily demand rollup and refresh the forecasts.
+
+    Consumption is accumulated into one ledger movement per line and day, so
+    the ledger grows with days rather than with telemetry batches.
+    transfer_out movements are not applied here: the warehouse stock is taken
+    when the transfer reserves it.
+    """
+    if not movements:
+        return
+    stock = defaultdict(float)
+    demand = defaultdict(float)
+    consumed = {}
+    for m in movements:
+        stock[m.line_id] += 0 if m.kind == "transfer_out" else m.rolls
+        if m.kind == "consumption":
+            day = truncate_date(m.timestamp, "day")
+            demand[(m.line_id, day)] -= m.rolls
+            latest = consumed.get((m.line_id, day))
+            if latest is None or m.timestamp > latest.timestamp:
+                consumed[(m.line_id, day)] = m
+    ledger = [
+        UpdateOne({"id": supply_consumption_id(line_id, day)}, {
+            "$inc": {"rolls": -rolls},
+            "$max": {"timestamp": consumed[(line_id, day)].timestamp},
+            "$setOnInsert": consumed[(line_id, day)].dict(exclude={"id", "rolls", "timestamp"})
+        }, upsert=True)
+        for (line_id, day), rolls in demand.items()
+    ]
+    ledger += [InsertOne(m.dict()) for m in movements if m.kind != "consumption"]
+    await db.supply_movements.bulk_write(ledger, ordered=False)
+    await db.supplies.bulk_write([
+        UpdateOne({"id": line_id}, {"$inc": {"rolls": rolls}, "$set": {"updated_at": datetime.now(timezone.utc)}})
+        for line_id, rolls in stock.items()
+    ], ordered=False)
+    if demand:
+        await db.supply_daily.bulk_write([
+            UpdateOne({"line_id": line_id, "day": day}, {"$inc": {"rolls": rolls}}, upsert=True)
+            for (line_id, day), rolls in demand.items()
+        ], ordered=False)
+    await refresh_supply_forecasts(list(stock))
+
+async def ensure_store_supply_lines(store_ids: List[str]):
+    """Create the paper line of stores that have none yet"""
+    now = datetime.now(timezone.utc)
+    stores = db.stores.find({"id": {"$in": store_ids}}, {"_id": 0, "id": 1, "name": 1, "comuna": 1})
+    requests = [
+        UpdateOne({"id": supply_line_id(store["id"], SUPPLY_STORE_SKU)}, {"$setOnInsert": SupplyLine(
+            id=supply_line_id(store["id"], SUPPLY_STORE_SKU),
+            location_type="store",
+            location_id=store["id"],
+            location_name=f"{store.get('name', '')} - {store.get('comuna', '')}",
+            sku=SUPPLY_STORE_SKU,
+            rolls=0,
+            min_rolls=0,
+            created_at=now
+        ).dict()}, upsert=True)
+        async for store in stores
+    ]
+    if requests:
+        await db.supplies.bulk_write(requests, ordered=False)
+
+async def record_paper_consumption(readings: List[TelemetryReading]):
+    """Turn the labels printed per store and day (from telemetry) into consumption movements"""
+    labels = defaultdict(int)
+    latest = {}
+    for reading in readings:
+        if reading.labels_printed:
+            key = (reading.store_id, truncate_date(reading.timestamp, "day"))
+            labels[key] += reading.labels_printed
+            latest[key] = max(latest.get(key, reading.timestamp), reading.timestamp)
+    if not labels:
+        return
+    await ensure_store_supply_lines(list({store_id for store_id, _ in labels}))
+    meters_per_roll = SUPPLY_CATALOG[SUPPLY_STORE_SKU]["meters_per_roll"]
+    await record_supply_movements([
+        SupplyMovement(
+            line_id=supply_line_id(store_id, SUPPLY_STORE_SKU),
+            location_id=store_id,
+            sku=SUPPLY_STORE_SKU,
+            kind="consumption",
+            rolls=-count * SUPPLY_LABEL_METERS / meters_per_roll,
+            timestamp=latest[(store_id, day)]
+        )
+        for (store_id, day), count in labels.items()
+    ])
+
+async def refresh_supply_forecasts_periodically():
+    """Roll the forecasts over to the new day for lines without recent movements"""
+    while True:
+        try:
+            await refresh_supply_forecasts()
+        except Exception as e:
+            logger.error(f"Error refreshing supply forecasts: {str(e)}")
+        await asyncio.sleep(SUPPLY_REFRESH_INTERVAL)
+
+@api_router.get("/supplies", response_model=List[SupplyLine])
+async def get_supplies(
+    response: Response,
+    location_type: Optional[str] = None,
+    location_id: Optional[str] = None,
+    sku: Optional[str] = None,
+    limit: int = Query(SUPPLY_PAGE_DEFAULT, ge=1, le=SUPPLY_PAGE_MAX),
+    cursor: Optional[str] = None,
+):
+    """Paper stock lines with their cached forecast, soonest depletion first"""
+    query = {}
+    if location_type:
+        query["location_type"] = csv_filter(location_type)
+    if location_id:
+        query["location_id"] = csv_filter(location_id)
+    if sku:
+        query["sku"] = csv_filter(sku)
+    if cursor:
+        last_days, last_id = decode_cursor(cursor, 2)
+        query["$or"] = [
+            {"days_left": {"$gt": last_days}},
+            {"days_left": last_days, "id": {"$gt": last_id}},
+        ]
+    lines = await db.supplies.find(query, {"_id": 0, "daily_forecast": 0}).sort(
+        [("days_left", 1), ("id", 1)]
+    ).limit(limit).to_list(limit)
+    if len(lines) == limit:
+        response.headers["X-Next-Cursor"] = encode_cursor(lines[-1]["days_left"], lines[-1]["id"])
+    return lines
+
+@api_router.get("/supplies/summary", response_model=SupplySummary)
+async def get_supplies_summary():
+    """Warehouse stock per SKU and the chain-wide store coverage"""
+    analytics_db = route_db("analytics")
+    warehouse = await analytics_db.supplies.find(
+        {"location_type": "warehouse"}, {"_id": 0, "daily_forecast": 0}
+    ).sort("id", 1).to_list(None)
+    stores = await analytics_db.supplies.aggregate([
+        {"$match": {"location_type": "store"}},
+        {"$group": {
+            "_id": None,
+            "stores": {"$sum": 1},
+            "rolls": {"$sum": "$rolls"},
+            "daily_rolls": {"$sum": "$daily_rolls"},
+            "below_min": {"$sum": {"$cond": [{"$lt": ["$rolls", "$min_rolls"]}, 1, 0]}},
+            "depleting_soon": {"$sum": {"$cond": [{"$lt": ["$days_left", SUPPLY_ALERT_DAYS]}, 1, 0]}},
+        }},
+    ]).to_list(1)
+    stores = stores[0] if stores else {"stores": 0, "rolls": 0, "daily_rolls": 0, "below_min": 0, "depleting_soon": 0}
+    peak, days_to_peak = next_seasonal_peak(truncate_date(datetime.now(timezone.utc), "day"))
+    return SupplySummary(
+        catalog=[SupplySku(sku=sku, **item) for sku, item in SUPPLY_CATALOG.items()],
+        warehouse=warehouse,
+        stores=stores["stores"],
+        store_rolls=round(stores["rolls"], 1),
+        store_daily_rolls=round(stores["daily_rolls"], 1),
+        stores_below_min=stores["below_min"],
+        stores_depleting_soon=stores["depleting_soon"],
+        next_peak=peak,
+        days_to_next_peak=days_to_peak
+    )
+
+@api_router.get("/supplies/movements", response_model=List[SupplyMovement])
+async def get_supply_movements(
+    location_id: Optional[str] = None,
+    kind: Optional[str] = None,
+    limit: int = Query(SUPPLY_PAGE_DEFAULT, ge=1, le=SUPPLY_PAGE_MAX),
+):
+    """Latest ledger entries, newest first"""
+    query = {}
+    if location_id:
+        query["location_id"] = csv_filter(location_id)
+    if kind:
+        query["kind"] = csv_filter(kind)
+    return await db.supply_movements.find(query, {"_id": 0}).sort("timestamp", -1).limit(limit).to_list(limit)
+
+@api_router.post("/supplies/movements", response_model=List[SupplyMovement])
+async def create_supply_movements(requests: List[SupplyMovementCreate]):
+    """Record receipts at the warehouse, transfers to stores and stock adjustments.
+
+    A transfer takes the rolls out of the warehouse line of the same SKU and
+    into the store line; it is refused when the warehouse holds fewer rolls.
+    """
+    now = datetime.now(timezone.utc)
+    for request in requests:
+        if request.sku not in SUPPLY_CATALOG:
+            raise HTTPException(status_code=400, detail=f"Unknown SKU {request.sku}")
+        if request.kind != "adjustment" and request.rolls <= 0:
+            raise HTTPException(status_code=400, detail="Receipts and transfers need a positive number of rolls")
+        at_warehouse = request.location_id == SUPPLY_WAREHOUSE["id"]
+        if request.kind == "receipt" and not at_warehouse:
+            raise HTTPException(status_code=400, detail=f"Receipts go to the warehouse {SUPPLY_WAREHOUSE['id']}")
+        if request.kind == "transfer" and at_warehouse:
+            raise HTTPException(status_code=400, detail="Transfers go from the warehouse to a store")
+        if not at_warehouse and request.sku != SUPPLY_STORE_SKU:
+            raise HTTPException(status_code=400, detail=f"Stores stock {SUPPLY_STORE_SKU} rolls")
+        if not at_warehouse and not await db.stores.count_documents({"id": request.location_id}, limit=1):
+            raise HTTPException(status_code=404, detail=f"Unknown location {request.location_id}")
+    await ensure_store_supply_lines([r.location_id for r in requests if r.location_id != SUPPLY_WAREHOUSE["id"]])
+    
+    movements = []
+    reserved = []
+    for request in requests:
+        if request.kind == "transfer":
+            source_id = supply_line_id(SUPPLY_WAREHOUSE["id"], request.sku)
+            # Take the rolls atomically so concurrent transfers cannot overdraw the warehouse
+            result = await db.supplies.update_one(
+                {"id": source_id, "rolls": {"$gte": request.rolls}}, {"$inc": {"rolls": -request.rolls}}
+            )
+            if result.modified_count == 0:
+                for line_id, rolls in reserved:
+                    await db.supplies.update_one({"id": line_id}, {"$inc": {"rolls": rolls}})
+                raise HTTPException(status_code=409, detail=f"Not enough {request.sku} rolls in the warehouse")
+            reserved.append((source_id, request.rolls))
+            movements.append(SupplyMovement(line_id=source_id, location_id=SUPPLY_WAREHOUSE["id"], sku=request.sku,
+                                            kind="transfer_out", rolls=-request.rolls, timestamp=now,
+                                            reference=request.reference))
+        movements.append(SupplyMovement(line_id=supply_line_id(request.location_id, request.sku),
+                                        location_id=request.location_id, sku=request.sku,
+                                        kind="transfer_in" if request.kind == "transfer" else request.kind,
+                                        rolls=request.rolls, timestamp=now, reference=request.reference))
+    await record_supply_movements(movements)
+    return movements
+
+async def supply_context() -> dict:
+    """Paper numbers for the AI predictions context"""
+    lines = await db.supplies.find(
+        {"location_type": "warehouse"}, {"_id": 0, "sku": 1, "rolls": 1, "days_left": 1}
+    ).to_list(None)
+    store_daily = await db.supplies.aggregate([
+        {"$match": {"location_type": "store"}},
+        {"$group": {"_id": None, "daily_rolls": {"$sum": "$daily_rolls"}}},
+    ]).to_list(1)
+    peak, days_to_peak = next_seasonal_peak(truncate_date(datetime.now(timezone.utc), "day"))
+    return {
+        "paper_rolls_per_day": round(store_daily[0]["daily_rolls"]) if store_daily else 0,
+        # Hundreds of rolls, so that single transfers do not change the predictions fingerprint
+        "warehouse_rolls": {line["sku"]: int(round(line["rolls"], -2)) for line in lines},
+        "warehouse_days_left": min((line.get("days_left", SUPPLY_FORECAST_DAYS) for line in lines), default=None),
+        "next_peak": peak,
+        "days_to_next_peak": days_to_peak,
+    }
+
+async def seed_supplies(history_days: int = 28):
+    """Warehouse stock and a few weeks of store consumption on a fresh database"""
+    now = datetime.now(timezone.utc)
+    today = truncate_date(now, "day")
+    start = today - timedelta(days=history_days)
+    estimates = await store_paper_estimates()
+    stores = {
+        store["id"]: store
+        async for store in db.stores.find({"id": {"$in": list(estimates)}}, {"_id": 0, "id": 1, "name": 1, "comuna": 1})
+    }
+    lines = [
+        SupplyLine(id=supply_line_id(SUPPLY_WAREHOUSE["id"], sku), location_type="warehouse",
+                   location_id=SUPPLY_WAREHOUSE["id"], location_name=SUPPLY_WAREHOUSE["name"], sku=sku,
+                   rolls=rolls, min_rolls=min_rolls, created_at=start)
+        for sku, (rolls, min_rolls) in SUPPLY_SEED_WAREHOUSE_STOCK.items()
+    ]
+    movements = []
+    for store_id, daily in estimates.items():
+        store = stores.get(store_id, {})
+        line_id = supply_line_id(store_id, SUPPLY_STORE_SKU)
+        used = []
+        for offset in range(history_days):
+            day = start + timedelta(days=offset)
+            rolls = daily * (1.2 if day.weekday() >= 5 else 1.0) * random.uniform(0.8, 1.2)
+            used.append(rolls)
+            movements.append(SupplyMovement(line_id=line_id, location_id=store_id, sku=SUPPLY_STORE_SKU,
+                                            kind="consumption", rolls=-round(rolls, 3),
+                                            timestamp=day + timedelta(hours=20)))
+        lines.append(SupplyLine(
+            id=line_id, location_type="store", location_id=store_id,
+            location_name=f"{store.get('name', '')} - {store.get('comuna', '')}", sku=SUPPLY_STORE_SKU,
+            rolls=round(sum(used) + daily * random.uniform(3, 30)),  # what is left after the history
+            min_rolls=round(daily * SUPPLY_STORE_MIN_DAYS), created_at=start
+        ))
+    await db.supplies.insert_many([line.dict() for line in lines])
+    await record_supply_movements(movements)
+    await refresh_supply_forecasts()
+
+# =================== LIVE STREAM ===================
+
+class StreamSubscriber:
+    """A connected client with its topic filters and a bounded event queue.
+
+    Backpressure: when the queue is full the pending events are dropped and
+    replaced by a single `resync` event telling the client to refetch.
+    Clients that need more than STREAM_MAX_RESYNCS resyncs are disconnected.
+    """
+
+    def __init__(self, topics=None, comuna=None, store_id=None, priority=None):
+        self.queue = asyncio.Queue(maxsize=STREAM_QUEUE_SIZE)
+        self.resyncs = 0
+        self.closed = False
+        self.update_filters(topics, comuna, store_id, priority)
+
+    def update_filters(self, topics=None, comuna=None, store_id=None, priority=None):
+        self.topics = set(topics or STREAM_TOPICS)
+        self.comuna = set(comuna or [])
+        self.store_id = set(store_id or [])
+        self.priority = set(priority or [])
+
+    def matches(self, event: dict) -> bool:
+        if event["topic"] not in self.topics:
+            return False
+        if self.comuna and event.get("comuna") not in self.comuna:
+            return False
+        if self.store_id and event.get("store_id") not in self.store_id:
+            return False
+        if self.priority and event["topic"] == "alerts" and event.get("priority") not in self.priority:
+            return False
+        return True
+
+    def offer(self, event: dict):
+        if self.closed:
+            return
+        try:
+            self.queue.put_nowait(event)
+        except asyncio.QueueFull:
+            self.resyncs += 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            if self.resyncs > STREAM_MAX_RESYNCS:
+                self.closed = True
+                self.queue.put_nowait({"topic": "control", "type": "close", "reason": "slow consumer"})
+            else:
+                self.queue.put_nowait({"topic": "control", "type": "resync"})
+
+def split_filter(value: Optional[str]) -> List[str]:
+    return [v.strip() for v in value.split(",") if v.strip()] if value else []
+
+def filter_values(value) -> List[str]:
+    """A filter sent over the WebSocket: a comma-separated string or a list of strings"""
+    if value is None or isinstance(value, str):
+        return split_filter(value)
+    if isinstance(value, list) and all(isinstance(v, str) for v in value):
+        return value
+    raise ValueError("each filter must be a string or a list of strings")
+
+def compact_device(device: dict) -> dict:
+    return {"id": device["id"], **{f: device.get(f) for f in STREAM_DEVICE_FIELDS}}
+
+class StreamHub:
+    """Fans out compact store/alert/ticket changes to the stream subscribers.
+
+    Tails a MongoDB change stream when the server supports it (replica sets),
+    restarting it with backoff when it fails, and otherwise polls the
+    documents whose `updated_at` moved since the previous poll.
+    """
+
+    def __init__(self):
+        self.subscribers = set()
+        self.mode = None
+        self._task = None
+        self._comunas = {}
+        self._resume_token = None
+        self._retry_delay = 1
+
+    def subscribe(self, **filters) -> StreamSubscriber:
+        subscriber = StreamSubscriber(**filters)
+        self.subscribers.add(subscriber)
+        return subscriber
+
+    def unsubscribe(self, subscriber: StreamSubscriber):
+        self.subscribers.discard(subscriber)
+
+    def publish(self, event: dict):
+        event = jsonable_encoder(event)
+        for subscriber in list(self.subscribers):
+            if subscriber.matches(event):
+                subscriber.offer(event)
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    def stop(self):
+        if self._task:
+            self._task.cancel()
+
+    async def _run(self):
+        if STREAM_MODE == "poll":
+            await self._poll()
+            return
+        while True:
+            try:
+                await self._watch_change_stream()
+                logger.warning("Change stream closed, reopening")
+            except asyncio.CancelledError:
+                raise
+            except OperationFailure as e:
+                if self.mode is None and STREAM_MODE != "change_stream":
+                    logger.info(f"Change streams unavailable ({e.code}), polling every {STREAM_POLL_INTERVAL}s")
+                    await self._poll()
+                    return
+                logger.error(f"Change stream failed ({e.code}), restarting in {self._retry_delay}s: {str(e)}")
+                self._resume_token = None  # the token may be what the server rejected
+            except Exception as e:
+                logger.error(f"Change stream failed, restarting in {self._retry_delay}s: {str(e)}")
+            await asyncio.sleep(self._retry_delay)
+            self._retry_delay = min(self._retry_delay * 2, STREAM_RETRY_MAX)
+
+    # ---- change streams ----
+
+    async def _watch_change_stream(self):
+        pipeline = [{"$match": {
+            "ns.coll": {"$in": list(STREAM_WATCHED_COLLECTIONS)},
+            "operationType": {"$in": ["insert", "update", "replace"]},
+        }}]
+        async with db.watch(pipeline, full_document="updateLookup", resume_after=self._resume_token) as stream:
+            self.mode = "change_stream"
+            async for change in stream:
+                event = await self._event_from_change(change)
+                if event:
+                    self.publish(event)
+                self._resume_token = stream.resume_token
+                self._retry_delay = 1  # the stream is healthy again
+
+    async def _event_from_change(self, change: dict) -> Optional[dict]:
+        collection = change["ns"]["coll"]
+        document = change.get("fullDocument")
+        if not document:
+            return None
+        if collection not in ("stores", "devices"):
+            return self._document_event(collection, document)
+        
+        updated = (change.get("updateDescription") or {}).get("updatedFields")
+        if collection == "devices":
+            # Device changes are published on the stores topic of their store
+            fields = STREAM_DEVICE_FIELDS if updated is None else [f for f in STREAM_DEVICE_FIELDS if f in updated]
+            if not fields:
+                return None
+            return {"topic": "stores", "store_id": document.get("store_id"),
+                    "comuna": await self._store_comuna(document.get("store_id")), "fields": {},
+                    "devices": [{"id": document["id"], **{f: document.get(f) for f in fields}}]}
+        
+        self._comunas[document["id"]] = document.get("comuna")
+        if updated is None:  # insert or replace
+            updated = {"status": document.get("status")}
+        fields = {key: value for key, value in updated.items()
+                  if key.split(".")[0] not in ("rollup", "last_update", "updated_at")}
+        if not fields:
+            return None
+        return {"topic": "stores", "store_id": document["id"], "comuna": document.get("comuna"),
+                "fields": fields, "devices": []}
+
+    async def _store_comuna(self, store_id: Optional[str]) -> Optional[str]:
+        if store_id not in self._comunas:
+            store = await db.stores.find_one({"id": store_id}, {"_id": 0, "comuna": 1})
+            self._comunas[store_id] = store.get("comuna") if store else None
+        return self._comunas[store_id]
+
+    @staticmethod
+    def _document_event(topic: str, document: dict) -> dict:
+        if topic == "alerts":
+            return {"topic": "alerts", "id": document["id"], "store_id": document.get("store_id"),
+                    "type": document.get("type"), "priority": document.get("priority"),
+                    "message": document.get("message"), "resolved": document.get("resolved", False)}
+        return {"topic": "tickets", "id": document["id"], "sap_code": document.get("sap_code"),
+                "comuna": document.get("store_comuna"), "status": document.get("status"),
+                "reported_to": document.get("reported_to")}
+
+    # ---- polling fallback (standalone servers) ----
+
+    async def _poll(self):
+        """Read only what changed since the previous poll.
+
+        Every write stamps `updated_at` (device writes through the store
+        rollup refresh). Each poll overlaps the previous one by an interval
+        so writes stamped by a slightly late clock are not missed; the
+        duplicates this reads are dropped by diffing against the last state.
+        """
+        self.mode = "poll"
+        stores, alerts, tickets = {}, {}, {}
+        since = None
+        while True:
+            started = datetime.now(timezone.utc)
+            try:
+                stores = await self._poll_stores(stores, since)
+                if since is not None:
+                    alerts = await self._poll_documents("alerts", ("store_id", "priority", "resolved"), alerts, since)
+                    tickets = await self._poll_documents("tickets", ("status",), tickets, since)
+                since = started - timedelta(seconds=STREAM_POLL_INTERVAL)
+            except Exception as e:
+                logger.error(f"Error polling stream changes: {str(e)}")
+            await asyncio.sleep(STREAM_POLL_INTERVAL)
+
+    async def _poll_stores(self, previous: dict, since: Optional[datetime]) -> dict:
+        """Diff the stores written since `since` (all of them on the first poll, without publishing)"""
+        query = {} if since is None else {"updated_at": {"$gte": since}}
+        stores = await db.stores.find(
+            query, {"_id": 0, "id": 1, "comuna": 1, "status": 1, "network_status": 1}
+        ).to_list(None)
+        by_store = defaultdict(dict)
+        device_projection = {"_id": 0, "id": 1, "store_id": 1, **{f: 1 for f in STREAM_DEVICE_FIELDS}}
+        device_query = {} if since is None else {"store_id": {"$in": [store["id"] for store in stores]}}
+        async for device in db.devices.find(device_query, device_projection):
+            by_store[device["store_id"]][device["id"]] = compact_device(device)
+        current = previous
+        for store in stores:
+            devices = by_store.get(store["id"], {})
+            old_status, old_network, old_devices = previous.get(store["id"], (None, None, {}))
+            current[store["id"]] = (store.get("status"), store.get("network_status"), devices)
+            if since is None:
+                continue
+            fields = {}
+            if store.get("status") != old_status:
+                fields["status"] = store.get("status")
+            if store.get("network_status") != old_network:
+                fields["network_status"] = store.get("network_status")
+            changed_devices = []
+            for device_id, device in devices.items():
+                old = old_devices.get(device_id, {})
+                diff = {f: v for f, v in device.items() if f != "id" and old.get(f) != v}
+                if diff:
+                    changed_devices.append({"id": device_id, **diff})
+            if fields or changed_devices:
+                self.publish({"topic": "stores", "store_id": store["id"], "comuna": store.get("comuna"),
+                              "fields": fields, "devices": changed_devices})
+        return current
+
+    async def _poll_documents(self, topic: str, watched: tuple, previous: dict, since: datetime) -> dict:
+        """Publish the documents written since `since`; returns their watched fields, which
+        is all the state needed to drop the ones read again by the next, overlapping poll"""
+        current = {}
+        async for document in db[topic].find({"updated_at": {"$gte": since}}, {"_id": 0}):
+            current[document["id"]] = tuple(document.get(f) for f in watched)
+            if previous.get(document["id"]) != current[document["id"]]:
+                self.publish(self._document_event(topic, document))
+        return current
+
+stream_hub = StreamHub()
+
+@api_router.websocket("/stream")
+async def stream_websocket(
+    websocket: WebSocket,
+    topics: Optional[str] = None,
+    comuna: Optional[str] = None,
+    store_id: Optional[str] = None,
+    priority: Optional[str] = None,
+):
+    """Push compact change events; clients may send new filters as JSON messages"""
+    await websocket.accept()
+    subscriber = stream_hub.subscribe(topics=split_filter(topics), comuna=split_filter(comuna),
+                                      store_id=split_filter(store_id), priority=split_filter(priority))
+    
+    async def receive_filters():
+        while True:
+            try:
+                message = json.loads(await websocket.receive_text())
+                if not isinstance(message, dict):
+                    raise ValueError("filters must be a JSON object")
+                filters = {key: filter_values(message.get(key)) for key in ("topics", "comuna", "store_id", "priority")}
+            except ValueError as e:  # JSONDecodeError included
+                subscriber.offer({"topic": "control", "type": "error", "reason": f"Invalid filters: {str(e)}"})
+                continue
+            subscriber.update_filters(**filters)
+    
+    receiver = asyncio.create_task(receive_filters())
     try:
-        tickets = await db.tickets.find().sort("created_at", -1).to_list(1000)
-        return [Ticket(**ticket) for ticket in tickets]
+        while not receiver.done():
+            try:
+                event = await asyncio.wait_for(subscriber.queue.get(), timeout=STREAM_KEEPALIVE)
+            except asyncio.TimeoutError:
+                event = {"topic": "control", "type": "keepalive"}
+            await websocket.send_json(event)
+            if event.get("type") == "close":
+                await websocket.close(code=1013)
+                break
+    except WebSocketDisconnect:
+        pass
+    finally:
+        receiver.cancel()
+        stream_hub.unsubscribe(subscriber)
+
+@api_router.get("/stream")
+async def stream_events(
+    request: Request,
+    topics: Optional[str] = None,
+    comuna: Optional[str] = None,
+    store_id: Optional[str] = None,
+    priority: Optional[str] = None,
+):
+    """Server-Sent Events variant of the change stream (for EventSource clients)"""
+    subscriber = stream_hub.subscribe(topics=split_filter(topics), comuna=split_filter(comuna),
+                                      store_id=split_filter(store_id), priority=split_filter(priority))
+    
+    async def events():
+        try:
+            yield f"retry: {int(STREAM_POLL_INTERVAL * 1000)}\n\n"
+            while not await request.is_disconnected():
+                try:
+                    event = await asyncio.wait_for(subscriber.queue.get(), timeout=STREAM_KEEPALIVE)
+                except asyncio.TimeoutError:
+                    yield ": keepalive\n\n"
+                    continue
+                name = event.get("type") if event["topic"] == "control" else event["topic"]
+                yield f"event: {name}\ndata: {json.dumps(event)}\n\n"
+                if event.get("type") == "close":
+                    break
+        finally:
+            stream_hub.unsubscribe(subscriber)
+    
+    return StreamingResponse(events(), media_type="text/event-stream",
+                             headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
+# =================== DIAGNOSTICS ===================
+
+def hot_queries() -> list:
+    """Queries issued by the API on every request; each must be index-backed"""
+    now = datetime.now(timezone.utc)
+    return [
+        {"name": "store by id", "collection": "stores", "filter": {"id": ""}},
+        {"name": "stores page", "collection": "stores", "filter": {},
+         "sort": [("sap_code", 1), ("id", 1)]},
+        {"name": "calibration window", "collection": "devices",
+         "filter": {"last_calibration": {"$gt": now - timedelta(days=CALIBRATION_WINDOW_DAYS + 1)}}},
+        {"name": "device by id", "collection": "devices", "filter": {"id": ""}},
+        {"name": "devices of store", "collection": "devices", "filter": {"store_id": {"$in": [""]}}},
+        {"name": "devices page", "collection": "devices", "filter": {"status": "online"},
+         "sort": [("id", 1)]},
+        {"name": "stores near point", "collection": "stores",
+         "filter": {"location": {"$nearSphere": {"$geometry": {"type": "Point", "coordinates": [-70.65, -33.45]},
+                                                 "$maxDistance": 5000}}}},
+        {"name": "maintenance by risk", "collection": "maintenance_scores", "filter": {"priority": "high"},
+         "sort": [("maintenance_risk", -1), ("device_id", 1)]},
+        {"name": "obsolescence by provider", "collection": "obsolescence",
+         "filter": {"provider": "Allcom IA Systems", "needs_attention": True},
+         "sort": [("obsolescence_score", -1), ("device_id", 1)]},
+        {"name": "supplies by depletion", "collection": "supplies", "filter": {"location_type": "store"},
+         "sort": [("days_left", 1), ("id", 1)]},
+        {"name": "supply history", "collection": "supply_daily",
+         "filter": {"line_id": {"$in": [""]}, "day": {"$gte": now - timedelta(days=SUPPLY_HISTORY_DAYS)}}},
+        {"name": "campaign by id", "collection": "campaigns", "filter": {"id": ""}},
+        {"name": "alert by id", "collection": "alerts", "filter": {"id": ""}},
+        {"name": "unresolved alerts", "collection": "alerts", "filter": {"resolved": False},
+         "sort": [("created_at", -1)]},
+        {"name": "rule alerts by store", "collection": "alerts",
+         "filter": {"store_id": {"$in": [""]}, "dedup_key": {"$exists": True}}},
+        {"name": "tickets by date", "collection": "tickets", "filter": {},
+         "sort": [("created_at", -1), ("id", 1)]},
+        {"name": "tickets by status", "collection": "tickets", "filter": {"status": "Pendiente"},
+         "sort": [("created_at", -1), ("id", 1)]},
+        {"name": "tickets by provider", "collection": "tickets", "filter": {"reported_to": "Alcom"},
+         "sort": [("created_at", -1), ("id", 1)]},
+        {"name": "tickets by device", "collection": "tickets", "filter": {"device_id": "", "created_at": {"$gte": ""}}},
+        {"name": "daily weights", "collection": "weight_daily",
+         "filter": {"day": {"$gte": now - timedelta(days=7)}, "product": "Tomate"}},
+        {"name": "monthly weighings by device", "collection": "device_daily",
+         "filter": {"device_id": {"$in": [""]}, "day": {"$gte": now - timedelta(days=30)}}},
+        {"name": "daily sales by store", "collection": "sales_daily",
+         "filter": {"store_id": "", "period": {"$gte": now - timedelta(days=SALES_DEFAULT_DAYS)}}},
+        {"name": "hourly sales", "collection": "sales_hourly",
+         "filter": {"period": {"$gte": now - timedelta(days=1)}}},
+    ]
+
+def plan_stages(plan: dict) -> List[str]:
+    """Flatten the stage names of a winning plan tree"""
+    stages = [plan["stage"]] if "stage" in plan else []
+    for key in ("inputStage", "queryPlan"):
+        if key in plan:
+            stages += plan_stages(plan[key])
+    for child in plan.get("inputStages", []):
+        stages += plan_stages(child)
+    return stages
+
+@api_router.get("/diagnostics/query-plans")
+async def get_query_plans():
+    """Run explain() on every hot query and report collection scans and in-memory sorts"""
+    reports = []
+    for query in hot_queries():
+        cursor = db[query["collection"]].find(query["filter"])
+        if query.get("sort"):
+            cursor = cursor.sort(query["sort"])
+        try:
+            explain = await cursor.explain()
+        except OperationFailure as e:
+            reports.append({"name": query["name"], "collection": query["collection"], "error": str(e)})
+            continue
+        stages = plan_stages(explain["queryPlanner"]["winningPlan"])
+        reports.append({
+            "name": query["name"],
+            "collection": query["collection"],
+            "stages": stages,
+            "collscan": "COLLSCAN" in stages,
+            "in_memory_sort": "SORT" in stages,
+        })
+    return {
+        "ok": not any(r.get("error") or r["collscan"] or r["in_memory_sort"] for r in reports),
+        "queries": reports,
+    }
+
+@api_router.get("/health/db")
+async def get_db_health():
+    """Ping latency and connection pool usage of this worker.
+
+    Checkout waits close to MONGO_WAIT_QUEUE_TIMEOUT_MS, `in_use` pinned at
+    the pool size or checkout failures point at pool starvation.
+    """
+    bootstrap = getattr(app.state, "bootstrap", None)
+    bootstrap_error = getattr(app.state, "bootstrap_error", None)
+    if bootstrap is None:
+        bootstrap_status = "not_started"
+    elif bootstrap.done():
+        bootstrap_status = "done"
+    else:
+        bootstrap_status = "retrying" if bootstrap_error else "running"
+    started = time.perf_counter()
+    try:
+        await db.command("ping")
+        ping_ms = round((time.perf_counter() - started) * 1000, 3)
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Error fetching tickets: {str(e)}")
+        ping_ms = None
+        logger.error(f"Database ping failed: {str(e)}")
+    health = {
+        "status": "ok" if ping_ms is not None else "down",
+        "ping_ms": ping_ms,
+        "bootstrap": bootstrap_status,
+        "bootstrap_error": bootstrap_error,  # last failed attempt while retrying
+        "pool": {
+            "max_pool_size": MONGO_MAX_POOL_SIZE,
+            "min_pool_size": MONGO_MIN_POOL_SIZE,
+            "wait_queue_timeout_ms": int(MONGO_WAIT_QUEUE_TIMEOUT_MS) if MONGO_WAIT_QUEUE_TIMEOUT_MS else None,
+            **pool_monitor.stats(),
+        },
+    }
+    return health if ping_ms is not None else JSONResponse(status_code=503, content=health)
+
+# =================== DATABASE SETUP ===================
+
+SAMPLE_PRODUCTS = [
+    {"product": "Tomate", "base": 450, "variance": 80, "price_per_kg": 1990},
+    {"product": "Palta", "base": 320, "variance": 60, "price_per_kg": 5500},
+    {"product": "Plátano", "base": 580, "variance": 100, "price_per_kg": 1290}
+]
+
+async def seed_weight_readings(stores: list, days: int = 7, readings_per_day: int = 24):
+    """Sample weighing history so the dashboard chart has data on a fresh database"""
+    today = truncate_date(datetime.now(timezone.utc), "day")
+    readings = []
+    for offset in range(days):
+        day = today - timedelta(days=days - 1 - offset)
+        for p in SAMPLE_PRODUCTS:
+            daily_kg = p["base"] + random.uniform(-p["variance"], p["variance"])
+            for _ in range(readings_per_day):
+                store = random.choice(stores)
+                weight_kg = round(daily_kg / readings_per_day, 3)
+                readings.append(WeightReading(
+                    store_id=store["id"],
+                    device_id=random.choice(store["devices"])["id"],
+                    product=p["product"],
+                    weight_kg=weight_kg,
+                    amount=round(weight_kg * p["price_per_kg"]),
+                    timestamp=day + timedelta(minutes=random.randint(8 * 60, 22 * 60)),
+                    reading_id=str(uuid.uuid4())
+                ))
+    await record_weight_readings(readings)
+
+async def ensure_weight_collections():
+    """Create the weight readings time-series collection"""
+    if "weight_readings" not in await db.list_collection_names():
+        options = {"timeseries": {"timeField": "ts", "metaField": "meta", "granularity": "minutes"}}
+        if WEIGHT_READINGS_RETENTION_DAYS:
+            options["expireAfterSeconds"] = int(WEIGHT_READINGS_RETENTION_DAYS) * 86400
+        await db.create_collection("weight_readings", **options)
+
+# Indexes required by the hot queries, ensured at startup
+INDEXES = {
+    "stores": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("sap_code", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("rollup.types", ASCENDING)]),
+        IndexModel([("last_update", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+        IndexModel([("location", GEOSPHERE)]),
+    ],
+    "devices": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("store_id", ASCENDING)]),
+        IndexModel([("type", ASCENDING)]),
+        IndexModel([("status", ASCENDING)]),
+        IndexModel([("firmware_version", ASCENDING)]),
+        IndexModel([("last_calibration", ASCENDING)]),
+        IndexModel([("last_seen", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+        IndexModel([("content.campaign.deployment_id", ASCENDING)]),
+        IndexModel([("content.self_service_flow.deployment_id", ASCENDING)]),
+    ],
+    "maintenance_scores": [
+        IndexModel([("device_id", ASCENDING)], unique=True),
+        IndexModel([("maintenance_risk", DESCENDING), ("device_id", ASCENDING)]),
+        IndexModel([("priority", ASCENDING), ("maintenance_risk", DESCENDING), ("device_id", ASCENDING)]),
+        IndexModel([("store_id", ASCENDING)]),
+    ],
+    "obsolescence": [
+        IndexModel([("device_id", ASCENDING)], unique=True),
+        # Page filters, each followed by the (obsolescence_score, device_id) page order
+        IndexModel([("needs_attention", ASCENDING), ("obsolescence_score", DESCENDING), ("device_id", ASCENDING)]),
+        IndexModel([("provider", ASCENDING), ("needs_attention", ASCENDING), ("obsolescence_score", DESCENDING), ("device_id", ASCENDING)]),
+        IndexModel([("device_type", ASCENDING), ("needs_attention", ASCENDING), ("obsolescence_score", DESCENDING), ("device_id", ASCENDING)]),
+        IndexModel([("priority", ASCENDING), ("needs_attention", ASCENDING), ("obsolescence_score", DESCENDING), ("device_id", ASCENDING)]),
+        IndexModel([("store_id", ASCENDING)]),
+    ],
+    "supplies": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("location_type", ASCENDING), ("days_left", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("days_left", ASCENDING), ("id", ASCENDING)]),
+        IndexModel([("location_id", ASCENDING)]),
+    ],
+    "supply_movements": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("location_id", ASCENDING), ("timestamp", DESCENDING)]),
+        IndexModel([("timestamp", DESCENDING)]),
+    ],
+    "supply_daily": [
+        IndexModel([("line_id", ASCENDING), ("day", ASCENDING)], unique=True),
+    ],
+    "campaigns": [
+        IndexModel([("id", ASCENDING)], unique=True),
+    ],
+    "assets": [
+        IndexModel([("sha256", ASCENDING)], unique=True),
+        IndexModel([("source_sha256", ASCENDING)]),
+    ],
+    "asset_uploads": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=ASSET_UPLOAD_TTL),
+    ],
+    "asset_upload_chunks": [
+        IndexModel([("upload_id", ASCENDING), ("index", ASCENDING)], unique=True),
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=ASSET_UPLOAD_TTL),
+    ],
+    "deployments": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("created_at", DESCENDING)]),
+        IndexModel([("status", ASCENDING), ("lease_expires_at", ASCENDING)]),
+    ],
+    "alerts": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        IndexModel([("resolved", ASCENDING), ("created_at", ASCENDING)]),
+        # One rules-engine alert per (store, device, rule)
+        IndexModel([("dedup_key", ASCENDING)], unique=True,
+                   partialFilterExpression={"dedup_key": {"$exists": True}}),
+        IndexModel([("store_id", ASCENDING), ("dedup_key", ASCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "tickets": [
+        IndexModel([("id", ASCENDING)], unique=True),
+        # Queue filters, each followed by the (created_at, id) page order
+        IndexModel([("created_at", DESCENDING), ("id", ASCENDING)]),
+        IndexModel([("status", ASCENDING), ("created_at", DESCENDING), ("id", ASCENDING)]),
+        IndexModel([("reported_to", ASCENDING), ("created_at", DESCENDING), ("id", ASCENDING)]),
+        IndexModel([("sap_code", ASCENDING), ("created_at", DESCENDING), ("id", ASCENDING)]),
+        IndexModel([("device_id", ASCENDING), ("created_at", DESCENDING)]),
+        IndexModel([("updated_at", ASCENDING)]),
+    ],
+    "weight_daily": [
+        IndexModel([("day", ASCENDING), ("store_id", ASCENDING), ("product", ASCENDING)], unique=True),
+        IndexModel([("product", ASCENDING), ("day", ASCENDING)]),
+    ],
+    "device_daily": [
+        IndexModel([("device_id", ASCENDING), ("day", ASCENDING)], unique=True),
+        IndexModel([("day", ASCENDING)]),
+    ],
+    "weight_reading_keys": [
+        IndexModel([("created_at", ASCENDING)], expireAfterSeconds=WEIGHT_READING_DEDUP_TTL),
+    ],
+    **{
+        collection: [
+            IndexModel([("period", ASCENDING), ("store_id", ASCENDING), ("product", ASCENDING),
+                        ("device_type", ASCENDING)], unique=True),
+            IndexModel([("store_id", ASCENDING), ("period", ASCENDING)]),
+            IndexModel([("product", ASCENDING), ("period", ASCENDING)]),
+        ]
+        for collection in SALES_CUBES.values()
+    },
+}
+
+async def sync_store_locations(query: dict):
+    """Store latitude/longitude as a GeoJSON point for the 2dsphere index"""
+    await db.stores.update_many(query, [
+        {"$set": {"location": {"type": "Point", "coordinates": ["$longitude", "$latitude"]}}}
+    ])
+
+async def ensure_indexes():
+    await sync_store_locations({"location": {"$exists": False}})
+    for collection, indexes in INDEXES.items():
+        try:
+            await db[collection].create_indexes(indexes)
+        except OperationFailure as e:
+            logger.error(f"Could not create indexes on {collection}: {str(e)}")
 
 async def initialize_data_fixed():
     """Initialize data with correct naming (Local instead of Sucursal)"""
@@ -601,7 +5046,7 @@ async def initialize_data_fixed():
         )
         stores.append(store.dict())
     
-    await db.stores.insert_many(stores)
+    await insert_stores(stores)
     
     # Create sample campaigns (same as before)
     campaigns = [
@@ -636,37 +5081,102 @@ async def initialize_data_fixed():
     ]
     await db.campaigns.insert_many([c.dict() for c in campaigns])
     
-    # Create alerts (same as before)
-    alerts = []
-    for i, store in enumerate(stores[:10]):
-        if i % 3 == 0:
-            alerts.append(Alert(
-                store_id=store["id"],
-                store_name=f"{store['name']} - {store['comuna']}",
-                type="calibration",
-                message="Calibración trimestral pendiente",
-                priority="medium",
-                created_at=(datetime.now(timezone.utc) - timedelta(days=random.randint(1, 7))).isoformat(),
-                resolved=False
-            ).dict())
-        elif i % 3 == 1:
-            alerts.append(Alert(
-                store_id=store["id"],
-                store_name=f"{store['name']} - {store['comuna']}",
-                type="maintenance",
-                message="Mantenimiento preventivo requerido",
-                priority="high",
-                created_at=(datetime.now(timezone.utc) - timedelta(days=random.randint(1, 5))).isoformat(),
-                resolved=False
-            ).dict())
+    # Alerts are raised by the rules engine as the stores are inserted
     
-    if alerts:
-        await db.alerts.insert_many(alerts)
+    await seed_weight_readings(stores)
+
+async def migrate_embedded_devices():
+    """Move devices still embedded in store documents into the devices collection"""
+    store_ids = []
+    async for store in db.stores.find({"devices": {"$exists": True}}, {"_id": 0, "id": 1, "devices": 1}):
+        if store["devices"]:
+            # Upserts keep the migration idempotent if it is interrupted
+            await db.devices.bulk_write([
+                ReplaceOne({"id": device["id"]}, {**device, "store_id": store["id"]}, upsert=True)
+                for device in store["devices"]
+            ], ordered=False)
+        store_ids.append(store["id"])
+    if store_ids:
+        await db.stores.update_many({"id": {"$in": store_ids}}, {"$unset": {"devices": ""}})
+        await refresh_store_rollups({"id": {"$in": store_ids}})
+        logger.info(f"Moved embedded devices of {len(store_ids)} stores into the devices collection")
+
+async def migrate_updated_at():
+    """Stamp stores, devices, tickets and alerts written before `updated_at`
+    existed; the next incremental export includes them once"""
+    now = datetime.now(timezone.utc)
+    for collection in (db.stores, db.devices, db.tickets, db.alerts):
+        await collection.update_many({"updated_at": {"$exists": False}}, {"$set": {"updated_at": now}})
 
-@app.on_event("startup")
-async def startup_event():
-    await initialize_data_fixed()
-    logger.info("Database initialized with sample data (Local naming fixed)")
+async def migrate_calibration_dates():
+    """Convert legacy ISO-string calibration dates into BSON dates"""
+    requests = []
+    device_ids, store_ids = [], set()
+    async for device in db.devices.find(
+        {"last_calibration": {"$type": "string"}},
+        {"_id": 0, "id": 1, "store_id": 1, "last_calibration": 1}
+    ):
+        requests.append(UpdateOne(
+            {"id": device["id"]},
+            {"$set": {"last_calibration": datetime.fromisoformat(device["last_calibration"])}}
+        ))
+        device_ids.append(device["id"])
+        store_ids.add(device["store_id"])
+    if requests:
+        await db.devices.bulk_write(requests, ordered=False)
+        await refresh_store_rollups({"id": {"$in": list(store_ids)}})
+        await refresh_maintenance_scores({"id": {"$in": device_ids}})
+        logger.info(f"Migrated calibration dates to BSON dates for {len(requests)} devices")
+
+async def start_services():
+    """Prepare the database, start the background services and bootstrap the
+    data in the background.
+
+    Only collections and indexes are awaited, so the server accepts requests
+    (and answers /api/health/db) while migrations and seeding run. The
+    services do not wait for the bootstrap, which is retried until it
+    succeeds.
+    """
+    await ensure_weight_collections()
+    # Rollups are merged into stores on the unique id index, so create it first
+    await ensure_indexes()
+    app.state.bootstrap_error = None
+    app.state.bootstrap = asyncio.create_task(bootstrap_data())
+    app.state.prediction_refresher = asyncio.create_task(refresh_ai_predictions_periodically())
+    app.state.maintenance_refresher = asyncio.create_task(refresh_maintenance_scores_periodically())
+    app.state.obsolescence_refresher = asyncio.create_task(refresh_obsolescence_periodically())
+    app.state.supply_refresher = asyncio.create_task(refresh_supply_forecasts_periodically())
+    app.state.alert_sweeper = asyncio.create_task(sweep_calibration_alerts_periodically())
+    stream_hub.start()
+    deployment_engine.start()
+
+async def bootstrap_data():
+    """Run the migrations and seeding, retrying with exponential backoff; the
+    last failure is reported by /api/health/db until an attempt succeeds"""
+    delay = BOOTSTRAP_RETRY_DELAY
+    while True:
+        try:
+            await migrate_embedded_devices()
+            await initialize_data_fixed()
+            await migrate_calibration_dates()
+            await migrate_updated_at()
+            await refresh_store_rollups({"rollup": {"$exists": False}})
+            await fleet_snapshot.ensure()
+            if not await db.device_daily.count_documents({}, limit=1):
+                await backfill_device_daily()  # monthly weighings used to be counted from the raw readings
+            if not await db.supplies.count_documents({}, limit=1):
+                await seed_supplies()
+            if not await db.alerts.count_documents({"dedup_key": {"$exists": True}}, limit=1):
+                await evaluate_alerts({})  # backfill rule alerts once for existing fleets
+        except Exception as e:
+            logger.exception(f"Database bootstrap failed, retrying in {delay:g}s")
+            app.state.bootstrap_error = f"{e.__class__.__name__}: {str(e)}"
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, BOOTSTRAP_RETRY_MAX_DELAY)
+            continue
+        app.state.bootstrap_error = None
+        logger.info("Database initialized with sample data (Local naming fixed)")
+        return
 
 app.include_router(api_router)
 
@@ -676,6 +5186,7 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
 logging.basicConfig(
@@ -684,6 +5195,11 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-@app.on_event("shutdown")
-async def shutdown_db_client():
-    client.close()
\ No newline at end of file
+async def stop_services():
+    for name in ("bootstrap", "prediction_refresher", "maintenance_refresher", "obsolescence_refresher",
+                 "supply_refresher", "alert_sweeper"):
+        task = getattr(app.state, name, None)
+        if task:
+            task.cancel()
+    stream_hub.stop()
+    await deployment_engine.stop()
\ No newline at end of file
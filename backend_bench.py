@@ -0,0 +1,296 @@
+#!/usr/bin/env python3
+"""
+Latency/throughput benchmark for the BM MANAGER backend
+Seeds a fleet of configurable size and drives every /api route in-process
+through httpx's ASGI transport, reporting p50/p95/p99 latency, throughput and
+response size. Results are written as JSON so runs can be compared between
+commits:
+
+    python backend_bench.py --stores 20,1000 --output bench_results/new.json \
+        --compare bench_results/old.json
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+ROOT_DIR = Path(__file__).parent
+sys.path.insert(0, str(ROOT_DIR / "backend"))
+
+# Routes that are destructive, long-lived or not request/response shaped
+SKIPPED_ROUTES = {"/api/fix-naming", "/api/stream"}
+
+# Query parameters for routes that require them
+ROUTE_PARAMS = {
+    "/api/stores/near": {"lat": -33.45, "lon": -70.65, "radius": 20000},
+    "/api/stores/within": {"bbox": "-71.5,-34.0,-70.0,-33.0"},
+    "/api/stores/clusters": {"bbox": "-71.5,-34.0,-70.0,-33.0", "zoom": 10},
+}
+
+
+def percentile(sorted_values, pct):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, round(pct / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+
+def git_commit():
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+class BackendBenchmark:
+    def __init__(self, args):
+        self.args = args
+        os.environ.setdefault("MONGO_URL", args.mongo_url)
+        os.environ["DB_NAME"] = args.db_name
+        import server
+        self.server = server
+        if args.mongomock:
+            from mongomock_motor import AsyncMongoMockClient
+            server.client = AsyncMongoMockClient(tz_aware=True)
+            server.db = server.client[args.db_name]
+            # mongomock has no per-database read preference / write concern
+            server.route_db = lambda route_class: server.db
+        else:
+            server.connect_database()
+        self.db = server.db
+
+    async def seed(self, store_count):
+        """Replace the benchmark database with `store_count` stores"""
+        server = self.server
+        for name in await self.db.list_collection_names():
+            await self.db.drop_collection(name)
+        try:
+            await server.ensure_weight_collections()
+        except NotImplementedError:
+            pass  # mongomock has no time-series collections
+        try:
+            # Rollups are merged on the unique stores.id index
+            await server.ensure_indexes()
+        except NotImplementedError:
+            pass
+        if self.args.mongomock:
+            # mongomock ignores partialFilterExpression, so manual alerts would collide on a null dedup_key
+            await self.db.alerts.drop_index("dedup_key_1")
+
+        comunas = server.SANTIAGO_COMUNAS
+        types = ["BMS_ASISTIDA", "AUTOSERVICIO", "IA"]
+        stores = []
+        for i in range(store_count):
+            comuna = comunas[i % len(comunas)]
+            devices = [server.generate_device(types[d % len(types)]) for d in range(self.args.devices_per_store)]
+            stores.append(server.Store(
+                name=f"Local {i + 1}",
+                comuna=comuna["name"],
+                sap_code=f"SAP-{1000 + i}",
+                address=f"Av. Principal {100 + i}, {comuna['name']}",
+                latitude=comuna["lat"] + (i % 97) * 0.0002,
+                longitude=comuna["lon"] + (i % 89) * 0.0002,
+                status="online",
+                balances_bms=sum(1 for d in devices if d.type == "BMS_ASISTIDA"),
+                balances_autoservicio=sum(1 for d in devices if d.type == "AUTOSERVICIO"),
+                balances_ia=sum(1 for d in devices if d.type == "IA"),
+                last_update=datetime.now(timezone.utc).isoformat(),
+                latency=20,
+                devices=[d.dict() for d in devices]
+            ).dict())
+        for start in range(0, len(stores), 1000):
+            await server.insert_stores(stores[start:start + 1000])
+        if self.args.mongomock:
+            await self.patch_mongomock_seed(stores)
+        await self.db.alerts.insert_many([
+            server.Alert(
+                store_id=store["id"],
+                store_name=store["name"],
+                type="maintenance",
+                message="Mantenimiento preventivo requerido",
+                priority="high",
+                created_at=datetime.now(timezone.utc).isoformat()
+            ).dict()
+            for store in stores[::3]
+        ])
+        await self.db.tickets.insert_many([
+            server.Ticket(
+                device_id=store["devices"][0]["id"],
+                store_name=store["name"],
+                store_comuna=store["comuna"],
+                store_address=store["address"],
+                sap_code=store["sap_code"],
+                issue="Balanza no calibra correctamente",
+                description="Ticket generado por el benchmark",
+                reported_to="Servicio Técnico"
+            ).dict()
+            for store in stores[::2]
+        ])
+        await server.seed_weight_readings(stores)
+        return stores
+
+    async def patch_mongomock_seed(self, stores):
+        """Write what mongomock cannot: its $max fails against a null `last_seen`
+        (telemetry) and its pipeline updates store "$longitude"/"$latitude" as
+        literals instead of the store coordinates (geo routes, store detail)"""
+        from pymongo import UpdateOne
+        await self.db.devices.update_many({"last_seen": None}, {"$set": {"last_seen": datetime.now(timezone.utc)}})
+        await self.db.stores.bulk_write([
+            UpdateOne({"id": store["id"]}, {"$set": {"location": {
+                "type": "Point", "coordinates": [store["longitude"], store["latitude"]],
+            }}})
+            for store in stores
+        ], ordered=False)
+
+    def routes(self, stores):
+        """(name, method, path, params, body) for every benchmarked /api route"""
+        sample = stores[0]
+        requests = []
+        for route in self.server.app.routes:
+            path = getattr(route, "path", "")
+            methods = getattr(route, "methods", None) or set()
+            if not path.startswith("/api") or path in SKIPPED_ROUTES or "GET" not in methods:
+                continue
+            url = path.replace("{store_id}", sample["id"]).replace("{device_id}", sample["devices"][0]["id"])
+            if "{" in url:
+                continue
+            requests.append((f"GET {path}", "GET", url, ROUTE_PARAMS.get(path, {}), None))
+
+        readings = "\n".join(
+            json.dumps({"store_id": store["id"], "device_id": device["id"], "status": "online", "weight_kg": 0.5})
+            for store in stores[:self.args.telemetry_stores] for device in store["devices"]
+        )
+        requests.append(("POST /api/telemetry/batch", "POST", "/api/telemetry/batch", {}, readings))
+        return requests
+
+    async def drive(self, client, method, url, params, body):
+        """Latency stats of a route, or its error rate when any response is not 2xx"""
+        latencies, sizes, statuses = [], [], {}
+        semaphore = asyncio.Semaphore(self.args.concurrency)
+        headers = {"Content-Type": "application/x-ndjson"} if body else {}
+
+        async def one():
+            async with semaphore:
+                started = time.perf_counter()
+                response = await client.request(method, url, params=params, content=body, headers=headers)
+                latencies.append((time.perf_counter() - started) * 1000)
+                sizes.append(len(response.content))
+                statuses[response.status_code] = statuses.get(response.status_code, 0) + 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*[one() for _ in range(self.args.requests)])
+        elapsed = time.perf_counter() - started
+        errors = sum(count for status, count in statuses.items() if not 200 <= status < 300)
+        if errors:
+            # Timings of failing requests say nothing about the route
+            return {
+                "requests": len(latencies),
+                "failed": True,
+                "errors": errors,
+                "error_rate": round(errors / len(latencies), 3),
+                "status_codes": {str(status): count for status, count in sorted(statuses.items())},
+            }
+        latencies.sort()
+        return {
+            "requests": len(latencies),
+            "errors": 0,
+            "p50_ms": round(percentile(latencies, 50), 3),
+            "p95_ms": round(percentile(latencies, 95), 3),
+            "p99_ms": round(percentile(latencies, 99), 3),
+            "mean_ms": round(sum(latencies) / len(latencies), 3),
+            "throughput_rps": round(len(latencies) / elapsed, 1),
+            "bytes_per_response": round(sum(sizes) / len(sizes)),
+        }
+
+    async def run(self):
+        import httpx
+        results = {}
+        for store_count in self.args.stores:
+            print(f"\n🏬 Seeding {store_count} stores × {self.args.devices_per_store} devices")
+            stores = await self.seed(store_count)
+            transport = httpx.ASGITransport(app=self.server.app, raise_app_exceptions=False)
+            async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=120) as client:
+                fleet = {}
+                for name, method, url, params, body in self.routes(stores):
+                    fleet[name] = stats = await self.drive(client, method, url, params, body)
+                    if stats.get("failed"):
+                        print(f"  {name:<40} ❌ failed: {stats['error_rate']:.0%} non-2xx {stats['status_codes']}")
+                        continue
+                    print(f"  {name:<40} p50 {stats['p50_ms']:>9.2f}ms  p95 {stats['p95_ms']:>9.2f}ms  "
+                          f"p99 {stats['p99_ms']:>9.2f}ms  {stats['throughput_rps']:>8.1f} req/s  "
+                          f"{stats['bytes_per_response']:>10} B")
+                results[str(store_count)] = fleet
+        return {
+            "commit": git_commit(),
+            "timestamp": datetime.now(timezone.utc).isoformat(),
+            "config": {
+                "stores": self.args.stores,
+                "devices_per_store": self.args.devices_per_store,
+                "concurrency": self.args.concurrency,
+                "requests": self.args.requests,
+                "backend": "mongomock" if self.args.mongomock else "mongodb",
+            },
+            "results": results,
+        }
+
+
+def compare(current, previous, threshold):
+    """Print p95/throughput deltas against a previous run; return the regressions"""
+    print(f"\n📊 Comparison with {previous.get('commit')} ({previous.get('timestamp')})")
+    regressions = []
+    for fleet, routes in current["results"].items():
+        for route, stats in routes.items():
+            old = previous.get("results", {}).get(fleet, {}).get(route)
+            if not old or old.get("failed") or not old.get("p95_ms"):
+                continue
+            if stats.get("failed"):
+                print(f"⚠️ [{fleet}] {route:<40} now failing ({stats['error_rate']:.0%} non-2xx)")
+                regressions.append(f"[{fleet}] {route}")
+                continue
+            change = (stats["p95_ms"] - old["p95_ms"]) / old["p95_ms"]
+            marker = "⚠️ " if change > threshold else "  "
+            print(f"{marker}[{fleet}] {route:<40} p95 {old['p95_ms']:>9.2f} → {stats['p95_ms']:>9.2f}ms "
+                  f"({change:+.0%})  {old['throughput_rps']:>8.1f} → {stats['throughput_rps']:>8.1f} req/s")
+            if change > threshold:
+                regressions.append(f"[{fleet}] {route}")
+    return regressions
+
+
+def parse_args():
+    parser = argparse.ArgumentParser(description="Benchmark the BM MANAGER API in-process")
+    parser.add_argument("--stores", default="20,1000",
+                        type=lambda v: [int(n) for n in v.split(",")], help="comma-separated fleet sizes")
+    parser.add_argument("--devices-per-store", type=int, default=6)
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--requests", type=int, default=200, help="requests per route")
+    parser.add_argument("--telemetry-stores", type=int, default=100, help="stores per telemetry batch")
+    parser.add_argument("--mongo-url", default=os.environ.get("MONGO_URL", "mongodb://localhost:27017"))
+    parser.add_argument("--db-name", default="bm_manager_bench")
+    parser.add_argument("--mongomock", action="store_true", help="use mongomock-motor instead of MongoDB")
+    parser.add_argument("--output", help="results file (default bench_results/<commit>.json)")
+    parser.add_argument("--compare", help="previous results file to compare against")
+    parser.add_argument("--regression-threshold", type=float, default=0.2, help="allowed p95 increase")
+    return parser.parse_args()
+
+
+if __name__ == "__main__":
+    args = parse_args()
+    benchmark = BackendBenchmark(args)
+    report = asyncio.run(benchmark.run())
+
+    output = Path(args.output or ROOT_DIR / "bench_results" / f"{report['commit']}.json")
+    output.parent.mkdir(parents=True, exist_ok=True)
+    output.write_text(json.dumps(report, indent=2))
+    print(f"\n💾 Results written to {output}")
+
+    if args.compare:
+        regressions = compare(report, json.loads(Path(args.compare).read_text()), args.regression_threshold)
+        if regressions:
+            print(f"\n❌ {len(regressions)} failing routes or p95 regressions above {args.regression_threshold:.0%}")
+            sys.exit(1)
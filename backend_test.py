@@ -5,8 +5,10 @@ Tests all API endpoints with proper data validation
 """
 
 import requests
+import base64
 import json
 import sys
+import time
 from datetime import datetime
 import uuid
 
@@ -92,6 +94,217 @@ class BackendTester:
         except Exception as e:
             self.log_test("GET /stores", False, f"Exception: {str(e)}")
     
+    def test_device_update_rollup(self):
+        """Test PUT /stores/{id}/devices/{device_id} keeps the store rollup in sync"""
+        try:
+            response = self.session.get(f"{BACKEND_URL}/stores", params={"limit": 1})
+            if response.status_code != 200 or not response.json():
+                self.log_test("PUT /stores/{id}/devices/{device_id}", False, f"Status: {response.status_code}")
+                return
+            store = response.json()[0]
+            device = store['devices'][0]
+            new_status = 'maintenance' if device['status'] != 'maintenance' else 'online'
+            response = self.session.put(f"{BACKEND_URL}/stores/{store['id']}/devices/{device['id']}",
+                                        json={"status": new_status})
+            if response.status_code != 200:
+                self.log_test("PUT /stores/{id}/devices/{device_id}", False, f"Status: {response.status_code}, Response: {response.text}")
+                return
+            updated = self.session.get(f"{BACKEND_URL}/stores/{store['id']}").json()
+            rollup = updated.get('rollup') or {}
+            expected_online = sum(1 for d in updated['devices'] if d['status'] == 'online')
+            if rollup.get('online') == expected_online and rollup.get('total') == len(updated['devices']):
+                self.log_test("PUT /stores/{id}/devices/{device_id}", True, f"Rollup updated: {rollup.get('online')}/{rollup.get('total')} online")
+            else:
+                self.log_test("PUT /stores/{id}/devices/{device_id}", False, f"Rollup out of sync: {rollup}")
+        except Exception as e:
+            self.log_test("PUT /stores/{id}/devices/{device_id}", False, f"Exception: {str(e)}")
+    
+    def test_devices_endpoints(self):
+        """Test GET /devices paging and PATCH /devices/{id}"""
+        try:
+            response = self.session.get(f"{BACKEND_URL}/devices", params={"limit": 5})
+            if response.status_code != 200 or not response.json():
+                self.log_test("GET /devices", False, f"Status: {response.status_code}")
+                return
+            devices = response.json()
+            cursor = response.headers.get('X-Next-Cursor')
+            if cursor:
+                next_page = self.session.get(f"{BACKEND_URL}/devices", params={"limit": 5, "cursor": cursor}).json()
+                if next_page and next_page[0]['id'] <= devices[-1]['id']:
+                    self.log_test("GET /devices", False, "Cursor page overlaps the previous page")
+                    return
+            self.log_test("GET /devices", True, f"Retrieved {len(devices)} devices, next cursor: {bool(cursor)}")
+            
+            device = devices[0]
+            new_status = 'maintenance' if device['status'] != 'maintenance' else 'online'
+            response = self.session.patch(f"{BACKEND_URL}/devices/{device['id']}", json={"status": new_status})
+            if response.status_code == 200 and response.json().get('status') == new_status:
+                self.log_test("PATCH /devices/{id}", True, f"Device {device['id']} set to {new_status}")
+            else:
+                self.log_test("PATCH /devices/{id}", False, f"Status: {response.status_code}, Response: {response.text}")
+        except Exception as e:
+            self.log_test("GET /devices", False, f"Exception: {str(e)}")
+    
+    def test_maintenance_scores_endpoints(self):
+        """Test GET /maintenance/scores ordering and GET /maintenance/summary"""
+        try:
+            response = self.session.get(f"{BACKEND_URL}/maintenance/scores", params={"limit": 20})
+            if response.status_code != 200:
+                self.log_test("GET /maintenance/scores", False, f"Status: {response.status_code}, Response: {response.text}")
+                return
+            scores = response.json()
+            risks = [s['maintenance_risk'] for s in scores]
+            if risks == sorted(risks, reverse=True):
+                self.log_test("GET /maintenance/scores", True, f"Retrieved {len(scores)} scores sorted by risk")
+            else:
+                self.log_test("GET /maintenance/scores", False, f"Scores not sorted by risk: {risks}")
+            
+            response = self.session.get(f"{BACKEND_URL}/maintenance/summary")
+            summary = response.json() if response.status_code == 200 else {}
+            if summary and summary['high'] + summary['medium'] + summary['low'] == summary['total']:
+                self.log_test("GET /maintenance/summary", True, f"{summary['total']} devices, avg risk {summary['avg_risk']}")
+            else:
+                self.log_test("GET /maintenance/summary", False, f"Status: {response.status_code}, Response: {response.text}")
+        except Exception as e:
+            self.log_test("GET /maintenance/scores", False, f"Exception: {str(e)}")
+    
+    def test_obsolescence_endpoints(self):
+        """Test GET /obsolescence/devices pages by score and /obsolescence/summary adds up"""
+        try:
+            params = {"provider": "Allcom IA Systems"}
+            devices = self.session.get(f"{BACKEND_URL}/obsolescence/devices", params={**params, "limit": 1000}).json()
+            summary = self.session.get(f"{BACKEND_URL}/obsolescence/summary", params=params).json()
+            scores = [d['obsolescence_score'] for d in devices]
+            if (scores == sorted(scores, reverse=True) and summary['devices'] == len(devices)
+                    and sum(g['devices'] for g in summary['by_priority']) == summary['devices']
+                    and all(d['provider'] == params['provider'] and d['needs_attention'] for d in devices)):
+                self.log_test("Obsolescence endpoints", True,
+                            f"{summary['devices']} devices, ${summary['replacement_cost']:,} to replace")
+            else:
+                self.log_test("Obsolescence endpoints", False, f"Summary {summary} vs {len(devices)} devices")
+        except Exception as e:
+            self.log_test("Obsolescence endpoints", False, f"Exception: {str(e)}")
+    
+    def test_export_endpoints(self):
+        """Test the streaming NDJSON and CSV exports"""
+        try:
+            response = self.session.get(f"{BACKEND_URL}/export/stores", stream=True)
+            lines = [line for line in response.iter_lines() if line]
+            if response.status_code == 200 and lines and all('id' in json.loads(line) for line in lines):
+                self.log_test("GET /export/stores", True, f"Streamed {len(lines)} stores as NDJSON")
+            else:
+                self.log_test("GET /export/stores", False, f"Status: {response.status_code}")
+            
+            response = self.session.get(f"{BACKEND_URL}/export/devices", params={"format": "csv", "gzip": "true"})
+            if response.status_code == 200 and response.headers.get('content-type', '').startswith('application/gzip'):
+                self.log_test("GET /export/devices", True, f"Received {len(response.content)} bytes of gzipped CSV")
+            else:
+                self.log_test("GET /export/devices", False, f"Status: {response.status_code}")
+        except Exception as e:
+            self.log_test("GET /export", False, f"Exception: {str(e)}")
+    
+    def test_asset_endpoints(self):
+        """Test uploading an image asset and fetching it with ETag and Range"""
+        try:
+            # 1x1 PNG
+            png = base64.b64decode("iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mP8z8BQDwAEhQGAhKmMIQAAAABJRU5ErkJggg==")
+            response = self.session.post(f"{BACKEND_URL}/assets", data=png, headers={'Content-Type': 'image/png'})
+            if response.status_code != 200:
+                self.log_test("POST /assets", False, f"Status: {response.status_code}, Response: {response.text}")
+                return
+            asset = response.json()
+            self.log_test("POST /assets", True, f"Stored {asset['sha256'][:12]} ({asset['size']} bytes)")
+            
+            url = f"{BACKEND_URL}/assets/{asset['sha256']}"
+            cached = self.session.get(url, headers={'If-None-Match': f'"{asset["sha256"]}"'})
+            partial = self.session.get(url, headers={'Range': 'bytes=0-9'})
+            if cached.status_code == 304 and partial.status_code == 206 and len(partial.content) == 10:
+                self.log_test("GET /assets/{sha256}", True, "ETag and Range requests honoured")
+            else:
+                self.log_test("GET /assets/{sha256}", False, f"If-None-Match: {cached.status_code}, Range: {partial.status_code}")
+        except Exception as e:
+            self.log_test("POST /assets", False, f"Exception: {str(e)}")
+    
+    def test_deployment_endpoints(self):
+        """Test POST /deployments runs a self-service flow rollout to completion"""
+        try:
+            response = self.session.post(f"{BACKEND_URL}/deployments", json={
+                "kind": "self_service_flow",
+                "package": {"steps": [{"id": 1, "title": "Bienvenido", "image": "https://example.com/1.jpg"}]},
+                "device_types": ["AUTOSERVICIO"]
+            })
+            if response.status_code != 200:
+                self.log_test("POST /deployments", False, f"Status: {response.status_code}, Response: {response.text}")
+                return
+            deployment = response.json()
+            for _ in range(30):
+                deployment = self.session.get(f"{BACKEND_URL}/deployments/{deployment['id']}").json()
+                if deployment['status'] not in ('queued', 'running'):
+                    break
+                time.sleep(1)
+            finished = deployment['deployed_stores'] + deployment['failed_stores']
+            if deployment['status'] in ('completed', 'partial') and finished == deployment['total_stores']:
+                self.log_test("POST /deployments", True,
+                            f"{deployment['deployed_stores']}/{deployment['total_stores']} stores, {deployment['deployed_count']} balances")
+            else:
+                self.log_test("POST /deployments", False, f"Deployment did not finish: {deployment['status']}")
+        except Exception as e:
+            self.log_test("POST /deployments", False, f"Exception: {str(e)}")
+    
+    def test_telemetry_batch_endpoint(self):
+        """Test POST /telemetry/batch with an NDJSON payload"""
+        try:
+            stores = self.session.get(f"{BACKEND_URL}/stores", params={"limit": 2}).json()
+            readings = [
+                {"store_id": store['id'], "device_id": device['id'], "weight_kg": 1.25}
+                for store in stores for device in store['devices']
+            ]
+            readings.append({"store_id": "unknown-store", "device_id": "unknown-device"})
+            body = "\n".join(json.dumps(r) for r in readings)
+            response = self.session.post(f"{BACKEND_URL}/telemetry/batch", data=body,
+                                         headers={'Content-Type': 'application/x-ndjson'})
+            if response.status_code == 200:
+                result = response.json()
+                if result.get('accepted') == len(readings) - 1 and result.get('rejected') == 1:
+                    self.log_test("POST /telemetry/batch", True,
+                                f"Accepted {result['accepted']} readings across {result['stores_updated']} stores")
+                else:
+                    self.log_test("POST /telemetry/batch", False, f"Unexpected acceptance: {result}")
+            else:
+                self.log_test("POST /telemetry/batch", False, f"Status: {response.status_code}, Response: {response.text}")
+        except Exception as e:
+            self.log_test("POST /telemetry/batch", False, f"Exception: {str(e)}")
+    
+    def test_query_plans_endpoint(self):
+        """Test GET /diagnostics/query-plans reports no collection scans"""
+        try:
+            response = self.session.get(f"{BACKEND_URL}/diagnostics/query-plans")
+            if response.status_code == 200:
+                report = response.json()
+                scans = [q['name'] for q in report.get('queries', []) if q.get('collscan') or q.get('error')]
+                if report.get('ok'):
+                    self.log_test("GET /diagnostics/query-plans", True, f"{len(report['queries'])} hot queries use indexes")
+                else:
+                    self.log_test("GET /diagnostics/query-plans", False, f"Unindexed queries: {scans}")
+            else:
+                self.log_test("GET /diagnostics/query-plans", False, f"Status: {response.status_code}, Response: {response.text}")
+        except Exception as e:
+            self.log_test("GET /diagnostics/query-plans", False, f"Exception: {str(e)}")
+    
+    def test_db_health_endpoint(self):
+        """Test GET /health/db reports ping latency and pool usage"""
+        try:
+            response = self.session.get(f"{BACKEND_URL}/health/db")
+            health = response.json() if response.status_code == 200 else {}
+            pool = health.get('pool', {})
+            if health.get('status') == 'ok' and pool.get('checkouts', 0) > 0 and 'wait_ms_p95' in pool:
+                self.log_test("GET /health/db", True, f"Ping {health['ping_ms']} ms, {pool['in_use']}/{pool['max_pool_size']} connections in use, "
+                                                     f"p95 checkout wait {pool['wait_ms_p95']} ms")
+            else:
+                self.log_test("GET /health/db", False, f"Status: {response.status_code}, Response: {response.text}")
+        except Exception as e:
+            self.log_test("GET /health/db", False, f"Exception: {str(e)}")
+    
     def test_fix_naming_endpoint(self):
         """Test POST /fix-naming endpoint"""
         try:
@@ -207,6 +420,43 @@ class BackendTester:
         except Exception as e:
             self.log_test("POST /tickets", False, f"Exception: {str(e)}")
     
+    def test_ticket_workflow(self):
+        """Test ticket status transitions, queue filters and SLA aggregation"""
+        try:
+            ticket = self.session.post(f"{BACKEND_URL}/tickets", json={
+                "device_id": str(uuid.uuid4()),
+                "store_name": "Local Providencia",
+                "store_comuna": "Providencia",
+                "store_address": "Av. Providencia 2124, Providencia",
+                "sap_code": "SAP-TEST-SLA",
+                "issue": "Impresora atascada",
+                "description": "Ticket de prueba del flujo de estados",
+                "reported_to": "Alcom"
+            }).json()
+            moves = [self.session.patch(f"{BACKEND_URL}/tickets/{ticket['id']}", json={"status": status})
+                     for status in ("En Proceso", "Resuelto", "Pendiente")]
+            resolved = moves[1].json() if moves[1].status_code == 200 else {}
+            if [m.status_code for m in moves] == [200, 200, 409] and resolved.get('resolution_hours') is not None:
+                self.log_test("PATCH /tickets/{id}", True, f"Resolved in {resolved['resolution_hours']} h, reopening rejected")
+            else:
+                self.log_test("PATCH /tickets/{id}", False, f"Statuses: {[m.status_code for m in moves]}, Ticket: {resolved}")
+            
+            found = self.session.get(f"{BACKEND_URL}/tickets", params={"status": "Resuelto", "sap_code": "SAP-TEST-SLA"}).json()
+            if any(t['id'] == ticket['id'] for t in found):
+                self.log_test("GET /tickets filters", True, f"{len(found)} resolved tickets for SAP-TEST-SLA")
+            else:
+                self.log_test("GET /tickets filters", False, "Resolved ticket not found by status and sap_code")
+            
+            response = self.session.get(f"{BACKEND_URL}/tickets/sla")
+            sla = response.json() if response.status_code == 200 else {}
+            alcom = next((g for g in sla.get('by_provider', []) if g['key'] == 'Alcom'), None)
+            if alcom and alcom['resolved'] >= 1 and alcom['mean_hours_to_resolve'] is not None:
+                self.log_test("GET /tickets/sla", True, f"Alcom backlog {alcom['backlog']}, mean {alcom['mean_hours_to_resolve']} h to resolve")
+            else:
+                self.log_test("GET /tickets/sla", False, f"Status: {response.status_code}, Response: {response.text}")
+        except Exception as e:
+            self.log_test("PATCH /tickets/{id}", False, f"Exception: {str(e)}")
+    
     def test_campaigns_endpoints(self):
         """Test campaigns endpoints"""
         try:
@@ -254,6 +504,45 @@ class BackendTester:
         except Exception as e:
             self.log_test("GET /alerts", False, f"Exception: {str(e)}")
     
+    def test_alert_rules(self):
+        """Test rule alerts are raised once per device and cleared when the condition goes away"""
+        try:
+            device = self.session.get(f"{BACKEND_URL}/devices", params={"limit": 1}).json()[0]
+            
+            def rule_alerts():
+                return [a for a in self.session.get(f"{BACKEND_URL}/alerts").json()
+                        if a.get('device_id') == device['id'] and a.get('rule') == 'printhead_low']
+            
+            for life in (5, 4):
+                self.session.patch(f"{BACKEND_URL}/devices/{device['id']}", json={"printhead_life": life})
+            raised = rule_alerts()
+            self.session.patch(f"{BACKEND_URL}/devices/{device['id']}", json={"printhead_life": device.get('printhead_life', 100)})
+            cleared = rule_alerts()
+            if len(raised) == 1 and '4%' in raised[0]['message'] and not cleared:
+                self.log_test("Alert rules", True, f"printhead_low raised once and cleared for {device['id']}")
+            else:
+                self.log_test("Alert rules", False, f"Raised: {raised}, after clearing: {cleared}")
+        except Exception as e:
+            self.log_test("Alert rules", False, f"Exception: {str(e)}")
+    
+    def test_fraud_detection(self):
+        """Test soda-can weighings labelled as produce raise a single fraud alert"""
+        try:
+            device = self.session.get(f"{BACKEND_URL}/devices", params={"type": "AUTOSERVICIO", "limit": 1}).json()[0]
+            reading = {"store_id": device['store_id'], "device_id": device['id'], "product": "Palta", "weight_kg": 0.335}
+            body = "\n".join(json.dumps(reading) for _ in range(8))
+            for _ in range(2):
+                self.session.post(f"{BACKEND_URL}/telemetry/batch", data=body,
+                                  headers={'Content-Type': 'application/x-ndjson'})
+            alerts = [a for a in self.session.get(f"{BACKEND_URL}/alerts").json()
+                      if a.get('device_id') == device['id'] and a.get('rule') == 'product_mismatch']
+            if len(alerts) == 1 and alerts[0]['type'] == 'fraud':
+                self.log_test("Fraud detection", True, alerts[0]['message'])
+            else:
+                self.log_test("Fraud detection", False, f"Fraud alerts for {device['id']}: {alerts}")
+        except Exception as e:
+            self.log_test("Fraud detection", False, f"Exception: {str(e)}")
+    
     def test_metrics_endpoint(self):
         """Test metrics endpoint"""
         try:
@@ -284,6 +573,66 @@ class BackendTester:
         except Exception as e:
             self.log_test("GET /metrics", False, f"Exception: {str(e)}")
     
+    def test_sales_analytics_endpoint(self):
+        """Test GET /analytics/sales group-by queries over the sales cubes"""
+        try:
+            response = self.session.get(f"{BACKEND_URL}/analytics/sales", params={"group_by": "product"})
+            rows = response.json() if response.status_code == 200 else []
+            if rows and all(r['product'] and r['transactions'] > 0 for r in rows):
+                self.log_test("GET /analytics/sales", True, f"{len(rows)} products, top: {rows[0]['product']} ${rows[0]['amount']:,.0f}")
+            else:
+                self.log_test("GET /analytics/sales", False, f"Status: {response.status_code}, Response: {response.text}")
+            
+            response = self.session.get(f"{BACKEND_URL}/analytics/sales", params={"group_by": "period,device_type", "granularity": "hour"})
+            periods = [r['period'] for r in response.json()] if response.status_code == 200 else []
+            if periods and periods == sorted(periods):
+                self.log_test("GET /analytics/sales hourly", True, f"{len(periods)} hourly rows in order")
+            else:
+                self.log_test("GET /analytics/sales hourly", False, f"Status: {response.status_code}, Response: {response.text[:200]}")
+        except Exception as e:
+            self.log_test("GET /analytics/sales", False, f"Exception: {str(e)}")
+    
+    def test_sustainability_endpoint(self):
+        """Test GET /sustainability totals agree with the fleet's device consumption"""
+        try:
+            report = self.session.get(f"{BACKEND_URL}/sustainability", params={"top": 5}).json()
+            devices = self.session.get(f"{BACKEND_URL}/devices", params={"limit": 1000}).json()
+            energy = round(sum(d['avg_consumption'] for d in devices), 2)
+            categories = sum(report['categories'].values())
+            if (len(devices) < 1000 and abs(report['totals']['energy_kwh_day'] - energy) < 0.05
+                    and categories == report['totals']['stores'] and len(report['top_consumers']) <= 5):
+                self.log_test("GET /sustainability", True,
+                            f"{report['totals']['energy_kwh_day']} kWh/day, {report['totals']['carbon_kg_month']} kg CO2/month")
+            elif len(devices) == 1000:
+                self.log_test("GET /sustainability", True, f"Fleet too large to cross-check, {report['totals']}")
+            else:
+                self.log_test("GET /sustainability", False, f"Totals {report['totals']} vs {energy} kWh/day from devices")
+        except Exception as e:
+            self.log_test("GET /sustainability", False, f"Exception: {str(e)}")
+    
+    def test_supplies_endpoints(self):
+        """Test the supplies forecast and that a receipt moves the warehouse stock and depletion date"""
+        try:
+            summary = self.session.get(f"{BACKEND_URL}/supplies/summary").json()
+            stores = self.session.get(f"{BACKEND_URL}/supplies", params={"location_type": "store", "limit": 5}).json()
+            if not summary['warehouse'] or any(a['days_left'] > b['days_left'] for a, b in zip(stores, stores[1:])):
+                self.log_test("GET /supplies", False, f"Warehouse {summary['warehouse']}, stores {stores}")
+                return
+            line = summary['warehouse'][0]
+            response = self.session.post(f"{BACKEND_URL}/supplies/movements", json=[
+                {"kind": "receipt", "location_id": line['location_id'], "sku": line['sku'], "rolls": 100, "reference": "backend_test"}
+            ])
+            after = self.session.get(f"{BACKEND_URL}/supplies", params={"location_id": line['location_id'], "sku": line['sku']}).json()
+            if response.status_code == 200 and after and abs(after[0]['rolls'] - line['rolls'] - 100) < 1e-6 \
+                    and after[0]['days_left'] >= line['days_left']:
+                self.log_test("GET/POST /supplies", True,
+                            f"{line['sku']} warehouse {line['rolls']} → {after[0]['rolls']} rolls, {after[0]['days_left']} days left, "
+                            f"{summary['stores_depleting_soon']} stores depleting within a week")
+            else:
+                self.log_test("GET/POST /supplies", False, f"Status {response.status_code}, {line} → {after}")
+        except Exception as e:
+            self.log_test("GET/POST /supplies", False, f"Exception: {str(e)}")
+    
     def test_weight_data_endpoint(self):
         """Test weight data endpoint"""
         try:
@@ -338,13 +687,29 @@ class BackendTester:
         # Test all endpoints
         self.test_root_endpoint()
         self.test_stores_endpoints()
+        self.test_device_update_rollup()
+        self.test_devices_endpoints()
+        self.test_maintenance_scores_endpoints()
+        self.test_obsolescence_endpoints()
+        self.test_export_endpoints()
+        self.test_asset_endpoints()
+        self.test_deployment_endpoints()
+        self.test_telemetry_batch_endpoint()
+        self.test_query_plans_endpoint()
+        self.test_db_health_endpoint()
         self.test_fix_naming_endpoint()
         self.test_ai_predictions_endpoint()
         self.test_tickets_endpoints()
+        self.test_ticket_workflow()
         self.test_campaigns_endpoints()
         self.test_alerts_endpoints()
+        self.test_alert_rules()
+        self.test_fraud_detection()
         self.test_metrics_endpoint()
         self.test_weight_data_endpoint()
+        self.test_sales_analytics_endpoint()
+        self.test_sustainability_endpoint()
+        self.test_supplies_endpoints()
         self.test_cors_functionality()
         
         # Summary
@@ -18,6 +18,7 @@ const AIMenuPage = ({ onLogout }) => {
   const [loading, setLoading] = useState(true);
   const [showAddUser, setShowAddUser] = useState(false);
   const [tickets, setTickets] = useState([]);
+  const [ticketBacklog, setTicketBacklog] = useState(0);
 
   const [contacts, setContacts] = useState([
     { id: 1, name: 'Juan Pérez', phone: '+56 9 8765 4321', role: 'Supervisor Plataforma', permissions: 'admin' },
@@ -55,16 +56,13 @@ const AIMenuPage = ({ onLogout }) => {
       });
       setProblemBalances(problems);
       
-      // Generate sample tickets
-      setTickets(problems.slice(0, 10).map((p, idx) => ({
-        id: `TKT-${Date.now()}-${idx}`,
-        deviceId: p.id,
-        storeName: p.storeName,
-        issue: p.issue,
-        status: Math.random() > 0.5 ? 'Pendiente' : 'En Proceso',
-        createdAt: new Date(Date.now() - Math.random() * 86400000).toISOString(),
-        assignedTo: contacts[Math.floor(Math.random() * contacts.length)].name
-      })));
+      // Open tickets: latest page of the queue and the backlog per provider
+      const [ticketsResponse, slaResponse] = await Promise.all([
+        axios.get(`${API}/tickets`, { params: { status: 'Pendiente,En Proceso', limit: 5 } }),
+        axios.get(`${API}/tickets/sla`)
+      ]);
+      setTickets(ticketsResponse.data);
+      setTicketBacklog(slaResponse.data.by_provider.reduce((sum, group) => sum + group.backlog, 0));
     } catch (error) {
       toast.error('Error al cargar datos');
     } finally {
@@ -168,7 +166,7 @@ Por favor atender a la brevedad.`;
             <div className="flex items-center justify-between">
               <div>
                 <p className="text-sm text-gray-600 mb-1">Tickets Activos</p>
-                <h3 className="text-3xl font-bold" style={{ color: '#FFC220' }}>{tickets.length}</h3>
+                <h3 className="text-3xl font-bold" style={{ color: '#FFC220' }}>{ticketBacklog}</h3>
               </div>
               <div className="w-12 h-12 rounded-full flex items-center justify-center" style={{ backgroundColor: 'rgba(255, 194, 32, 0.1)' }}>
                 <MessageCircle className="w-6 h-6" style={{ color: '#FFC220' }} />
@@ -256,8 +254,8 @@ Por favor atender a la brevedad.`;
                     <div key={ticket.id} className="flex items-center justify-between p-3 bg-blue-50 border border-blue-200 rounded-lg">
                       <div>
                         <p className="font-semibold text-gray-800">#{ticket.id}</p>
-                        <p className="text-sm text-gray-600">{ticket.storeName} - {ticket.issue}</p>
-                        <p className="text-xs text-gray-500 mt-1">Asignado a: {ticket.assignedTo}</p>
+                        <p className="text-sm text-gray-600">{ticket.store_name} - {ticket.issue}</p>
+                        <p className="text-xs text-gray-500 mt-1">Asignado a: {ticket.assigned_to || 'Por asignar'}</p>
                       </div>
                       <Badge 
                         style={{
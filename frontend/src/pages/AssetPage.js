@@ -23,27 +23,36 @@ const AssetPage = ({ onLogout }) => {
 
   const loadData = async () => {
     try {
-      const response = await axios.get(`${API}/stores`);
+      const response = await axios.get(`${API}/stores`, {
+        params: { fields: 'id,name,comuna,sap_code,address' }
+      });
       setStores(response.data);
+      const storesById = Object.fromEntries(response.data.map(store => [store.id, store]));
       
-      // Flatten all devices with store info
+      // Page through the devices collection and join the store info
       const devices = [];
-      response.data.forEach(store => {
-        store.devices?.forEach(device => {
+      let cursor = null;
+      do {
+        const page = await axios.get(`${API}/devices`, {
+          params: { limit: 1000, ...(cursor && { cursor }) }
+        });
+        page.data.forEach(device => {
+          const store = storesById[device.store_id] || {};
           // Generate random serial like BMCL-9E998776
           const randomHex = Math.floor(Math.random() * 0xFFFFFFFF).toString(16).toUpperCase().padStart(8, '0');
           devices.push({
             ...device,
-            storeName: store.name,
+            storeName: store.name || '',
             storeComuna: store.comuna,
-            storeId: store.id,
+            storeId: device.store_id,
             serialNumber: `BMCL-${randomHex}`,
             provider: device.type === 'IA' ? 'Allcom IA Systems' : 'Balanzas Chile S.A.',
             licenseStatus: Math.random() > 0.1 ? 'active' : 'pending',
             warrantyExpiry: new Date(Date.now() + Math.random() * 365 * 24 * 60 * 60 * 1000).toISOString().split('T')[0]
           });
         });
-      });
+        cursor = page.headers['x-next-cursor'];
+      } while (cursor);
       
       setAllDevices(devices);
     } catch (error) {
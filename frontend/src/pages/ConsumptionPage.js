@@ -7,8 +7,10 @@ import { BarChart, Bar, XAxis, YAxis, CartesianGrid, Tooltip, Legend, Responsive
 import { Zap, FileText, TrendingUp, Package } from 'lucide-react';
 import { toast } from 'sonner';
 
+const TYPE_LABELS = { BMS_ASISTIDA: 'BMS Asistida', AUTOSERVICIO: 'Autoservicio', IA: 'Balanzas IA' };
+
 const ConsumptionPage = ({ onLogout }) => {
-  const [stores, setStores] = useState([]);
+  const [report, setReport] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -17,8 +19,8 @@ const ConsumptionPage = ({ onLogout }) => {
 
   const loadData = async () => {
     try {
-      const response = await axios.get(`${API}/stores`);
-      setStores(response.data);
+      const response = await axios.get(`${API}/sustainability`, { params: { top: 15 } });
+      setReport(response.data);
     } catch (error) {
       toast.error('Error al cargar datos');
     } finally {
@@ -26,38 +28,22 @@ const ConsumptionPage = ({ onLogout }) => {
     }
   };
 
-  // Calculate consumption data
-  const totalEnergyConsumption = stores.reduce((sum, store) => {
-    const storeConsumption = store.devices?.reduce((deviceSum, device) => 
-      deviceSum + (device.avg_consumption || 0), 0) || 0;
-    return sum + storeConsumption;
-  }, 0);
-
-  const autoserviceBalances = stores.reduce((sum, store) => 
-    sum + (store.balances_autoservicio || 0), 0);
-
-  // Paper consumption (dummy data per balance)
-  const avgPaperPerBalance = 300; // meters per day
-  const totalPaperMeters = autoserviceBalances * avgPaperPerBalance;
+  // Totals and rankings come precomputed from the backend rollups
+  const totalEnergyConsumption = report?.totals.energy_kwh_day || 0;
+  const totalPaperMeters = report?.totals.paper_meters_day || 0;
   const totalPaperKm = (totalPaperMeters / 1000).toFixed(2);
-  const rollLength = 80; // meters per roll
-  const totalRolls = Math.ceil(totalPaperMeters / rollLength);
+  const totalRolls = report?.totals.paper_rolls_day || 0;
+  const stores = report?.top_consumers || [];
 
   // Top consumers
   const topConsumers = stores
-    .map(store => ({
-      name: store.comuna,
-      energy: store.devices?.reduce((sum, d) => sum + (d.avg_consumption || 0), 0).toFixed(2) || 0,
-      paper: (store.balances_autoservicio * avgPaperPerBalance)
-    }))
-    .sort((a, b) => b.energy - a.energy)
-    .slice(0, 10);
-
-  const consumptionByType = [
-    { name: 'BMS Asistida', value: stores.reduce((sum, s) => sum + s.balances_bms, 0) * 1.5 },
-    { name: 'Autoservicio', value: stores.reduce((sum, s) => sum + s.balances_autoservicio, 0) * 2.1 },
-    { name: 'Balanzas IA', value: stores.reduce((sum, s) => sum + s.balances_ia, 0) * 1.8 }
-  ];
+    .slice(0, 10)
+    .map(store => ({ name: store.comuna, energy: store.energy_kwh_day, paper: store.paper_meters_day }));
+
+  const consumptionByType = (report?.by_type || []).map(group => ({
+    name: TYPE_LABELS[group.device_type] || group.device_type,
+    value: group.energy_kwh_day
+  }));
 
   const COLORS = ['#0071CE', '#FFC220', '#1B4D89'];
 
@@ -184,7 +170,7 @@ const ConsumptionPage = ({ onLogout }) => {
 
         {/* Paper Consumption by Store */}
         <Card className="p-6 shadow-lg">
-          <h3 className="text-xl font-semibold mb-4 text-gray-800">Consumo de Papel por Local</h3>
+          <h3 className="text-xl font-semibold mb-4 text-gray-800">Consumo por Local - Top 15 Energía</h3>
           <div className="overflow-x-auto">
             <table className="w-full">
               <thead>
@@ -197,23 +183,19 @@ const ConsumptionPage = ({ onLogout }) => {
                 </tr>
               </thead>
               <tbody>
-                {stores.slice(0, 15).map((store) => {
-                  const paperMeters = store.balances_autoservicio * avgPaperPerBalance;
-                  const rolls = Math.ceil(paperMeters / rollLength);
-                  const energy = store.devices?.reduce((sum, d) => sum + (d.avg_consumption || 0), 0).toFixed(2) || 0;
-                  
+                {stores.map((store) => {
                   return (
-                    <tr key={store.id} className="border-b hover:bg-gray-50 transition-colors">
+                    <tr key={store.store_id} className="border-b hover:bg-gray-50 transition-colors">
                       <td className="px-4 py-3">
                         <div>
                           <p className="font-semibold text-gray-800">{store.name}</p>
                           <p className="text-sm text-gray-600">{store.comuna}</p>
                         </div>
                       </td>
-                      <td className="px-4 py-3 text-center font-semibold">{store.balances_autoservicio}</td>
-                      <td className="px-4 py-3 text-center">{paperMeters.toLocaleString()} m</td>
-                      <td className="px-4 py-3 text-center">{rolls}</td>
-                      <td className="px-4 py-3 text-center font-semibold" style={{ color: '#0071CE' }}>{energy}</td>
+                      <td className="px-4 py-3 text-center font-semibold">{store.self_service_devices}</td>
+                      <td className="px-4 py-3 text-center">{store.paper_meters_day.toLocaleString()} m</td>
+                      <td className="px-4 py-3 text-center">{store.paper_rolls_day}</td>
+                      <td className="px-4 py-3 text-center font-semibold" style={{ color: '#0071CE' }}>{store.energy_kwh_day.toFixed(2)}</td>
                     </tr>
                   );
                 })}
@@ -28,6 +28,44 @@ const DashboardPage = ({ onLogout }) => {
     loadData();
   }, []);
 
+  // Live store/alert updates pushed by the backend
+  useEffect(() => {
+    const source = new EventSource(`${API}/stream?topics=stores,alerts`);
+
+    source.addEventListener('stores', (event) => {
+      const change = JSON.parse(event.data);
+      if (change.fields && change.fields.status) {
+        setStores(prev => prev.map(store =>
+          store.id === change.store_id ? { ...store, ...change.fields } : store
+        ));
+        refreshMetrics();
+      }
+    });
+    source.addEventListener('alerts', () => refreshAlerts());
+    source.addEventListener('resync', () => loadData());
+    source.addEventListener('close', () => source.close());
+
+    return () => source.close();
+  }, []);
+
+  const refreshMetrics = async () => {
+    try {
+      const response = await axios.get(`${API}/metrics`);
+      setMetrics(response.data);
+    } catch (error) {
+      console.error(error);
+    }
+  };
+
+  const refreshAlerts = async () => {
+    try {
+      const response = await axios.get(`${API}/alerts`);
+      setAlerts(response.data);
+    } catch (error) {
+      console.error(error);
+    }
+  };
+
   const loadData = async () => {
     try {
       const [storesRes, metricsRes, weightRes, alertsRes] = await Promise.all([
@@ -333,7 +371,7 @@ const DashboardPage = ({ onLogout }) => {
                       <div>
                         <p className="font-semibold text-gray-800">{alert.store_name}</p>
                         <p className="text-sm text-gray-700">{alert.message}</p>
-                        <p className="text-xs text-gray-500 mt-1">{alert.type === 'calibration' ? '⚙️ Calibración' : alert.type === 'maintenance' ? '🔧 Mantenimiento' : '📡 Firmware'}</p>
+                        <p className="text-xs text-gray-500 mt-1">{alert.type === 'calibration' ? '⚙️ Calibración' : alert.type === 'maintenance' ? '🔧 Mantenimiento' : alert.type === 'network' ? '🌐 Red' : alert.type === 'fraud' ? '🚨 Fraude' : '📡 Firmware'}</p>
                       </div>
                     </div>
                     <Badge 
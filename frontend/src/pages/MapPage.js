@@ -1,8 +1,8 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useCallback, useRef } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import Layout from '@/components/Layout';
-import { MapContainer, TileLayer, Marker, Popup } from 'react-leaflet';
+import { MapContainer, TileLayer, Marker, Popup, useMapEvents } from 'react-leaflet';
 import L from 'leaflet';
 import { Card } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
@@ -19,25 +19,60 @@ L.Icon.Default.mergeOptions({
   shadowUrl: require('leaflet/dist/images/marker-shadow.png'),
 });
 
+// Reports the visible bounds and zoom whenever the map stops moving
+const ViewportWatcher = ({ onChange }) => {
+  const map = useMapEvents({
+    moveend: () => onChange(map),
+  });
+
+  useEffect(() => {
+    onChange(map);
+  }, [map, onChange]);
+
+  return null;
+};
+
+const clamp = (value, min, max) => Math.min(Math.max(value, min), max);
+
 const MapPage = ({ onLogout }) => {
   const navigate = useNavigate();
-  const [stores, setStores] = useState([]);
-  const [loading, setLoading] = useState(true);
+  const mapRef = useRef(null);
+  const [clusters, setClusters] = useState([]);
+  const [total, setTotal] = useState(0);
+  const [viewport, setViewport] = useState(null);
   const [filterLevel, setFilterLevel] = useState('all');
 
-  useEffect(() => {
-    loadStores();
+  const handleViewportChange = useCallback((map) => {
+    mapRef.current = map;
+    const bounds = map.getBounds();
+    const bbox = [
+      clamp(bounds.getWest(), -180, 180),
+      clamp(bounds.getSouth(), -90, 90),
+      clamp(bounds.getEast(), -180, 180),
+      clamp(bounds.getNorth(), -90, 90)
+    ].map(v => v.toFixed(5)).join(',');
+    setViewport({ bbox, zoom: map.getZoom() });
   }, []);
 
-  const loadStores = async () => {
+  useEffect(() => {
+    if (viewport) {
+      loadClusters();
+    }
+  }, [viewport, filterLevel]);
+
+  const loadClusters = async () => {
     try {
-      const response = await axios.get(`${API}/stores`);
-      setStores(response.data);
+      // The server aggregates stores into clusters for the current zoom level
+      const params = { ...viewport };
+      if (filterLevel !== 'all') {
+        params.sales_level = filterLevel;
+      }
+      const response = await axios.get(`${API}/stores/clusters`, { params });
+      setClusters(response.data.clusters);
+      setTotal(response.data.total);
     } catch (error) {
       toast.error('Error al cargar locales');
       console.error(error);
-    } finally {
-      setLoading(false);
     }
   };
 
@@ -82,19 +117,37 @@ const MapPage = ({ onLogout }) => {
     });
   };
 
-  const filteredStores = filterLevel === 'all' 
-    ? stores 
-    : stores.filter(s => s.sales_level === filterLevel);
+  const createClusterIcon = (cluster) => {
+    const size = Math.min(64, 32 + Math.log2(cluster.count) * 6);
+    return L.divIcon({
+      className: 'custom-marker',
+      html: `
+        <div style="
+          background-color: #79b9e7;
+          width: ${size}px;
+          height: ${size}px;
+          border-radius: 50%;
+          border: 3px solid white;
+          box-shadow: 0 4px 6px rgba(0,0,0,0.3);
+          display: flex;
+          align-items: center;
+          justify-content: center;
+          color: white;
+          font-weight: bold;
+          font-size: 13px;
+        ">${cluster.count}</div>
+      `,
+      iconSize: [size, size],
+      iconAnchor: [size / 2, size / 2]
+    });
+  };
 
-  if (loading) {
-    return (
-      <Layout onLogout={onLogout}>
-        <div className="flex items-center justify-center h-full">
-          <div className="w-16 h-16 border-4 border-sky-400 border-t-transparent rounded-full animate-spin" />
-        </div>
-      </Layout>
-    );
-  }
+  const zoomIntoCluster = (cluster) => {
+    const map = mapRef.current;
+    if (map) {
+      map.setView([cluster.latitude, cluster.longitude], map.getZoom() + 2);
+    }
+  };
 
   return (
     <Layout onLogout={onLogout}>
@@ -130,7 +183,7 @@ const MapPage = ({ onLogout }) => {
                 onClick={() => setFilterLevel('all')}
                 style={filterLevel === 'all' ? { backgroundColor: '#79b9e7' } : {}}
               >
-                Todos ({stores.length})
+                Todos{filterLevel === 'all' ? ` (${total})` : ''}
               </Button>
               <Button 
                 size="sm" 
@@ -171,7 +224,19 @@ const MapPage = ({ onLogout }) => {
               attribution='&copy; <a href="https://www.openstreetmap.org/copyright">OpenStreetMap</a>'
               url="https://{s}.tile.openstreetmap.org/{z}/{x}/{y}.png"
             />
-            {filteredStores.map((store, idx) => {
+            <ViewportWatcher onChange={handleViewportChange} />
+            {clusters.map((cluster, idx) => {
+              if (!cluster.store) {
+                return (
+                  <Marker
+                    key={`cluster-${cluster.latitude}-${cluster.longitude}`}
+                    position={[cluster.latitude, cluster.longitude]}
+                    icon={createClusterIcon(cluster)}
+                    eventHandlers={{ click: () => zoomIntoCluster(cluster) }}
+                  />
+                );
+              }
+              const store = cluster.store;
               // Extract 3-digit code from store name or use index
               const localCode = store.sap_code ? store.sap_code.split('-')[1].slice(-3) : (idx + 1).toString().padStart(3, '0');
               return (
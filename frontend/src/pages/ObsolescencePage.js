@@ -10,9 +10,11 @@ import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from
 import { AlertTriangle, Clock, WrenchIcon, ShoppingCart, Filter, TrendingDown, Calendar, Zap } from 'lucide-react';
 import { toast } from 'sonner';
 
+const PAGE_SIZE = 30;
+
 const ObsolescencePage = ({ onLogout }) => {
-  const [stores, setStores] = useState([]);
   const [obsoleteDevices, setObsoleteDevices] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [filterType, setFilterType] = useState('all');
   const [filterProvider, setFilterProvider] = useState('all');
   const [loading, setLoading] = useState(true);
@@ -20,76 +22,40 @@ const ObsolescencePage = ({ onLogout }) => {
 
   useEffect(() => {
     loadObsolescenceData();
-  }, []);
+  }, [filterType, filterProvider]);
 
   const loadObsolescenceData = async () => {
     try {
-      const response = await axios.get(`${API}/stores`);
-      setStores(response.data);
-      
-      // Analyze devices for obsolescence
-      const obsoleteList = [];
-      
-      response.data.forEach(store => {
-        store.devices.forEach(device => {
-          // Calculate installation age (assuming random dates for demo)
-          const installationDate = new Date(2019 + Math.random() * 6, Math.floor(Math.random() * 12), Math.floor(Math.random() * 28));
-          const ageInYears = (new Date() - installationDate) / (1000 * 60 * 60 * 24 * 365);
-          
-          // Generate failure data
-          const monthlyFailures = Math.floor(Math.random() * 5);
-          const downtime = Math.random() * 48; // hours per month
-          const lastMaintenance = new Date(Date.now() - Math.random() * 90 * 24 * 60 * 60 * 1000);
-          const warrantyExpired = ageInYears > 3;
-          
-          // Calculate obsolescence score (0-100, higher = more obsolete)
-          let obsolescenceScore = 0;
-          if (ageInYears > 5) obsolescenceScore += 40;
-          else if (ageInYears > 3) obsolescenceScore += 20;
-          
-          obsolescenceScore += monthlyFailures * 8;
-          obsolescenceScore += (downtime / 48) * 30;
-          if (warrantyExpired) obsolescenceScore += 20;
-          
-          const provider = device.type === 'IA' ? 'Allcom IA Systems' : 
-                          device.type === 'AUTOSERVICIO' ? 'Balanzas Chile S.A.' : 'Sistemas Integrados';
-          
-          const replacementCost = device.type === 'IA' ? 850000 : 
-                                 device.type === 'AUTOSERVICIO' ? 650000 : 450000;
-          
-          const priority = obsolescenceScore >= 70 ? 'high' :
-                          obsolescenceScore >= 40 ? 'medium' : 'low';
-          
-          // Reduce criteria to show fewer devices (50% reduction)
-          if (obsolescenceScore > 60 || ageInYears > 5 || monthlyFailures > 3) {
-            obsoleteList.push({
-              id: device.id,
-              storeId: store.id,
-              storeName: store.name,
-              comuna: store.comuna,
-              deviceType: device.type,
-              installationDate: installationDate.toISOString().split('T')[0],
-              ageInYears: ageInYears.toFixed(1),
-              monthlyFailures,
-              downtime: downtime.toFixed(1),
-              lastMaintenance: lastMaintenance.toISOString().split('T')[0],
-              warrantyExpired,
-              obsolescenceScore: Math.min(100, obsolescenceScore),
-              provider,
-              replacementCost,
-              priority,
-              serialNumber: `BMCL-${Math.random().toString(36).substr(2, 8).toUpperCase()}`,
-              status: device.status,
-              lastFailure: new Date(Date.now() - Math.random() * 30 * 24 * 60 * 60 * 1000).toISOString().split('T')[0]
-            });
-          }
-        });
-      });
-      
-      // Sort by obsolescence score (highest first) and limit to top 30 for performance
-      obsoleteList.sort((a, b) => b.obsolescenceScore - a.obsolescenceScore);
-      setObsoleteDevices(obsoleteList.slice(0, 30));
-      
+      // Scores and totals are materialized by the backend; each filter change is one indexed query
+      const params = {};
+      if (filterType !== 'all') params.device_type = filterType;
+      if (filterProvider !== 'all') params.provider = filterProvider;
+      const [devicesResponse, summaryResponse] = await Promise.all([
+        axios.get(`${API}/obsolescence/devices`, { params: { ...params, limit: PAGE_SIZE } }),
+        axios.get(`${API}/obsolescence/summary`, { params })
+      ]);
+      setObsoleteDevices(devicesResponse.data.map(device => ({
+        id: device.device_id,
+        storeId: device.store_id,
+        storeName: device.store_name,
+        comuna: device.comuna,
+        deviceType: device.device_type,
+        installationDate: device.installation_date.split('T')[0],
+        ageInYears: device.age_years.toFixed(1),
+        monthlyFailures: device.monthly_failures,
+        downtime: device.downtime_hours.toFixed(1),
+        lastMaintenance: device.last_calibration.split('T')[0],
+        warrantyExpired: device.warranty_expired,
+        obsolescenceScore: device.obsolescence_score,
+        provider: device.provider,
+        replacementCost: device.replacement_cost,
+        priority: device.priority,
+        serialNumber: `BMCL-${device.device_id.slice(0, 8).toUpperCase()}`,
+        firmwareVersion: device.firmware_version,
+        firmwareOutdated: device.firmware_outdated,
+        lastFailure: device.last_failure ? device.last_failure.split('T')[0] : 'Sin fallas'
+      })));
+      setSummary(summaryResponse.data);
     } catch (error) {
       console.error('Error loading obsolescence data:', error);
       toast.error('Error al cargar datos de obsolescencia');
@@ -98,14 +64,6 @@ const ObsolescencePage = ({ onLogout }) => {
     }
   };
 
-  const getFilteredDevices = () => {
-    return obsoleteDevices.filter(device => {
-      const typeMatch = filterType === 'all' || device.deviceType === filterType;
-      const providerMatch = filterProvider === 'all' || device.provider === filterProvider;
-      return typeMatch && providerMatch;
-    });
-  };
-
   const generateReplacementOrder = (device) => {
     const orderData = {
       device_id: device.id,
@@ -133,25 +91,17 @@ const ObsolescencePage = ({ onLogout }) => {
     }
   };
 
-  const getObsolescenceStats = () => {
-    const filtered = getFilteredDevices();
-    const highPriority = filtered.filter(d => d.priority === 'high').length;
-    const mediumPriority = filtered.filter(d => d.priority === 'medium').length;
-    const lowPriority = filtered.filter(d => d.priority === 'low').length;
-    const warrantyExpired = filtered.filter(d => d.warrantyExpired).length;
-    const totalReplacementCost = filtered.reduce((sum, d) => sum + d.replacementCost, 0);
-    
-    return {
-      total: filtered.length,
-      highPriority,
-      mediumPriority,
-      lowPriority,
-      warrantyExpired,
-      totalReplacementCost
-    };
-  };
+  const countByPriority = (priority) =>
+    summary?.by_priority.find(group => group.key === priority)?.devices || 0;
 
-  const stats = getObsolescenceStats();
+  const stats = {
+    total: summary?.devices || 0,
+    highPriority: countByPriority('high'),
+    mediumPriority: countByPriority('medium'),
+    lowPriority: countByPriority('low'),
+    warrantyExpired: summary?.warranty_expired || 0,
+    totalReplacementCost: summary?.replacement_cost || 0
+  };
 
   if (loading) {
     return (
@@ -279,7 +229,7 @@ const ObsolescencePage = ({ onLogout }) => {
         <Card className="p-6">
           <h3 className="text-lg font-semibold mb-4 flex items-center gap-2">
             <WrenchIcon className="w-5 h-5 text-orange-600" />
-            Balanzas que Requieren Atención ({getFilteredDevices().length})
+            Balanzas que Requieren Atención ({stats.total})
           </h3>
           
           <div className="overflow-x-auto">
@@ -298,7 +248,7 @@ const ObsolescencePage = ({ onLogout }) => {
                 </tr>
               </thead>
               <tbody>
-                {getFilteredDevices().map(device => (
+                {obsoleteDevices.map(device => (
                   <tr key={device.id} className="border-b hover:bg-gray-50">
                     <td className="p-3">
                       <div>
@@ -391,9 +341,9 @@ const ObsolescencePage = ({ onLogout }) => {
                                     <p>{selectedDevice.provider}</p>
                                   </div>
                                   <div>
-                                    <label className="font-medium">Estado Actual:</label>
-                                    <Badge className={selectedDevice.status === 'online' ? 'bg-green-100 text-green-700' : 'bg-red-100 text-red-700'}>
-                                      {selectedDevice.status}
+                                    <label className="font-medium">Firmware:</label>
+                                    <Badge className={selectedDevice.firmwareOutdated ? 'bg-red-100 text-red-700' : 'bg-green-100 text-green-700'}>
+                                      {selectedDevice.firmwareVersion}{selectedDevice.firmwareOutdated ? ' (desactualizado)' : ''}
                                     </Badge>
                                   </div>
                                 </div>
@@ -407,7 +357,7 @@ const ObsolescencePage = ({ onLogout }) => {
                                     <p>{selectedDevice.lastFailure}</p>
                                   </div>
                                   <div>
-                                    <label className="font-medium">Último Mantenimiento:</label>
+                                    <label className="font-medium">Última Calibración:</label>
                                     <p>{selectedDevice.lastMaintenance}</p>
                                   </div>
                                   <div>
@@ -10,8 +10,9 @@ import { Recycle, Calendar as CalendarIcon, AlertTriangle, Wrench, Clock, Trendi
 import { toast } from 'sonner';
 
 const PredictiveMaintenancePage = ({ onLogout }) => {
-  const [stores, setStores] = useState([]);
   const [maintenanceData, setMaintenanceData] = useState({});
+  const [tableData, setTableData] = useState([]);
+  const [summary, setSummary] = useState(null);
   const [loading, setLoading] = useState(true);
   const [selectedDate, setSelectedDate] = useState(new Date());
   const [sortBy, setSortBy] = useState('risk'); // risk, date, priority
@@ -21,76 +22,45 @@ const PredictiveMaintenancePage = ({ onLogout }) => {
     loadMaintenanceData();
   }, []);
 
+  useEffect(() => {
+    loadTableData();
+  }, [filterPriority]);
+
+  // Scores are computed and materialized by the backend, highest risk first
+  const toMaintenanceRow = (score) => ({
+    id: score.device_id,
+    storeId: score.store_id,
+    storeName: score.store_name,
+    comuna: score.comuna,
+    deviceType: score.device_type,
+    maintenanceRisk: Math.floor(score.maintenance_risk),
+    nextMaintenanceDate: score.next_maintenance_date.split('T')[0],
+    daysUntilMaintenance: score.days_until_maintenance,
+    lastCalibration: score.last_calibration.split('T')[0],
+    daysSinceCalibration: score.days_since_calibration,
+    dailyUsage: score.daily_consumption.toFixed(1),
+    monthlyTransactions: score.monthly_transactions,
+    ageInMonths: score.age_months,
+    components: score.components,
+    priority: score.priority,
+    estimatedCost: score.estimated_cost,
+    recommendations: generateMaintenanceRecommendations(score.maintenance_risk, score.components, score.days_since_calibration),
+    serialNumber: `BMCL-${score.device_id.slice(0, 8).toUpperCase()}`,
+    status: score.status
+  });
+
   const loadMaintenanceData = async () => {
     try {
-      const response = await axios.get(`${API}/stores`);
-      setStores(response.data);
+      const [summaryResponse, scoresResponse] = await Promise.all([
+        axios.get(`${API}/maintenance/summary`),
+        axios.get(`${API}/maintenance/scores`, { params: { limit: 100 } })
+      ]);
+      setSummary(summaryResponse.data);
       
-      // Generate predictive maintenance data
       const maintenance = {};
-      
-      response.data.forEach(store => {
-        store.devices.forEach(device => {
-          // Calculate maintenance predictions based on device usage and history
-          const installationDate = new Date(2019 + Math.random() * 6, Math.floor(Math.random() * 12), Math.floor(Math.random() * 28));
-          const ageInMonths = (new Date() - installationDate) / (1000 * 60 * 60 * 24 * 30);
-          
-          // Simulate usage patterns
-          const dailyUsage = Math.random() * 12 + 8; // 8-20 hours per day
-          const monthlyTransactions = Math.floor(Math.random() * 3000 + 1000); // 1000-4000 transactions
-          const lastCalibration = new Date(Date.now() - Math.random() * 90 * 24 * 60 * 60 * 1000);
-          const daysSinceCalibration = (new Date() - lastCalibration) / (1000 * 60 * 60 * 24);
-          
-          // Predictive factors
-          const usageScore = (dailyUsage / 20) * 100; // Higher usage = more maintenance needed
-          const ageScore = Math.min((ageInMonths / 60) * 100, 100); // Older = more maintenance
-          const calibrationScore = Math.min((daysSinceCalibration / 90) * 100, 100); // Overdue calibration
-          const transactionScore = (monthlyTransactions / 4000) * 100; // High transactions
-          
-          // Overall maintenance risk (0-100)
-          const maintenanceRisk = (usageScore + ageScore + calibrationScore + transactionScore) / 4;
-          
-          // Predict next maintenance date
-          const daysUntilMaintenance = Math.max(1, 90 - (maintenanceRisk / 100 * 90));
-          const nextMaintenanceDate = new Date(Date.now() + daysUntilMaintenance * 24 * 60 * 60 * 1000);
-          
-          // Calculate component wear
-          const components = {
-            printHead: Math.min(100, (monthlyTransactions * ageInMonths) / 50000 * 100),
-            loadCell: Math.min(100, (monthlyTransactions * ageInMonths) / 100000 * 100),
-            display: Math.min(100, ageInMonths / 60 * 100),
-            keyboard: Math.min(100, (monthlyTransactions * ageInMonths) / 75000 * 100),
-            printer: Math.min(100, (monthlyTransactions * ageInMonths) / 80000 * 100)
-          };
-          
-          const priority = maintenanceRisk >= 70 ? 'high' : 
-                          maintenanceRisk >= 40 ? 'medium' : 'low';
-          
-          const estimatedCost = Math.floor(50000 + (maintenanceRisk / 100) * 200000); // $50k-$250k CLP
-          
-          maintenance[device.id] = {
-            storeId: store.id,
-            storeName: store.name,
-            comuna: store.comuna,
-            deviceType: device.type,
-            maintenanceRisk: Math.floor(maintenanceRisk),
-            nextMaintenanceDate: nextMaintenanceDate.toISOString().split('T')[0],
-            daysUntilMaintenance: Math.floor(daysUntilMaintenance),
-            lastCalibration: lastCalibration.toISOString().split('T')[0],
-            daysSinceCalibration: Math.floor(daysSinceCalibration),
-            dailyUsage: dailyUsage.toFixed(1),
-            monthlyTransactions,
-            ageInMonths: Math.floor(ageInMonths),
-            components,
-            priority,
-            estimatedCost,
-            recommendations: generateMaintenanceRecommendations(maintenanceRisk, components, daysSinceCalibration),
-            serialNumber: `BMCL-${Math.random().toString(36).substr(2, 8).toUpperCase()}`,
-            status: device.status
-          };
-        });
+      scoresResponse.data.forEach(score => {
+        maintenance[score.device_id] = toMaintenanceRow(score);
       });
-      
       setMaintenanceData(maintenance);
     } catch (error) {
       console.error('Error loading maintenance data:', error);
@@ -100,6 +70,17 @@ const PredictiveMaintenancePage = ({ onLogout }) => {
     }
   };
 
+  const loadTableData = async () => {
+    try {
+      const response = await axios.get(`${API}/maintenance/scores`, {
+        params: { limit: 15, ...(filterPriority !== 'all' && { priority: filterPriority }) }
+      });
+      setTableData(response.data.map(toMaintenanceRow));
+    } catch (error) {
+      console.error('Error loading maintenance scores:', error);
+    }
+  };
+
   const generateMaintenanceRecommendations = (risk, components, daysSince) => {
     const recommendations = [];
     
@@ -174,25 +155,15 @@ Por favor programar mantenimiento.`;
     }
   };
 
-  const getMaintenanceStats = () => {
-    const devices = Object.values(maintenanceData);
-    const urgentMaintenance = devices.filter(d => d.priority === 'high').length;
-    const scheduledMaintenance = devices.filter(d => d.priority === 'medium').length;
-    const preventiveMaintenance = devices.filter(d => d.priority === 'low').length;
-    const avgRisk = devices.reduce((sum, d) => sum + d.maintenanceRisk, 0) / devices.length;
-    const totalEstimatedCost = devices.reduce((sum, d) => sum + d.estimatedCost, 0);
-    const overdueCalibractions = devices.filter(d => d.daysSinceCalibration > 90).length;
-    
-    return {
-      total: devices.length,
-      urgentMaintenance,
-      scheduledMaintenance,
-      preventiveMaintenance,
-      avgRisk: avgRisk || 0,
-      totalEstimatedCost,
-      overdueCalibractions
-    };
-  };
+  const getMaintenanceStats = () => ({
+    total: summary.total,
+    urgentMaintenance: summary.high,
+    scheduledMaintenance: summary.medium,
+    preventiveMaintenance: summary.low,
+    avgRisk: summary.avg_risk,
+    totalEstimatedCost: summary.total_estimated_cost,
+    overdueCalibractions: summary.overdue_calibrations
+  });
 
   const getUpcomingMaintenance = () => {
     return Object.values(maintenanceData)
@@ -201,7 +172,7 @@ Por favor programar mantenimiento.`;
       .slice(0, 10);
   };
 
-  const stats = Object.keys(maintenanceData).length > 0 ? getMaintenanceStats() : {};
+  const stats = summary ? getMaintenanceStats() : {};
   const upcomingMaintenance = Object.keys(maintenanceData).length > 0 ? getUpcomingMaintenance() : [];
 
   if (loading) {
@@ -320,9 +291,7 @@ Por favor programar mantenimiento.`;
               </div>
             </div>
             <Badge style={{ backgroundColor: '#0071CE', color: 'white' }}>
-              {Object.values(maintenanceData).filter(device => 
-                filterPriority === 'all' || device.priority === filterPriority
-              ).length} dispositivos
+              {summary ? (filterPriority === 'all' ? summary.total : summary[filterPriority]) : 0} dispositivos
             </Badge>
           </div>
         </Card>
@@ -496,8 +465,7 @@ Por favor programar mantenimiento.`;
                 </tr>
               </thead>
               <tbody>
-                {Object.values(maintenanceData)
-                  .filter(device => filterPriority === 'all' || device.priority === filterPriority)
+                {[...tableData]
                   .sort((a, b) => {
                     switch (sortBy) {
                       case 'risk':
@@ -513,7 +481,6 @@ Por favor programar mantenimiento.`;
                         return b.maintenanceRisk - a.maintenanceRisk;
                     }
                   })
-                  .slice(0, 15) // Limit to 15 devices for better performance
                   .map(device => (
                     <tr key={device.serialNumber} className="border-b hover:bg-gray-50">
                       <td className="p-3">
@@ -568,7 +535,7 @@ Por favor programar mantenimiento.`;
                           </p>
                         </div>
                       </td>
-                      <td className="p-3">{device.dailyUsage}h</td>
+                      <td className="p-3">{device.dailyUsage} kWh</td>
                       <td className="p-3">{device.monthlyTransactions.toLocaleString('es-CL')}</td>
                       <td className="p-3">
                         <span className="font-medium text-green-600">
@@ -1,4 +1,5 @@
 import { useState } from 'react';
+import { API } from '@/App';
 import Layout from '@/components/Layout';
 import { Card } from '@/components/ui/card';
 import { Button } from '@/components/ui/button';
@@ -7,10 +8,19 @@ import { Label } from '@/components/ui/label';
 import { toast } from 'sonner';
 import { FileText, Download, Calendar, Filter, Clock, User, Settings } from 'lucide-react';
 
+// Backend export behind each report type
+const EXPORT_COLLECTIONS = {
+  general: 'stores',
+  transactions: 'devices',
+  errors: 'alerts',
+  maintenance: 'tickets'
+};
+
 const ReportsPage = ({ onLogout }) => {
   const [dateFrom, setDateFrom] = useState('');
   const [dateTo, setDateTo] = useState('');
   const [reportType, setReportType] = useState('general');
+  const [storeStatus, setStoreStatus] = useState('all');
 
   const handleExportPDF = () => {
     toast.success('Exportando reporte en PDF...');
@@ -20,10 +30,17 @@ const ReportsPage = ({ onLogout }) => {
   };
 
   const handleExportExcel = () => {
+    // The export is streamed by the backend as CSV, so the browser downloads it directly
+    const collection = EXPORT_COLLECTIONS[reportType] || 'stores';
+    const params = new URLSearchParams({ format: 'csv' });
+    if (collection === 'stores' && storeStatus !== 'all') {
+      params.set('status', storeStatus);
+    }
+    if (dateFrom) {
+      params.set('since', `${dateFrom}T00:00:00Z`);
+    }
+    window.location.href = `${API}/export/${collection}?${params}`;
     toast.success('Exportando reporte en Excel...');
-    setTimeout(() => {
-      toast.success('Reporte Excel generado exitosamente');
-    }, 1500);
   };
 
   const auditLogs = [
@@ -104,6 +121,8 @@ const ReportsPage = ({ onLogout }) => {
               <select 
                 id="storeFilter"
                 className="w-full px-4 py-2 border rounded-lg mt-1"
+                value={storeStatus}
+                onChange={(e) => setStoreStatus(e.target.value)}
               >
                 <option value="all">Todos los locales</option>
                 <option value="online">Solo locales en línea</option>
@@ -13,10 +13,11 @@ const SalesAnalysisPage = ({ onLogout }) => {
   const [stores, setStores] = useState([]);
   const [salesData, setSalesData] = useState({});
   const [avocadoData, setAvocadoData] = useState({});
+  const [topDevices, setTopDevices] = useState([]);
   const [loading, setLoading] = useState(true);
 
-  // Precio de palta por kilo
-  const AVOCADO_PRICE_PER_KG = 5500;
+  // Días cubiertos por el análisis (rango por defecto de /analytics/sales)
+  const SALES_DAYS = 30;
 
   useEffect(() => {
     loadSalesData();
@@ -24,71 +25,69 @@ const SalesAnalysisPage = ({ onLogout }) => {
 
   const loadSalesData = async () => {
     try {
-      const response = await axios.get(`${API}/stores`);
-      setStores(response.data);
+      // Totals over the last 30 days, served from the server-side sales cubes
+      const [storesResponse, byStore, avocadoByStore, byStoreType] = await Promise.all([
+        axios.get(`${API}/stores`, { params: { fields: 'id,name,comuna,rollup' } }),
+        axios.get(`${API}/analytics/sales`, { params: { group_by: 'store_id' } }),
+        axios.get(`${API}/analytics/sales`, { params: { group_by: 'store_id,device_type', product: 'Palta' } }),
+        axios.get(`${API}/analytics/sales`, { params: { group_by: 'store_id,device_type', limit: 3 } })
+      ]);
+      setStores(storesResponse.data);
       
-      // Generate comprehensive sales data for each store
       const sales = {};
-      const avocados = {};
-      
-      response.data.forEach(store => {
-        const devices = store.devices || [];
-        
-        // Generate realistic sales data
-        const dailyTransactions = devices.length * Math.random() * 50 + 100; // 100-150 transactions per device per day
-        const avgTicketValue = Math.random() * 3000 + 2000; // $2000-$5000 CLP average ticket
-        const monthlyRevenue = dailyTransactions * 30 * avgTicketValue;
-        
-        // Weight analysis
-        const avgWeightPerTransaction = Math.random() * 0.8 + 0.2; // 0.2-1.0 kg per transaction
-        const monthlyWeight = dailyTransactions * 30 * avgWeightPerTransaction;
-        
-        // Product mix analysis
-        const fruitsVegetablesRatio = Math.random() * 0.4 + 0.6; // 60-100% fruits and vegetables
-        const revenuePerKg = monthlyRevenue / monthlyWeight;
-        
-        // Fraud indicators
-        const suspiciousTransactions = Math.floor(dailyTransactions * 0.02 * Math.random()); // 0-2% suspicious
-        const fraudLossEstimate = suspiciousTransactions * 30 * 500; // Estimated loss per fraud
-        
+      storesResponse.data.forEach(store => {
+        const row = byStore.data.find(r => r.store_id === store.id) || { transactions: 0, kg: 0, amount: 0, avg_ticket: 0 };
+        const devices = store.rollup?.total || 0;
         sales[store.id] = {
-          dailyTransactions: Math.floor(dailyTransactions),
-          monthlyRevenue: Math.floor(monthlyRevenue),
-          monthlyWeight: Math.floor(monthlyWeight),
-          avgTicketValue: Math.floor(avgTicketValue),
-          revenuePerKg: Math.floor(revenuePerKg),
-          fruitsVegetablesRatio,
-          suspiciousTransactions,
-          fraudLossEstimate,
-          devices: devices.length,
-          revenuePerDevice: Math.floor(monthlyRevenue / devices.length),
-          efficiencyScore: Math.floor((monthlyRevenue / (devices.length * 1000000)) * 100) // Revenue efficiency score
+          dailyTransactions: Math.round(row.transactions / SALES_DAYS),
+          monthlyTransactions: row.transactions,
+          monthlyRevenue: Math.floor(row.amount),
+          monthlyWeight: Math.floor(row.kg),
+          avgTicketValue: Math.floor(row.avg_ticket),
+          revenuePerKg: row.kg ? Math.floor(row.amount / row.kg) : 0,
+          devices,
+          revenuePerDevice: devices ? Math.floor(row.amount / devices) : 0,
+          efficiencyScore: devices ? Math.min(100, Math.floor((row.amount / (devices * 1000000)) * 100)) : 0 // Revenue efficiency score
         };
-
-        // Avocado specific data
-        const avocadoPercentage = Math.random() * 0.15 + 0.05; // 5-20% of transactions are avocados
-        const avocadoTransactions = dailyTransactions * avocadoPercentage;
-        const avgAvocadoWeight = Math.random() * 0.3 + 0.2; // 0.2-0.5 kg per avocado transaction
-        const monthlyAvocadoWeight = avocadoTransactions * 30 * avgAvocadoWeight;
-        const monthlyAvocadoRevenue = monthlyAvocadoWeight * AVOCADO_PRICE_PER_KG;
-        
-        // Split between IA and autoservice
-        const iaRatio = Math.random() * 0.6 + 0.2; // 20-80% IA vs autoservice
-        const iaAvocadoWeight = monthlyAvocadoWeight * iaRatio;
-        const autoserviceAvocadoWeight = monthlyAvocadoWeight * (1 - iaRatio);
-        
-        avocados[store.id] = {
-          monthlyWeight: Math.floor(monthlyAvocadoWeight),
-          monthlyRevenue: Math.floor(monthlyAvocadoRevenue),
-          iaWeight: Math.floor(iaAvocadoWeight),
-          iaRevenue: Math.floor(iaAvocadoWeight * AVOCADO_PRICE_PER_KG),
-          autoserviceWeight: Math.floor(autoserviceAvocadoWeight),
-          autoserviceRevenue: Math.floor(autoserviceAvocadoWeight * AVOCADO_PRICE_PER_KG),
-          transactionsPerDay: Math.floor(avocadoTransactions),
-          percentageOfTotal: (avocadoPercentage * 100).toFixed(1)
+      });
+      
+      const avocados = {};
+      avocadoByStore.data.forEach(row => {
+        const data = avocados[row.store_id] = avocados[row.store_id] || {
+          monthlyWeight: 0, monthlyRevenue: 0, iaWeight: 0, iaRevenue: 0,
+          autoserviceWeight: 0, autoserviceRevenue: 0, transactions: 0
+        };
+        data.monthlyWeight += row.kg;
+        data.monthlyRevenue += row.amount;
+        data.transactions += row.transactions;
+        if (row.device_type === 'IA') {
+          data.iaWeight += row.kg;
+          data.iaRevenue += row.amount;
+        } else if (row.device_type === 'AUTOSERVICIO') {
+          data.autoserviceWeight += row.kg;
+          data.autoserviceRevenue += row.amount;
+        }
+      });
+      Object.entries(avocados).forEach(([storeId, data]) => {
+        const total = sales[storeId]?.monthlyTransactions || 0;
+        avocados[storeId] = {
+          ...data,
+          monthlyWeight: Math.floor(data.monthlyWeight),
+          monthlyRevenue: Math.floor(data.monthlyRevenue),
+          iaWeight: Math.floor(data.iaWeight),
+          autoserviceWeight: Math.floor(data.autoserviceWeight),
+          transactionsPerDay: Math.round(data.transactions / SALES_DAYS),
+          percentageOfTotal: total ? (data.transactions / total * 100).toFixed(1) : '0.0'
         };
       });
       
+      const storesById = Object.fromEntries(storesResponse.data.map(store => [store.id, store]));
+      setTopDevices(byStoreType.data.map(row => ({
+        storeName: storesById[row.store_id]?.name || row.store_id,
+        comuna: storesById[row.store_id]?.comuna || '',
+        deviceType: row.device_type,
+        revenue: Math.floor(row.amount)
+      })));
       setSalesData(sales);
       setAvocadoData(avocados);
     } catch (error) {
@@ -102,7 +101,7 @@ const SalesAnalysisPage = ({ onLogout }) => {
   const getOverallMetrics = () => {
     const totalRevenue = Object.values(salesData).reduce((sum, data) => sum + data.monthlyRevenue, 0);
     const totalWeight = Object.values(salesData).reduce((sum, data) => sum + data.monthlyWeight, 0);
-    const totalTransactions = Object.values(salesData).reduce((sum, data) => sum + (data.dailyTransactions * 30), 0);
+    const totalTransactions = Object.values(salesData).reduce((sum, data) => sum + data.monthlyTransactions, 0);
     const totalDevices = Object.values(salesData).reduce((sum, data) => sum + data.devices, 0);
     const totalAvocadoRevenue = Object.values(avocadoData).reduce((sum, data) => sum + data.monthlyRevenue, 0);
     const totalAvocadoWeight = Object.values(avocadoData).reduce((sum, data) => sum + data.monthlyWeight, 0);
@@ -114,7 +113,8 @@ const SalesAnalysisPage = ({ onLogout }) => {
       avgRevenuePerDevice: Math.floor(totalRevenue / totalDevices).toLocaleString('es-CL'),
       avgRevenuePerKg: Math.floor(totalRevenue / totalWeight).toLocaleString('es-CL'),
       totalAvocadoRevenue: totalAvocadoRevenue.toLocaleString('es-CL'),
-      totalAvocadoWeight: totalAvocadoWeight.toLocaleString('es-CL')
+      totalAvocadoWeight: totalAvocadoWeight.toLocaleString('es-CL'),
+      avocadoPricePerKg: totalAvocadoWeight ? Math.floor(totalAvocadoRevenue / totalAvocadoWeight).toLocaleString('es-CL') : '0'
     };
   };
 
@@ -124,29 +124,6 @@ const SalesAnalysisPage = ({ onLogout }) => {
       .slice(0, 3);
   };
 
-  const getTop3Devices = () => {
-    const deviceList = [];
-    stores.forEach(store => {
-      const storeData = salesData[store.id];
-      if (storeData) {
-        store.devices.forEach((device, index) => {
-          const deviceRevenue = Math.floor(storeData.monthlyRevenue / storeData.devices * (0.8 + Math.random() * 0.4));
-          deviceList.push({
-            storeName: store.name,
-            comuna: store.comuna,
-            deviceId: device.id.substring(0, 8),
-            deviceType: device.type,
-            revenue: deviceRevenue
-          });
-        });
-      }
-    });
-    
-    return deviceList
-      .sort((a, b) => b.revenue - a.revenue)
-      .slice(0, 3);
-  };
-
   const getTopAvocadoStores = () => {
     return stores
       .sort((a, b) => (avocadoData[b.id]?.monthlyWeight || 0) - (avocadoData[a.id]?.monthlyWeight || 0))
@@ -155,7 +132,7 @@ const SalesAnalysisPage = ({ onLogout }) => {
 
   const metrics = Object.keys(salesData).length > 0 ? getOverallMetrics() : {};
   const top3Stores = Object.keys(salesData).length > 0 ? getTop3Stores() : [];
-  const top3Devices = Object.keys(salesData).length > 0 ? getTop3Devices() : [];
+  const top3Devices = topDevices;
   const topAvocadoStores = Object.keys(avocadoData).length > 0 ? getTopAvocadoStores() : [];
 
   if (loading) {
@@ -250,7 +227,7 @@ const SalesAnalysisPage = ({ onLogout }) => {
             </div>
             <div>
               <h3 className="text-xl font-bold text-gray-800">Análisis Especial: Paltas</h3>
-              <p className="text-sm text-gray-600">Precio: ${AVOCADO_PRICE_PER_KG.toLocaleString('es-CL')} CLP/kg</p>
+              <p className="text-sm text-gray-600">Precio promedio: ${metrics.avocadoPricePerKg} CLP/kg</p>
             </div>
           </div>
           <div className="grid grid-cols-1 md:grid-cols-3 gap-4">
@@ -314,13 +291,13 @@ const SalesAnalysisPage = ({ onLogout }) => {
           <Card className="p-6">
             <h3 className="text-lg font-semibold mb-4 flex items-center gap-2">
               <Target className="w-5 h-5 text-blue-600" />
-              Top 3 Balanzas (Ingresos)
+              Top 3 Balanzas por Local (Ingresos)
             </h3>
             <div className="space-y-3">
               {top3Devices.map((device, index) => {
                 const colors = ['bg-blue-100 text-blue-800', 'bg-indigo-100 text-indigo-800', 'bg-purple-100 text-purple-800'];
                 return (
-                  <div key={`${device.storeName}-${device.deviceId}`} className="p-3 bg-gray-50 rounded-lg">
+                  <div key={`${device.storeName}-${device.deviceType}`} className="p-3 bg-gray-50 rounded-lg">
                     <div className="flex items-center justify-between">
                       <div className="flex items-center gap-3">
                         <div className={`w-6 h-6 rounded-full ${colors[index]} flex items-center justify-center font-bold text-xs`}>
@@ -328,7 +305,7 @@ const SalesAnalysisPage = ({ onLogout }) => {
                         </div>
                         <div>
                           <p className="font-medium text-sm">{device.storeName}</p>
-                          <p className="text-xs text-gray-600">ID: {device.deviceId}</p>
+                          <p className="text-xs text-gray-600">{device.comuna}</p>
                         </div>
                       </div>
                       <div className="text-right">
@@ -1,4 +1,4 @@
-import { useState, useEffect } from 'react';
+import { useState, useEffect, useRef } from 'react';
 import axios from 'axios';
 import { API } from '@/App';
 import Layout from '@/components/Layout';
@@ -54,6 +54,7 @@ const SelfServicePage = ({ onLogout }) => {
   const [deploymentDuration, setDeploymentDuration] = useState(0);
   const [packageSize, setPackageSize] = useState(0);
   const [deploymentErrors, setDeploymentErrors] = useState([]);
+  const deploymentSource = useRef(null);
 
   const demoImages = {
     bienvenido: [
@@ -80,6 +81,7 @@ const SelfServicePage = ({ onLogout }) => {
 
   useEffect(() => {
     loadStores();
+    return () => deploymentSource.current?.close();
   }, []);
 
   // Update deployment duration timer
@@ -104,14 +106,18 @@ const SelfServicePage = ({ onLogout }) => {
     }
   };
 
-  const handleImageUpload = (stepId, event) => {
+  const handleImageUpload = async (stepId, event) => {
     const file = event.target.files[0];
     if (file) {
-      const reader = new FileReader();
-      reader.onload = (e) => {
-        updateStepImage(stepId, e.target.result);
-      };
-      reader.readAsDataURL(file);
+      // Stored once by the backend (resized for the scale display) and referenced by its hash
+      try {
+        const response = await axios.post(`${API}/assets`, file, {
+          headers: { 'Content-Type': file.type || 'application/octet-stream' }
+        });
+        updateStepImage(stepId, `${API}/assets/${response.data.sha256}`);
+      } catch (error) {
+        toast.error(error.response?.data?.detail || 'Error al subir la imagen');
+      }
     }
   };
 
@@ -152,41 +158,63 @@ const SelfServicePage = ({ onLogout }) => {
     setDeploymentStartTime(Date.now());
     setDeploymentDuration(0);
     setDeploymentErrors([]);
-    
-    // Calculate package size (simulate based on number of images)
-    const calculatedSize = flowSteps.length * 2.8; // ~2.8MB per high-quality image
-    setPackageSize(calculatedSize);
+    setPackageSize(0);
 
-    const targetCount = getTargetStoresCount();
-    
-    const interval = setInterval(() => {
-      setDeploymentProgress(prev => {
-        // Update duration
-        setDeploymentDuration(Math.floor((Date.now() - deploymentStartTime) / 1000));
-        
-        if (prev >= targetCount) {
-          clearInterval(interval);
+    const target = {
+      current: { store_ids: stores.slice(0, 1).map(store => store.id) },
+      autoservicio: { device_types: ['AUTOSERVICIO'] },
+      all: {}
+    }[deploymentTarget];
+
+    try {
+      const response = await axios.post(`${API}/deployments`, {
+        kind: 'self_service_flow',
+        package: {
+          steps: flowSteps.map(step => ({ id: step.id, title: step.title, image: step.currentImage }))
+        },
+        ...target
+      });
+      const deployment = response.data;
+      setPackageSize(deployment.package_bytes / (1024 * 1024));
+
+      // Progress and per-store failures are pushed by the backend deployment engine
+      deploymentSource.current?.close();
+      const source = new EventSource(`${API}/stream?topics=deployments`);
+      deploymentSource.current = source;
+      source.addEventListener('deployments', (event) => {
+        const progress = JSON.parse(event.data);
+        if (progress.id !== deployment.id) return;
+        setDeploymentProgress(progress.deployed_stores + progress.failed_stores);
+        if (progress.failures.length > 0) {
+          setDeploymentErrors(prev => [
+            ...prev,
+            ...progress.failures.map(failure => `${failure.store_name}: ${failure.error}`)
+          ]);
+        }
+        if (['completed', 'partial', 'cancelled', 'failed'].includes(progress.status)) {
+          source.close();
           setIsDeploying(false);
-          
-          // Simulate some random errors (5% chance per store)
-          const errors = [];
-          for (let i = 0; i < targetCount; i++) {
-            if (Math.random() < 0.05) {
-              errors.push(`Local ${i + 1}: Error de conectividad`);
-            }
-          }
-          setDeploymentErrors(errors);
-          
-          if (errors.length === 0) {
-            toast.success(`Flujo desplegado satisfactoriamente en ${targetCount} locales`);
+          if (progress.status === 'failed') {
+            toast.error('El despliegue se detuvo por un error interno');
+          } else if (progress.failed_stores === 0) {
+            toast.success(`Flujo desplegado satisfactoriamente en ${progress.total_stores} locales`);
           } else {
-            toast.warning(`Desplegado en ${targetCount - errors.length}/${targetCount} locales. ${errors.length} errores.`);
+            toast.warning(`Desplegado en ${progress.deployed_stores}/${progress.total_stores} locales. ${progress.failed_stores} errores.`);
           }
-          return targetCount;
         }
-        return prev + 1;
       });
-    }, 300);
+      source.addEventListener('resync', async () => {
+        const current = await axios.get(`${API}/deployments/${deployment.id}`);
+        setDeploymentProgress(current.data.deployed_stores + current.data.failed_stores);
+        setDeploymentErrors(current.data.stores
+          .filter(store => store.status === 'failed')
+          .map(store => `${store.store_name}: ${store.error}`));
+      });
+      source.addEventListener('close', () => source.close());
+    } catch (error) {
+      setIsDeploying(false);
+      toast.error(error.response?.data?.detail || 'Error al iniciar el despliegue');
+    }
   };
 
   const formatDuration = (seconds) => {
@@ -492,7 +520,7 @@ const SelfServicePage = ({ onLogout }) => {
                   </div>
                   <div className="text-right">
                     <div className="text-2xl font-bold text-purple-600">
-                      {packageSize > 0 ? `${packageSize.toFixed(1)}` : '-'}
+                      {packageSize > 0 ? `${packageSize.toFixed(2)}` : '-'}
                     </div>
                     <div className="text-sm text-gray-600">MB</div>
                   </div>
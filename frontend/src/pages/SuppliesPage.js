@@ -1,44 +1,75 @@
+import { useState, useEffect } from 'react';
+import axios from 'axios';
+import { API } from '@/App';
 import Layout from '@/components/Layout';
 import { Card } from '@/components/ui/card';
 import { Badge } from '@/components/ui/badge';
 import { Button } from '@/components/ui/button';
-import { Package, Truck, CheckCircle2, Calendar } from 'lucide-react';
+import { Package, Truck, CheckCircle2, Calendar, AlertCircle } from 'lucide-react';
+import { toast } from 'sonner';
+
+const CRITICAL_STORES = 10;
+
+const formatDate = (value) => (value ? new Date(value).toLocaleDateString('es-CL') : '—');
 
 const SuppliesPage = ({ onLogout }) => {
-  const supplies = [
-    {
-      id: 1,
-      category: 'Papel Térmico Premium',
-      vendor: 'Papelera Nacional S.A.',
-      quality: 'Premium 80gsm',
-      glueAmount: '15%',
-      rollDimensions: '80mm x 80m',
-      metersPerRoll: 80,
-      coreSize: '12mm',
-      unitsPerBox: 50,
-      costPerRoll: '$2.500',
-      stock: 15000,
-      minStock: 5000,
-      lastOrder: '2025-02-10',
-      nextOrder: '2025-03-01'
-    },
-    {
-      id: 2,
-      category: 'Papel Térmico Estándar',
-      vendor: 'Distribuidora Sur',
-      quality: 'Estándar 55gsm',
-      glueAmount: '10%',
-      rollDimensions: '80mm x 60m',
-      metersPerRoll: 60,
-      coreSize: '12mm',
-      unitsPerBox: 60,
-      costPerRoll: '$1.800',
-      stock: 8000,
-      minStock: 3000,
-      lastOrder: '2025-02-15',
-      nextOrder: '2025-03-10'
+  const [summary, setSummary] = useState(null);
+  const [criticalStores, setCriticalStores] = useState([]);
+  const [loading, setLoading] = useState(true);
+
+  useEffect(() => {
+    loadSupplies();
+  }, []);
+
+  const loadSupplies = async () => {
+    try {
+      // Stock lines come sorted by forecast depletion, soonest first
+      const [summaryResponse, storesResponse] = await Promise.all([
+        axios.get(`${API}/supplies/summary`),
+        axios.get(`${API}/supplies`, { params: { location_type: 'store', limit: CRITICAL_STORES } })
+      ]);
+      setSummary(summaryResponse.data);
+      setCriticalStores(storesResponse.data);
+    } catch (error) {
+      console.error('Error loading supplies:', error);
+      toast.error('Error al cargar insumos');
+    } finally {
+      setLoading(false);
     }
-  ];
+  };
+
+  const placeOrder = async (line, catalogItem) => {
+    try {
+      // Whole boxes bringing the stock back up to twice its minimum
+      const boxes = Math.max(1, Math.ceil((line.min_rolls * 2 - line.rolls) / catalogItem.units_per_box));
+      await axios.post(`${API}/supplies/movements`, [{
+        kind: 'receipt',
+        location_id: line.location_id,
+        sku: line.sku,
+        rolls: boxes * catalogItem.units_per_box
+      }]);
+      toast.success(`Pedido de ${boxes} cajas de ${catalogItem.name} registrado`);
+      loadSupplies();
+    } catch (error) {
+      console.error('Error placing order:', error);
+      toast.error('Error al registrar el pedido');
+    }
+  };
+
+  if (loading || !summary) {
+    return (
+      <Layout onLogout={onLogout}>
+        <div className="flex items-center justify-center h-full">
+          <div className="animate-spin rounded-full h-12 w-12 border-b-2 border-blue-600"></div>
+        </div>
+      </Layout>
+    );
+  }
+
+  const catalog = Object.fromEntries(summary.catalog.map(item => [item.sku, item]));
+  const vendors = new Set(summary.catalog.map(item => item.vendor)).size;
+  const warehouseOk = summary.warehouse.filter(line => line.rolls > line.min_rolls).length;
+  const optimalStock = summary.warehouse.length ? Math.round(warehouseOk / summary.warehouse.length * 100) : 100;
 
   return (
     <Layout onLogout={onLogout}>
@@ -48,7 +79,9 @@ const SuppliesPage = ({ onLogout }) => {
           <h1 className="text-3xl font-bold text-gray-800" style={{ fontFamily: 'Inter, sans-serif' }}>
             Gestión de Insumos
           </h1>
-          <p className="text-gray-600 mt-1">Control de inventario y proveedores</p>
+          <p className="text-gray-600 mt-1">
+            Control de inventario y proveedores · {summary.stores} locales consumen {Math.round(summary.store_daily_rolls).toLocaleString()} rollos/día
+          </p>
         </div>
 
         {/* Summary Cards */}
@@ -57,7 +90,7 @@ const SuppliesPage = ({ onLogout }) => {
             <div className="flex items-center justify-between">
               <div>
                 <p className="text-sm text-gray-600 mb-1">Proveedores Activos</p>
-                <h3 className="text-3xl font-bold" style={{ color: '#0071CE' }}>2</h3>
+                <h3 className="text-3xl font-bold" style={{ color: '#0071CE' }}>{vendors}</h3>
               </div>
               <div className="w-12 h-12 rounded-full flex items-center justify-center" style={{ backgroundColor: 'rgba(0, 113, 206, 0.1)' }}>
                 <Truck className="w-6 h-6" style={{ color: '#0071CE' }} />
@@ -69,7 +102,7 @@ const SuppliesPage = ({ onLogout }) => {
             <div className="flex items-center justify-between">
               <div>
                 <p className="text-sm text-gray-600 mb-1">Tipos de Papel</p>
-                <h3 className="text-3xl font-bold" style={{ color: '#FFC220' }}>2</h3>
+                <h3 className="text-3xl font-bold" style={{ color: '#FFC220' }}>{summary.catalog.length}</h3>
               </div>
               <div className="w-12 h-12 rounded-full flex items-center justify-center" style={{ backgroundColor: 'rgba(255, 194, 32, 0.1)' }}>
                 <Package className="w-6 h-6" style={{ color: '#FFC220' }} />
@@ -81,7 +114,7 @@ const SuppliesPage = ({ onLogout }) => {
             <div className="flex items-center justify-between">
               <div>
                 <p className="text-sm text-gray-600 mb-1">Stock Óptimo</p>
-                <h3 className="text-3xl font-bold text-green-600">100%</h3>
+                <h3 className="text-3xl font-bold text-green-600">{optimalStock}%</h3>
               </div>
               <div className="w-12 h-12 rounded-full bg-green-100 flex items-center justify-center">
                 <CheckCircle2 className="w-6 h-6 text-green-600" />
@@ -92,8 +125,8 @@ const SuppliesPage = ({ onLogout }) => {
           <Card className="p-6 shadow-lg">
             <div className="flex items-center justify-between">
               <div>
-                <p className="text-sm text-gray-600 mb-1">Pedidos Pendientes</p>
-                <h3 className="text-3xl font-bold" style={{ color: '#1B4D89' }}>2</h3>
+                <p className="text-sm text-gray-600 mb-1">Días a {summary.next_peak}</p>
+                <h3 className="text-3xl font-bold" style={{ color: '#1B4D89' }}>{summary.days_to_next_peak}</h3>
               </div>
               <div className="w-12 h-12 rounded-full flex items-center justify-center" style={{ backgroundColor: 'rgba(27, 77, 137, 0.1)' }}>
                 <Calendar className="w-6 h-6" style={{ color: '#1B4D89' }} />
@@ -104,21 +137,21 @@ const SuppliesPage = ({ onLogout }) => {
 
         {/* Supplies Grid */}
         <div className="grid grid-cols-1 lg:grid-cols-2 gap-6">
-          {supplies.map(supply => (
-            <Card key={supply.id} className="p-6 shadow-lg hover:shadow-xl transition-shadow">
+          {summary.warehouse.map(line => ({ line, supply: catalog[line.sku] })).map(({ line, supply }) => (
+            <Card key={line.id} className="p-6 shadow-lg hover:shadow-xl transition-shadow">
               <div className="flex justify-between items-start mb-4">
                 <div>
-                  <h3 className="text-xl font-bold text-gray-800">{supply.category}</h3>
+                  <h3 className="text-xl font-bold text-gray-800">{supply.name}</h3>
                   <p className="text-sm text-gray-600 mt-1">{supply.vendor}</p>
                 </div>
                 <Badge 
                   className="px-3 py-1" 
                   style={{ 
-                    backgroundColor: supply.stock > supply.minStock ? '#10b981' : '#f59e0b',
+                    backgroundColor: line.rolls > line.min_rolls ? '#10b981' : '#f59e0b',
                     color: 'white'
                   }}
                 >
-                  {supply.stock > supply.minStock ? 'Stock OK' : 'Stock Bajo'}
+                  {line.rolls > line.min_rolls ? 'Stock OK' : 'Stock Bajo'}
                 </Badge>
               </div>
 
@@ -130,57 +163,89 @@ const SuppliesPage = ({ onLogout }) => {
                   </div>
                   <div>
                     <p className="text-xs text-gray-500">Metros/Rollo</p>
-                    <p className="font-semibold text-gray-800">{supply.metersPerRoll}m</p>
+                    <p className="font-semibold text-gray-800">{supply.meters_per_roll}m</p>
                   </div>
                 </div>
 
                 <div className="grid grid-cols-2 gap-4">
                   <div>
                     <p className="text-xs text-gray-500">Dimensiones</p>
-                    <p className="font-semibold text-gray-800">{supply.rollDimensions}</p>
+                    <p className="font-semibold text-gray-800">{supply.roll_dimensions}</p>
                   </div>
                   <div>
                     <p className="text-xs text-gray-500">Unidades/Caja</p>
-                    <p className="font-semibold text-gray-800">{supply.unitsPerBox}</p>
+                    <p className="font-semibold text-gray-800">{supply.units_per_box}</p>
                   </div>
                 </div>
 
                 <div className="grid grid-cols-3 gap-4">
                   <div>
                     <p className="text-xs text-gray-500">Costo/Rollo</p>
-                    <p className="font-semibold" style={{ color: '#0071CE' }}>{supply.costPerRoll}</p>
+                    <p className="font-semibold" style={{ color: '#0071CE' }}>${supply.cost_per_roll.toLocaleString('es-CL')}</p>
                   </div>
                   <div>
                     <p className="text-xs text-gray-500">Stock Actual</p>
-                    <p className="font-semibold text-gray-800">{supply.stock.toLocaleString()}</p>
+                    <p className="font-semibold text-gray-800">{Math.round(line.rolls).toLocaleString()}</p>
                   </div>
                   <div>
                     <p className="text-xs text-gray-500">Stock Mínimo</p>
-                    <p className="font-semibold text-gray-600">{supply.minStock.toLocaleString()}</p>
+                    <p className="font-semibold text-gray-600">{Math.round(line.min_rolls).toLocaleString()}</p>
                   </div>
                 </div>
               </div>
 
               <div className="border-t pt-4 space-y-2">
                 <div className="flex justify-between text-sm">
-                  <span className="text-gray-600">Último Pedido:</span>
-                  <span className="font-semibold">{supply.lastOrder}</span>
+                  <span className="text-gray-600">Consumo Pronosticado:</span>
+                  <span className="font-semibold">{Math.round(line.daily_rolls).toLocaleString()} rollos/día</span>
+                </div>
+                <div className="flex justify-between text-sm">
+                  <span className="text-gray-600">Agotamiento:</span>
+                  <span className="font-semibold">{formatDate(line.depletion_date)} ({line.days_left} días)</span>
                 </div>
                 <div className="flex justify-between text-sm">
                   <span className="text-gray-600">Próximo Pedido:</span>
-                  <span className="font-semibold" style={{ color: '#FFC220' }}>{supply.nextOrder}</span>
+                  <span className="font-semibold" style={{ color: '#FFC220' }}>{formatDate(line.reorder_date)}</span>
                 </div>
               </div>
 
               <Button 
                 className="w-full mt-4" 
                 style={{ backgroundColor: '#0071CE' }}
+                onClick={() => placeOrder(line, supply)}
               >
                 Realizar Pedido
               </Button>
             </Card>
           ))}
         </div>
+
+        {/* Stores closest to running out */}
+        <Card className="p-6 shadow-lg">
+          <div className="flex items-center justify-between mb-4">
+            <h3 className="text-xl font-bold text-gray-800">Locales Próximos a Agotar Papel</h3>
+            <Badge className="px-3 py-1" style={{ backgroundColor: '#f59e0b', color: 'white' }}>
+              {summary.stores_depleting_soon} en menos de 7 días · {summary.stores_below_min} bajo mínimo
+            </Badge>
+          </div>
+          <div className="space-y-3">
+            {criticalStores.map(line => (
+              <div key={line.id} className="flex items-center justify-between border-b pb-2 text-sm">
+                <div className="flex items-center gap-2">
+                  {line.rolls <= line.min_rolls && <AlertCircle className="w-4 h-4 text-orange-500" />}
+                  <span className="font-semibold text-gray-800">{line.location_name}</span>
+                </div>
+                <div className="flex gap-6 text-gray-600">
+                  <span>{Math.round(line.rolls)} rollos</span>
+                  <span>{line.daily_rolls.toFixed(1)} rollos/día</span>
+                  <span className="font-semibold" style={{ color: line.days_left < 7 ? '#f59e0b' : '#10b981' }}>
+                    {line.days_left} días
+                  </span>
+                </div>
+              </div>
+            ))}
+          </div>
+        </Card>
       </div>
     </Layout>
   );
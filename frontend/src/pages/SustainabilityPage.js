@@ -9,9 +9,10 @@ import { Progress } from '@/components/ui/progress';
 import { Leaf, TrendingDown, TrendingUp, Zap, FileText, Target, Award, AlertCircle } from 'lucide-react';
 import { toast } from 'sonner';
 
+const TOP_STORES = 10;
+
 const SustainabilityPage = ({ onLogout }) => {
-  const [stores, setStores] = useState([]);
-  const [sustainabilityData, setSustainabilityData] = useState({});
+  const [report, setReport] = useState(null);
   const [loading, setLoading] = useState(true);
 
   useEffect(() => {
@@ -20,33 +21,9 @@ const SustainabilityPage = ({ onLogout }) => {
 
   const loadSustainabilityData = async () => {
     try {
-      const response = await axios.get(`${API}/stores`);
-      setStores(response.data);
-      
-      // Calculate sustainability metrics for each store
-      const sustainability = {};
-      response.data.forEach(store => {
-        const devices = store.devices || [];
-        const energyConsumption = devices.length * 24 * 30 * 0.15; // kWh per month (estimated)
-        const paperConsumption = devices.length * 50 * 30; // sheets per month (estimated)
-        
-        // CO2 emissions calculation (kg CO2)
-        const carbonFootprint = (energyConsumption * 0.5) + (paperConsumption * 0.006);
-        
-        // Sustainability score (0-100, where 100 is best)
-        const score = Math.max(0, 100 - (carbonFootprint / devices.length) * 10);
-        
-        sustainability[store.id] = {
-          energyConsumption,
-          paperConsumption,
-          carbonFootprint,
-          score,
-          category: score >= 70 ? 'green' : score >= 40 ? 'orange' : 'red',
-          recommendations: generateRecommendations(score, energyConsumption, paperConsumption)
-        };
-      });
-      
-      setSustainabilityData(sustainability);
+      // Totals, categories and rankings are computed by the backend from the fleet rollups
+      const response = await axios.get(`${API}/sustainability`, { params: { top: TOP_STORES } });
+      setReport(response.data);
     } catch (error) {
       console.error('Error loading sustainability data:', error);
       toast.error('Error al cargar datos de sostenibilidad');
@@ -58,7 +35,7 @@ const SustainabilityPage = ({ onLogout }) => {
   const generateRecommendations = (score, energy, paper) => {
     const recommendations = [];
     
-    if (paper > 2000) {
+    if (paper > 600) {
       recommendations.push({
         type: 'paper',
         title: 'Adopta etiquetas linerless',
@@ -68,7 +45,7 @@ const SustainabilityPage = ({ onLogout }) => {
       });
     }
     
-    if (energy > 150) {
+    if (energy > 10) {
       recommendations.push({
         type: 'energy',
         title: 'Programa calibraciones',
@@ -100,28 +77,24 @@ const SustainabilityPage = ({ onLogout }) => {
     }
   };
 
-  const getOverallMetrics = () => {
-    const totalEnergy = Object.values(sustainabilityData).reduce((sum, data) => sum + data.energyConsumption, 0);
-    const totalPaper = Object.values(sustainabilityData).reduce((sum, data) => sum + data.paperConsumption, 0);
-    const totalCarbon = Object.values(sustainabilityData).reduce((sum, data) => sum + data.carbonFootprint, 0);
-    const avgScore = Object.values(sustainabilityData).reduce((sum, data) => sum + data.score, 0) / Object.keys(sustainabilityData).length;
-    
-    const greenStores = Object.values(sustainabilityData).filter(data => data.category === 'green').length;
-    const orangeStores = Object.values(sustainabilityData).filter(data => data.category === 'orange').length;
-    const redStores = Object.values(sustainabilityData).filter(data => data.category === 'red').length;
-
-    return {
-      totalEnergy: totalEnergy.toFixed(1),
-      totalPaper: totalPaper.toLocaleString(),
-      totalCarbon: totalCarbon.toFixed(1),
-      avgScore: avgScore.toFixed(1),
-      greenStores,
-      orangeStores,
-      redStores
-    };
-  };
+  const toStoreData = (store) => ({
+    energyConsumption: store.energy_kwh_day * 30,
+    paperConsumption: store.paper_rolls_day * 30,
+    carbonFootprint: store.carbon_kg_month,
+    score: store.score,
+    category: store.category,
+    recommendations: generateRecommendations(store.score, store.energy_kwh_day, store.paper_meters_day)
+  });
 
-  const metrics = Object.keys(sustainabilityData).length > 0 ? getOverallMetrics() : {};
+  const metrics = report ? {
+    totalEnergy: (report.totals.energy_kwh_day * 30).toFixed(1),
+    totalPaper: (report.totals.paper_rolls_day * 30).toLocaleString(),
+    totalCarbon: report.totals.carbon_kg_month.toFixed(1),
+    avgScore: report.totals.avg_score.toFixed(1),
+    greenStores: report.categories.green,
+    orangeStores: report.categories.orange,
+    redStores: report.categories.red
+  } : {};
 
   if (loading) {
     return (
@@ -191,7 +164,7 @@ const SustainabilityPage = ({ onLogout }) => {
               <div>
                 <p className="text-sm font-medium text-gray-600">Consumo de Papel</p>
                 <p className="text-2xl font-bold text-gray-900">{metrics.totalPaper}</p>
-                <p className="text-xs text-gray-600">hojas/mes</p>
+                <p className="text-xs text-gray-600">rollos/mes</p>
               </div>
               <div className="w-12 h-12 rounded-full bg-orange-100 flex items-center justify-center">
                 <FileText className="w-6 h-6 text-orange-600" />
@@ -225,14 +198,13 @@ const SustainabilityPage = ({ onLogout }) => {
               Top 5 Locales Más Sostenibles
             </h3>
             <div className="space-y-3">
-              {stores
-                .sort((a, b) => (sustainabilityData[b.id]?.score || 0) - (sustainabilityData[a.id]?.score || 0))
+              {report?.most_sustainable
                 .slice(0, 5)
                 .map((store, index) => {
-                  const data = sustainabilityData[store.id];
+                  const data = toStoreData(store);
                   const colors = getCategoryColor(data?.category);
                   return (
-                    <div key={store.id} className="flex items-center justify-between p-3 bg-gray-50 rounded-lg">
+                    <div key={store.store_id} className="flex items-center justify-between p-3 bg-gray-50 rounded-lg">
                       <div className="flex items-center gap-3">
                         <div className={`w-8 h-8 rounded-full ${colors.bg} ${colors.text} flex items-center justify-center font-bold text-sm`}>
                           {index + 1}
@@ -260,13 +232,12 @@ const SustainabilityPage = ({ onLogout }) => {
               Locales que Requieren Atención
             </h3>
             <div className="space-y-3">
-              {stores
-                .filter(store => sustainabilityData[store.id]?.category === 'red')
+              {report?.needs_attention
                 .slice(0, 5)
                 .map((store) => {
-                  const data = sustainabilityData[store.id];
+                  const data = toStoreData(store);
                   return (
-                    <div key={store.id} className="flex items-center justify-between p-3 bg-red-50 rounded-lg border border-red-200">
+                    <div key={store.store_id} className="flex items-center justify-between p-3 bg-red-50 rounded-lg border border-red-200">
                       <div className="flex items-center gap-3">
                         <div className="w-8 h-8 rounded-full bg-red-500 text-white flex items-center justify-center">
                           <AlertCircle className="w-4 h-4" />
@@ -289,7 +260,7 @@ const SustainabilityPage = ({ onLogout }) => {
 
         {/* Detailed Store Analysis */}
         <Card className="p-6">
-          <h3 className="text-lg font-semibold mb-4">Análisis Detallado por Local</h3>
+          <h3 className="text-lg font-semibold mb-4">Análisis Detallado - Top {TOP_STORES} Locales por Consumo</h3>
           <div className="overflow-x-auto">
             <table className="w-full text-sm">
               <thead>
@@ -297,17 +268,17 @@ const SustainabilityPage = ({ onLogout }) => {
                   <th className="text-left p-3">Local</th>
                   <th className="text-left p-3">Puntuación</th>
                   <th className="text-left p-3">CO₂ (kg/mes)</th>
-                  <th className="text-left p-3">Energía (kWh)</th>
-                  <th className="text-left p-3">Papel (hojas)</th>
+                  <th className="text-left p-3">Energía (kWh/mes)</th>
+                  <th className="text-left p-3">Papel (rollos/mes)</th>
                   <th className="text-left p-3">Recomendaciones</th>
                 </tr>
               </thead>
               <tbody>
-                {stores.map(store => {
-                  const data = sustainabilityData[store.id];
+                {report?.top_consumers.map(store => {
+                  const data = toStoreData(store);
                   const colors = getCategoryColor(data?.category);
                   return (
-                    <tr key={store.id} className="border-b hover:bg-gray-50">
+                    <tr key={store.store_id} className="border-b hover:bg-gray-50">
                       <td className="p-3">
                         <div>
                           <p className="font-medium">{store.name}</p>
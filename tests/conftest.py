@@ -0,0 +1,103 @@
+"""
+Fixtures for the BM MANAGER backend tests
+The app runs in process through httpx's ASGI transport against a fresh
+mongomock database per test, so the rollups take the client-side fallback
+instead of $merge.
+"""
+
+import os
+import sys
+from datetime import datetime, timedelta, timezone
+from pathlib import Path
+
+import httpx
+import pytest
+from mongomock_motor import AsyncMongoMockClient
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+os.environ.setdefault("MONGO_URL", "mongodb://localhost:27017")
+os.environ.setdefault("DB_NAME", "bm_test")
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+@pytest.fixture
+async def db(monkeypatch):
+    client = AsyncMongoMockClient(tz_aware=True)
+    database = client["bm_test"]
+    monkeypatch.setattr(server, "client", client)
+    monkeypatch.setattr(server, "db", database)
+    # mongomock has no per-database read preference / write concern
+    monkeypatch.setattr(server, "route_db", lambda route_class: database)
+    # In-process state starts empty for every test
+    monkeypatch.setattr(server, "fleet_snapshot", server.FleetSnapshot())
+    monkeypatch.setattr(server, "fraud_detector", server.FraudDetector())
+    monkeypatch.setattr(server, "deployment_engine", server.DeploymentEngine())
+    await server.ensure_indexes()
+    # mongomock ignores partialFilterExpression, so alerts without a dedup_key would collide
+    await database.alerts.drop_index("dedup_key_1")
+    yield database
+
+
+@pytest.fixture
+async def api(db):
+    transport = httpx.ASGITransport(app=server.app)
+    async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+        yield client
+
+
+def make_device(device_type="BMS_ASISTIDA", **fields):
+    """A healthy device that fires no alert rule.
+
+    `last_seen` is set because mongomock's $max (telemetry) fails against a
+    null; MongoDB takes the reading's timestamp. Devices seeded by
+    `generate_device` have none, see backend_bench.py.
+    """
+    now = datetime.now(timezone.utc)
+    return server.BalanceDevice(**{
+        "type": device_type,
+        "last_calibration": now - timedelta(days=1),
+        "installation_date": (now - timedelta(days=365)).isoformat(),
+        "avg_consumption": 1.0,
+        "printhead_life": 90,
+        "last_seen": now - timedelta(days=1),
+        **fields,
+    }).dict()
+
+
+def make_store(index, devices, **fields):
+    return server.Store(**{
+        "name": f"Local {index + 1}",
+        "comuna": "Providencia",
+        "sap_code": f"SAP-{1000 + index}",
+        "address": f"Av. Principal {100 + index}",
+        "latitude": -33.43,
+        "longitude": -70.61,
+        "status": "online",
+        "balances_bms": sum(1 for d in devices if d["type"] == "BMS_ASISTIDA"),
+        "balances_autoservicio": sum(1 for d in devices if d["type"] == "AUTOSERVICIO"),
+        "balances_ia": sum(1 for d in devices if d["type"] == "IA"),
+        "last_update": datetime.now(timezone.utc).isoformat(),
+        "latency": 20,
+        "devices": devices,
+        **fields,
+    }).dict()
+
+
+@pytest.fixture
+def seed(db):
+    """Insert stores through `insert_stores`, as the seeders do"""
+    async def seed(stores):
+        await server.insert_stores(stores)
+        # mongomock's pipeline update leaves "$longitude"/"$latitude" literals in `location`
+        for store in stores:
+            await server.db.stores.update_one({"id": store["id"]}, {"$set": {"location": {
+                "type": "Point", "coordinates": [store["longitude"], store["latitude"]],
+            }}})
+        return stores
+    return seed
@@ -0,0 +1,60 @@
+import pytest
+
+import server
+from tests.conftest import make_device, make_store
+
+pytestmark = pytest.mark.anyio
+
+
+async def rule_alerts(store_id):
+    return await server.db.alerts.find({"store_id": store_id, "rule": {"$ne": None}}, {"_id": 0}).to_list(None)
+
+
+async def test_firing_rule_raises_one_alert(api, seed):
+    device = make_device(label_status="replace")
+    store, = await seed([make_store(0, [device])])
+
+    await server.evaluate_alerts({"id": store["id"]})
+    await server.evaluate_alerts({"id": store["id"]})
+
+    alerts = await rule_alerts(store["id"])
+    assert [(a["rule"], a["device_id"], a["active"]) for a in alerts] == [("labels_replace", device["id"], True)]
+
+
+async def test_cleared_rule_resolves_and_reopens_the_same_alert(api, seed):
+    device = make_device(label_status="replace")
+    store, = await seed([make_store(0, [device])])
+    alert, = await rule_alerts(store["id"])
+
+    await server.db.devices.update_one({"id": device["id"]}, {"$set": {"label_status": "good"}})
+    await server.evaluate_alerts({"id": store["id"]})
+    cleared, = await rule_alerts(store["id"])
+    assert (cleared["active"], cleared["resolved"]) == (False, True)
+
+    await server.db.devices.update_one({"id": device["id"]}, {"$set": {"label_status": "replace"}})
+    await server.evaluate_alerts({"id": store["id"]})
+    reopened, = await rule_alerts(store["id"])
+    assert reopened["id"] == alert["id"]
+    assert (reopened["active"], reopened["resolved"]) == (True, False)
+
+
+async def test_changed_reading_updates_the_open_alert(api, seed):
+    device = make_device(printhead_life=15)
+    store, = await seed([make_store(0, [device])])
+
+    await server.db.devices.update_one({"id": device["id"]}, {"$set": {"printhead_life": 10}})
+    await server.evaluate_alerts({"id": store["id"]})
+
+    alert, = await rule_alerts(store["id"])
+    assert alert["rule"] == "printhead_low"
+    assert "10%" in alert["message"]
+
+
+async def test_store_rules_are_keyed_without_device(api, seed):
+    store, = await seed([make_store(0, [make_device()], latency=400, network_status="unstable")])
+
+    alerts = await rule_alerts(store["id"])
+    assert sorted(a["dedup_key"] for a in alerts) == [
+        server.alert_dedup_key(store["id"], None, "high_latency"),
+        server.alert_dedup_key(store["id"], None, "network_unstable"),
+    ]
@@ -0,0 +1,37 @@
+import io
+import warnings
+
+import pytest
+from PIL import Image
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+def png(width, height):
+    output = io.BytesIO()
+    Image.new("RGB", (width, height), "white").save(output, "PNG")
+    return output.getvalue()
+
+
+def test_image_is_scaled_to_the_display():
+    # Rendered directly: mongomock has no GridFS to store the rendition in
+    _, content_type, width, height = server.render_display_image(png(1600, 960))
+    assert (width, height) == server.ASSET_DISPLAY_SIZE
+    assert content_type == Image.MIME[server.ASSET_DISPLAY_FORMAT]
+
+
+@pytest.mark.parametrize("factor", [1.5, 3])
+async def test_images_above_the_pixel_limit_are_rejected(api, monkeypatch, factor):
+    monkeypatch.setattr(Image, "MAX_IMAGE_PIXELS", int(100 * 100 / factor))
+
+    response = await api.post("/api/assets", content=png(100, 100))
+    assert response.status_code == 413
+    # The limit is enforced per decode, not by turning Pillow's warning into an error process-wide
+    assert not [f for f in warnings.filters if f[2] is Image.DecompressionBombWarning]
+
+
+async def test_unreadable_image_is_unsupported(api):
+    response = await api.post("/api/assets", content=b"not an image")
+    assert response.status_code == 415
@@ -0,0 +1,99 @@
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+import server
+from tests.conftest import make_device, make_store
+
+pytestmark = pytest.mark.anyio
+
+FLOW = {"name": "Autoservicio", "steps": [{"title": "Seleccione producto"}]}
+
+
+@pytest.fixture(autouse=True)
+def no_backoff(monkeypatch):
+    monkeypatch.setattr(server, "DEPLOYMENT_RETRY_BACKOFF", 0)
+
+
+async def deploy(api, **payload):
+    response = await api.post("/api/deployments", json={"kind": "self_service_flow", "package": FLOW, **payload})
+    assert response.status_code == 200
+    deployment = response.json()
+    await finished(deployment["id"])
+    return (await api.get(f"/api/deployments/{deployment['id']}")).json()
+
+
+async def finished(deployment_id):
+    task = server.deployment_engine._jobs.get(deployment_id)
+    if task:
+        await task
+
+
+async def test_deployment_completes_every_store(api, seed):
+    stores = await seed([make_store(i, [make_device("IA"), make_device("AUTOSERVICIO")]) for i in range(3)])
+
+    deployment = await deploy(api, device_types=["IA"])
+
+    assert deployment["status"] == "completed"
+    assert (deployment["deployed_stores"], deployment["failed_stores"]) == (3, 0)
+    assert deployment["deployed_count"] == 3
+    assert {store["status"] for store in deployment["stores"]} == {"deployed"}
+    delivered = await server.db.devices.count_documents(
+        {"content.self_service_flow.deployment_id": deployment["id"]}
+    )
+    assert delivered == len(stores)
+
+
+async def test_offline_devices_leave_the_deployment_partial(api, seed):
+    await seed([
+        make_store(0, [make_device("IA")]),
+        make_store(1, [make_device("IA"), make_device("IA", status="offline")]),
+    ])
+
+    deployment = await deploy(api)
+
+    assert deployment["status"] == "partial"
+    assert (deployment["deployed_stores"], deployment["failed_stores"]) == (1, 1)
+    failed, = [store for store in deployment["stores"] if store["status"] == "failed"]
+    assert failed["attempts"] == server.DEPLOYMENT_MAX_ATTEMPTS
+    assert failed["deployed_devices"] == 1
+    assert deployment["deployed_count"] == 2
+
+    response = await api.post(f"/api/deployments/{deployment['id']}/cancel")
+    assert response.status_code == 409
+
+
+async def test_unexpected_error_fails_the_deployment(api, seed, monkeypatch):
+    await seed([make_store(0, [make_device("IA")])])
+
+    async def broken(deployment, store_id, gateway):
+        raise RuntimeError("gateway misconfigured")
+    monkeypatch.setattr(server, "deliver_package", broken)
+
+    deployment = await deploy(api)
+
+    assert deployment["status"] == "failed"
+    assert deployment["error"] == "gateway misconfigured"
+    assert deployment["finished_at"] is not None
+
+
+async def test_live_lease_of_another_worker_is_respected(api, seed):
+    store, = await seed([make_store(0, [make_device("IA")])])
+    now = datetime.now(timezone.utc)
+    held, expired = (
+        server.Deployment(kind="self_service_flow", package=FLOW, package_hash="h", total_stores=1, total_balances=1,
+                          stores=[server.DeploymentStore(store_id=store["id"], store_name=store["name"], device_count=1)])
+        for _ in range(2)
+    )
+    await server.db.deployments.insert_many([
+        {**held.dict(), "lease_owner": "other-worker", "lease_expires_at": now + timedelta(minutes=5)},
+        {**expired.dict(), "lease_owner": "dead-worker", "lease_expires_at": now - timedelta(minutes=5)},
+    ])
+
+    for deployment in (held, expired):
+        server.deployment_engine.submit(deployment.id)
+        await finished(deployment.id)
+
+    statuses = {d["id"]: d for d in await server.db.deployments.find({}, {"_id": 0}).to_list(None)}
+    assert (statuses[held.id]["status"], statuses[held.id]["lease_owner"]) == ("queued", "other-worker")
+    assert (statuses[expired.id]["status"], statuses[expired.id]["lease_owner"]) == ("completed", None)
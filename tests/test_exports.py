@@ -0,0 +1,43 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from tests.conftest import make_device, make_store
+
+pytestmark = pytest.mark.anyio
+
+
+async def export(api, path, **params):
+    response = await api.get(path, params=params)
+    assert response.status_code == 200
+    return [json.loads(line) for line in response.text.splitlines() if line]
+
+
+async def test_device_changes_are_exported_since(api, seed):
+    first, second = make_device(), make_device()
+    store, = await seed([make_store(0, [first, second])])
+    since = datetime.now(timezone.utc).isoformat()
+
+    assert await export(api, "/api/export/devices", since=since) == []
+    response = await api.patch(f"/api/devices/{first['id']}", json={"firmware_version": "v2.4.0"})
+    assert response.status_code == 200
+    response = await api.put(f"/api/stores/{store['id']}/devices/{second['id']}", json={"label_status": "warning"})
+    assert response.status_code == 200
+
+    exported = await export(api, "/api/export/devices", since=since)
+    assert sorted(device["id"] for device in exported) == sorted([first["id"], second["id"]])
+
+
+async def test_resolved_alerts_are_exported_since(api, seed):
+    store, = await seed([make_store(0, [make_device(label_status="replace")])])
+    alert = await server.db.alerts.find_one({"store_id": store["id"]})
+    since = datetime.now(timezone.utc).isoformat()
+
+    assert await export(api, "/api/export/alerts", since=since, resolved="true") == []
+    response = await api.put(f"/api/alerts/{alert['id']}/resolve")
+    assert response.status_code == 200
+
+    exported = await export(api, "/api/export/alerts", since=since, resolved="true")
+    assert [a["id"] for a in exported] == [alert["id"]]
@@ -0,0 +1,78 @@
+from datetime import datetime, timedelta, timezone
+
+import numpy as np
+import pytest
+
+import server
+from tests.conftest import make_device, make_store
+
+pytestmark = pytest.mark.anyio
+
+
+def weighings(store_id, device_id, kgs, product="Palta", start=None):
+    start = start or datetime(2026, 10, 1, 12, tzinfo=timezone.utc)
+    return [
+        server.WeightReading(store_id=store_id, device_id=device_id, product=product,
+                             weight_kg=kg, amount=1000, timestamp=start + timedelta(seconds=i))
+        for i, kg in enumerate(kgs)
+    ]
+
+
+def test_ring_buffer_histogram_counts_only_the_last_window():
+    window = server.DeviceWeightWindow()
+    rng = np.random.default_rng(7)
+    pushed = []
+    for size in (50, 100, 1, 300, 77):
+        bins = rng.integers(0, server.FRAUD_BINS + 1, size).astype(np.int16)
+        window.push(bins, np.zeros(size, dtype=np.int16), np.full(size, -1, dtype=np.int8))
+        pushed.extend(bins)
+
+    kept = np.array(pushed[-server.FRAUD_WINDOW:])
+    assert window.size == server.FRAUD_WINDOW
+    assert np.array_equal(window.histogram, np.bincount(kept, minlength=server.FRAUD_BINS + 1))
+    assert sorted(window.bins) == sorted(kept)
+
+
+def test_least_recently_seen_device_window_is_evicted(monkeypatch):
+    monkeypatch.setattr(server, "FRAUD_MAX_DEVICES", 2)
+    detector = server.FraudDetector()
+    types = {"a": "IA", "b": "IA", "c": "IA"}
+
+    for device_id in ("a", "b", "a", "c"):
+        detector.observe(weighings("s", device_id, [0.777]), types)
+
+    assert list(detector._windows) == ["a", "c"]
+
+
+def test_repeated_weight_fires_once_per_episode():
+    detector = server.FraudDetector()
+    types = {"d": "AUTOSERVICIO"}
+    repeats = [0.777] * server.FRAUD_REPEAT_MIN
+
+    fired = detector.observe(weighings("s", "d", repeats), types)
+    assert [d["rule"] for d in fired] == ["repeated_weight"]
+    assert detector.observe(weighings("s", "d", [0.777]), types) == []
+
+    # Varied weighings push the repeats out of the window and re-arm the rule
+    detector.observe(weighings("s", "d", np.linspace(0.1, 1.9, server.FRAUD_WINDOW)), types)
+    assert [d["rule"] for d in detector.observe(weighings("s", "d", repeats), types)] == ["repeated_weight"]
+
+
+def test_assisted_scales_are_not_watched():
+    detector = server.FraudDetector()
+    readings = weighings("s", "d", [0.777] * server.FRAUD_REPEAT_MIN)
+    assert detector.observe(readings, {"d": "BMS_ASISTIDA"}) == []
+
+
+async def test_mismatch_alert_is_deduplicated(api, seed):
+    device = make_device("AUTOSERVICIO")
+    store, = await seed([make_store(0, [device])])
+    cans = weighings(store["id"], device["id"], [0.335] * server.FRAUD_MISMATCH_MIN)
+
+    await server.record_weight_readings(cans)
+    later = cans[-1].timestamp + timedelta(minutes=1)
+    await server.record_weight_readings(weighings(store["id"], device["id"], [0.335] * 3, start=later))
+
+    alerts = await server.db.alerts.find({"type": "fraud"}, {"_id": 0}).to_list(None)
+    assert [(a["rule"], a["device_id"], a["active"]) for a in alerts] == [("product_mismatch", device["id"], True)]
+    assert "Lata de bebida" in alerts[0]["message"]
@@ -0,0 +1,114 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from tests.conftest import make_device, make_store
+
+pytestmark = pytest.mark.anyio
+
+DAY = datetime(2026, 10, 1, tzinfo=timezone.utc)
+
+
+def ndjson(readings):
+    return "\n".join(json.dumps(reading) for reading in readings)
+
+
+async def post_batch(api, readings):
+    response = await api.post("/api/telemetry/batch", content=ndjson(readings),
+                              headers={"Content-Type": "application/x-ndjson"})
+    assert response.status_code == 200
+    return response.json()
+
+
+@pytest.fixture
+async def fleet(seed):
+    return await seed([
+        make_store(0, [make_device("IA"), make_device("BMS_ASISTIDA")]),
+        make_store(1, [make_device("BMS_ASISTIDA")]),
+    ])
+
+
+def reading(store, device, product, kg, amount, hour, **fields):
+    return {"store_id": store["id"], "device_id": device["id"], "product": product, "weight_kg": kg,
+            "amount": amount, "timestamp": DAY.replace(hour=hour).isoformat(), **fields}
+
+
+async def test_readings_fold_into_hourly_and_daily_cubes(api, fleet):
+    first, second = fleet
+    ia, assisted = first["devices"]
+    result = await post_batch(api, [
+        reading(first, ia, "Palta", 1.5, 8250, 10),
+        reading(first, ia, "Palta", 0.5, 2750, 10, timestamp=DAY.replace(hour=10, minute=5).isoformat()),
+        reading(first, assisted, "Tomate", 2.0, 3980, 11),
+        reading(second, second["devices"][0], "Tomate", 1.0, 1990, 11),
+    ])
+    assert result["accepted"] == 4
+
+    daily = await server.db.sales_daily.find(
+        {"store_id": first["id"], "product": "Palta"}, {"_id": 0}
+    ).to_list(None)
+    assert [(c["device_type"], c["transactions"], c["kg"], c["amount"]) for c in daily] == [("IA", 2, 2.0, 11000)]
+    assert await server.db.sales_hourly.count_documents({}) == 3
+
+    response = await api.get("/api/analytics/sales", params={
+        "group_by": "product", "start": DAY.isoformat(), "end": DAY.replace(hour=23).isoformat(),
+    })
+    rows = {row["product"]: row for row in response.json()}
+    assert rows["Tomate"]["transactions"] == 2
+    assert rows["Tomate"]["amount"] == 5970
+    assert rows["Palta"]["avg_ticket"] == 5500
+
+
+async def test_retried_batch_is_not_counted_twice(api, fleet):
+    store = fleet[0]
+    device = store["devices"][0]
+    batch = [
+        reading(store, device, "Palta", 1.0, 5500, 9, reading_id="r-1"),
+        reading(store, device, "Palta", 1.0, 5500, 9, reading_id="r-2"),
+        reading(store, device, "Tomate", 0.5, 995, 9),
+    ]
+
+    await post_batch(api, batch)
+    await post_batch(api, batch)
+
+    cells = await server.db.sales_daily.find({}, {"_id": 0, "product": 1, "transactions": 1}).to_list(None)
+    assert sorted((c["product"], c["transactions"]) for c in cells) == [("Palta", 2), ("Tomate", 1)]
+    daily = await server.db.weight_daily.find({}, {"_id": 0, "product": 1, "count": 1}).to_list(None)
+    assert sorted((d["product"], d["count"]) for d in daily) == [("Palta", 2), ("Tomate", 1)]
+
+
+async def test_unknown_devices_are_rejected(api, fleet):
+    store = fleet[0]
+    result = await post_batch(api, [reading(store, {"id": "ghost"}, "Palta", 1.0, 5500, 9)])
+
+    assert result["accepted"] == 0
+    assert result["items"][0]["error"] == "Unknown store or device"
+    assert await server.db.sales_daily.count_documents({}) == 0
+
+
+async def test_retried_batch_updates_the_device_once(api, fleet):
+    store = fleet[0]
+    device = store["devices"][0]
+    batch = [reading(store, device, "Palta", 1.5, 8250, 9, reading_id="r1", printhead_life=55)]
+
+    await post_batch(api, batch)
+    batch[0]["printhead_life"] = 50
+    await post_batch(api, batch)
+
+    stored = await server.db.devices.find_one({"id": device["id"]})
+    assert stored["weight_total_kg"] == 1.5
+    assert stored["printhead_life"] == 50
+
+
+async def test_fix_naming_forgets_the_claimed_readings(api, fleet):
+    store = fleet[0]
+    device = store["devices"][0]
+    await post_batch(api, [reading(store, device, "Palta", 1.0, 5500, 9, reading_id="r-1")])
+    key = f"{device['id']}:r-1"
+    assert await server.db.weight_reading_keys.count_documents({"_id": key}) == 1
+
+    response = await api.post("/api/fix-naming")
+    assert response.status_code == 200
+    assert await server.db.weight_reading_keys.count_documents({"_id": key}) == 0
@@ -0,0 +1,39 @@
+import asyncio
+
+import pytest
+
+import server
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_services_start_while_the_bootstrap_retries(api, monkeypatch):
+    async def no_timeseries():
+        pass  # mongomock has no time-series collections
+
+    attempts = []
+
+    async def flaky_migration():
+        attempts.append(True)
+        if len(attempts) == 1:
+            raise RuntimeError("primary stepped down")
+
+    monkeypatch.setattr(server, "ensure_weight_collections", no_timeseries)
+    monkeypatch.setattr(server, "migrate_embedded_devices", flaky_migration)
+    monkeypatch.setattr(server, "BOOTSTRAP_RETRY_DELAY", 0.05)
+
+    await server.start_services()
+    try:
+        assert server.deployment_engine._resume is not None
+        while not attempts:
+            await asyncio.sleep(0.01)
+        health = (await api.get("/api/health/db")).json()
+        assert health["bootstrap"] == "retrying"
+        assert health["bootstrap_error"] == "RuntimeError: primary stepped down"
+
+        await asyncio.wait_for(server.app.state.bootstrap, 30)
+        health = (await api.get("/api/health/db")).json()
+        assert (health["bootstrap"], health["bootstrap_error"]) == ("done", None)
+        assert await server.db.stores.count_documents({}) > 0
+    finally:
+        await server.stop_services()
@@ -0,0 +1,73 @@
+import pytest
+
+import server
+from tests.conftest import make_device, make_store
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_rollups_fall_back_without_merge(api, seed):
+    devices = [make_device(), make_device("IA"), make_device("IA", status="offline")]
+    store, = await seed([make_store(0, devices)])
+
+    stored = await server.db.stores.find_one({"id": store["id"]})
+    assert stored["rollup"]["total"] == 3
+    assert stored["rollup"]["offline"] == 1
+    assert stored["status"] == "partial"
+
+    counters = await server.fleet_snapshot.counters()
+    assert counters["total_devices"] == 3
+    assert counters["stores"]["partial"] == 1
+
+
+async def test_store_cursor_pages_cover_every_store_once(api, seed):
+    await seed([make_store(i, [make_device()]) for i in range(7)])
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 3, **({"cursor": cursor} if cursor else {})}
+        response = await api.get("/api/stores", params=params)
+        assert response.status_code == 200
+        seen += [store["sap_code"] for store in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == [f"SAP-{1000 + i}" for i in range(7)]
+
+
+async def test_device_cursor_pages_cover_every_device_once(api, seed):
+    await seed([make_store(i, [make_device() for _ in range(3)]) for i in range(4)])
+
+    seen, cursor = [], None
+    while True:
+        params = {"limit": 5, **({"cursor": cursor} if cursor else {})}
+        response = await api.get("/api/devices", params=params)
+        seen += [device["id"] for device in response.json()]
+        cursor = response.headers.get("X-Next-Cursor")
+        if not cursor:
+            break
+    assert seen == sorted(await server.db.devices.distinct("id"))
+
+
+async def test_invalid_cursor_is_rejected(api, seed):
+    response = await api.get("/api/devices", params={"cursor": "not-a-cursor"})
+    assert response.status_code == 400
+
+
+async def test_store_update_rejects_invalid_devices(api, seed):
+    store, = await seed([make_store(0, [make_device()])])
+
+    response = await api.put(f"/api/stores/{store['id']}", json={"devices": [{"type": "IA"}]})
+    assert response.status_code == 422
+    assert await server.db.devices.count_documents({"store_id": store["id"]}) == 1
+
+
+async def test_store_detail_nests_its_devices(api, seed):
+    device = make_device("IA")
+    store, = await seed([make_store(0, [device])])
+
+    response = await api.get(f"/api/stores/{store['id']}")
+    assert response.status_code == 200
+    detail = response.json()
+    assert [d["id"] for d in detail["devices"]] == [device["id"]]
+    assert detail["location"]["coordinates"] == [store["longitude"], store["latitude"]]
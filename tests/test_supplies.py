@@ -0,0 +1,28 @@
+import json
+from datetime import datetime, timezone
+
+import pytest
+
+import server
+from tests.conftest import make_device, make_store
+
+pytestmark = pytest.mark.anyio
+
+
+async def test_retried_label_counts_consume_paper_once(api, seed):
+    device = make_device()
+    store, = await seed([make_store(0, [device])])
+    batch = json.dumps({"store_id": store["id"], "device_id": device["id"], "labels_printed": 100,
+                        "timestamp": datetime(2026, 10, 1, 9, tzinfo=timezone.utc).isoformat()})
+
+    for _ in range(2):
+        response = await api.post("/api/telemetry/batch", content=batch,
+                                  headers={"Content-Type": "application/x-ndjson"})
+        assert response.status_code == 200
+
+    line_id = server.supply_line_id(store["id"], server.SUPPLY_STORE_SKU)
+    meters_per_roll = server.SUPPLY_CATALOG[server.SUPPLY_STORE_SKU]["meters_per_roll"]
+    line = await server.db.supplies.find_one({"id": line_id})
+    assert line["rolls"] == pytest.approx(-100 * server.SUPPLY_LABEL_METERS / meters_per_roll)
+    movements = await server.db.supply_movements.find({"line_id": line_id}, {"_id": 0}).to_list(None)
+    assert [(m["kind"], m["rolls"]) for m in movements] == [("consumption", line["rolls"])]